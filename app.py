@@ -1,15 +1,43 @@
 import os
+import sys
 import json
+import hmac
+import hashlib
+import signal
 import requests
 from datetime import datetime
-from flask import Flask, request, jsonify
+from functools import wraps
+from flask import Flask, Response, request, jsonify
 from dotenv import load_dotenv
 import threading
 import time
 
+import chat_records
+from chat_search import ChatSearchIndex, parse_since
+from config import Config
+from dead_letters import DeadLetterReplayer, DeadLetterStore
+from delivery import ReadReceipts, split_reply
+from health import CachedProbe, disk_check, ping_check, upstream_status
+from history_cache import RecentHistory
+from intents import IntentRouter
+from media import GRAPH_API_BASE, MEDIA_TYPES, MediaPipeline
+from profiling import SamplingProfiler, thread_group
+from resilience import BoundedExecutor, CircuitBreaker, CircuitOpenError, Deadline, DeferredQueue
+from response_engines import RunCancelled, create_engine
+from scheduler import ConversationScheduler
+from sharding import HttpTransport, ShardRouter, UnixSocketTransport
+from shutdown import ShutdownCoordinator
+from status_store import StatusStore
+from tenants import TenantRegistry
+from thread_prewarm import ThreadPrewarmer
+from tracing import tracer
+from usage import UsageStore, parse_prices
+
 # Load environment variables
 load_dotenv()
 
+STARTED_AT = time.time()
+
 app = Flask(__name__)
 
 # Configuration
@@ -45,6 +73,7 @@ if missing_vars:
         print(f"   - {var}")
     print("   The bot may not function properly until these are set.")
 
+
 # Initialize OpenAI client with error handling
 client = None
 try:
@@ -58,27 +87,124 @@ except Exception as e:
     print(f"❌ Error initializing OpenAI client: {e}")
     print("The app will start but OpenAI features will be disabled")
 
-# WhatsApp API URL
-WHATSAPP_API_URL = f"https://graph.facebook.com/v18.0/{WHATSAPP_PHONE_NUMBER_ID}/messages"
+# WhatsApp numbers served by this deployment; .env configures the default tenant
+tenants = TenantRegistry.load(Config, WHATSAPP_TOKEN, WHATSAPP_PHONE_NUMBER_ID)
+
+# One pooled Graph API session shared by every tenant and the media downloads
+graph_session = requests.Session()
+graph_session.mount('https://', requests.adapters.HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=Config.WORKER_THREADS + Config.MEDIA_DOWNLOAD_WORKERS
+))
+
+# Per-message latency tracing
+tracer.configure(Config.TRACING_ENABLED, Config.TRACE_SAMPLE_RATE, Config.TRACE_EXPORT_PATH)
+
+# Opt-in sampling profiler (PROFILING_ENABLED or the /admin/profile endpoints)
+profiler = SamplingProfiler(Config.PROFILE_INTERVAL_MS / 1000, output_directory=Config.PROFILE_DIRECTORY)
+if Config.PROFILING_ENABLED:
+    profiler.start(Config.PROFILE_DURATION or None)
+
+# Circuit breakers around upstream APIs
+openai_breaker = CircuitBreaker('openai', Config.BREAKER_FAILURE_THRESHOLD, Config.BREAKER_RECOVERY_TIMEOUT, ignore=(RunCancelled,))
+graph_breaker = CircuitBreaker('graph', Config.BREAKER_FAILURE_THRESHOLD, Config.BREAKER_RECOVERY_TIMEOUT)
+
+# Ready-made OpenAI threads for new conversations (assistants engine only)
+thread_prewarmer = None
+if client and Config.THREAD_PREWARM_ENABLED and any(t.config.RESPONSE_ENGINE == 'assistants' for t in tenants):
+    thread_prewarmer = ThreadPrewarmer(
+        client, openai_breaker,
+        min_size=Config.THREAD_PREWARM_MIN,
+        max_size=Config.THREAD_PREWARM_MAX,
+        horizon=Config.THREAD_PREWARM_HORIZON,
+        rate_window=Config.THREAD_PREWARM_RATE_WINDOW,
+        max_age=Config.THREAD_PREWARM_MAX_AGE,
+        request_timeout=Config.OPENAI_REQUEST_TIMEOUT
+    )
+
+# Latest messages of active conversations, shared by all tenants under one memory cap
+history_cache = None
+if Config.HISTORY_CACHE_MESSAGES > 0:
+    history_cache = RecentHistory(Config.HISTORY_CACHE_MESSAGES, Config.HISTORY_CACHE_MB * 1024 * 1024)
+
+# Sent when the engine fails; the customer's message becomes a dead letter instead
+ERROR_REPLY = "I'm sorry, I encountered an error while processing your message. Please try again later."
+
+# Replies that failed for good, kept for inspection and replay
+dead_letters = DeadLetterStore(Config.DEAD_LETTER_PATH) if Config.DEAD_LETTER_ENABLED else None
+
+# Per-run token usage, for finding heavy conversations and sizing the worker pool
+usage_store = None
+if Config.USAGE_TRACKING_ENABLED:
+    usage_store = UsageStore(
+        Config.USAGE_DB_PATH,
+        Config.USAGE_RETENTION_DAYS,
+        Config.USAGE_ROLLUP_RETENTION_DAYS,
+        parse_prices(Config.USAGE_PRICES)
+    )
 
 class ChatManager:
-    def __init__(self):
+    def __init__(self, config=Config, tenant=None):
+        self.config = config
+        self.tenant = tenant
         self.active_threads = {}
-        self.chat_directory = "chats"
+        self.chat_directory = config.CHAT_DIRECTORY
         os.makedirs(self.chat_directory, exist_ok=True)
+        self.engine = create_engine(config.RESPONSE_ENGINE, client, self, config)
+        print(f"✅ Response engine: {self.engine.name} ({self.chat_directory})")
+        self.search_index = None
+        if config.SEARCH_INDEX_ENABLED:
+            self.search_index = ChatSearchIndex(config.SEARCH_INDEX_PATH)
+        chat_records.check_format(config.CHAT_RECORD_FORMAT)
+        self.record_format = config.CHAT_RECORD_FORMAT
+        self._migration_lock = threading.Lock()
+        self._migrated = set()
     
     def get_chat_file_path(self, phone_number):
-        """Get the file path for a specific phone number's chat history"""
+        """Get the file path for a specific phone number's chat history
+        
+        A legacy text chat file for the number is migrated to the record format on first use.
+        """
         safe_number = phone_number.replace('+', '').replace(' ', '')
-        return os.path.join(self.chat_directory, f"chat_{safe_number}.txt")
+        base = os.path.join(self.chat_directory, f"chat_{safe_number}")
+        
+        if safe_number not in self._migrated:
+            with self._migration_lock:
+                legacy_file = base + chat_records.EXTENSIONS['text']
+                if os.path.exists(legacy_file):
+                    chat_records.migrate_file(legacy_file, self.record_format, keep_backup=self.config.CHAT_BACKUP_ENABLED)
+                self._migrated.add(safe_number)
+        
+        return base + chat_records.EXTENSIONS[self.record_format]
     
     def save_message(self, phone_number, sender, message):
         """Save a message to the chat file"""
         chat_file = self.get_chat_file_path(phone_number)
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        record = chat_records.make_record(timestamp, sender, message)
+        
+        if history_cache is not None:
+            size_before = os.path.getsize(chat_file) if os.path.exists(chat_file) else 0
+            chat_records.append_record(chat_file, record)
+            history_cache.append(chat_file, record, size_before, os.path.getsize(chat_file))
+        else:
+            chat_records.append_record(chat_file, record)
         
-        with open(chat_file, 'a', encoding='utf-8') as f:
-            f.write(f"[{timestamp}] {sender}: {message}\n")
+        if self.search_index:
+            try:
+                self.search_index.add(phone_number, sender, message, timestamp)
+            except Exception as e:
+                print(f"⚠️  Could not index message for {phone_number}: {e}")
+    
+    def list_chats(self):
+        """List the phone numbers that have a chat file"""
+        phone_numbers = []
+        if os.path.exists(self.chat_directory):
+            for filename in os.listdir(self.chat_directory):
+                phone_number = chat_records.phone_of(filename)
+                if phone_number and phone_number not in phone_numbers:
+                    phone_numbers.append(phone_number)
+        return phone_numbers
     
     def get_or_create_thread(self, phone_number):
         """Get existing thread or create new one for a phone number"""
@@ -86,61 +212,103 @@ class ChatManager:
             raise Exception("OpenAI client not initialized")
             
         if phone_number not in self.active_threads:
-            thread = client.beta.threads.create()
-            self.active_threads[phone_number] = thread.id
-            print(f"🆕 Created new thread for {phone_number}: {thread.id}")
+            thread_id = thread_prewarmer.claim() if thread_prewarmer else None
+            if thread_id is None:
+                with tracer.span('openai.threads.create'):
+                    thread_id = client.beta.threads.create(timeout=Config.OPENAI_REQUEST_TIMEOUT).id
+            self.active_threads[phone_number] = thread_id
+            print(f"🆕 Created new thread for {phone_number}: {thread_id}")
         return self.active_threads[phone_number]
     
-    def get_assistant_response(self, phone_number, user_message):
-        """Get response from OpenAI assistant"""
+    def adopt_thread(self, phone_number, thread_id, posted):
+        """Continue a conversation on the thread a stopped worker used, where posted is already added"""
+        if self.active_threads.setdefault(phone_number, thread_id) == thread_id:
+            self.engine.restore_posted(phone_number, thread_id, posted)
+    
+    def record_usage(self, phone_number, **usage):
+        """Store the token usage, duration and poll count of a run"""
+        if usage_store:
+            usage_store.record(phone_number, tenant=self.tenant, **usage)
+    
+    def read_messages(self, phone_number, limit=None):
+        """Read the most recent messages from a phone number's chat file"""
+        chat_file = self.get_chat_file_path(phone_number)
+        if history_cache is not None:
+            return history_cache.read(chat_file, limit)
+        if not os.path.exists(chat_file):
+            return []
+        
+        if limit is not None:
+            return chat_records.tail_records(chat_file, limit)
+        return list(chat_records.iter_records(chat_file))
+    
+    def get_assistant_response(self, phone_number, user_message, deadline=None, cancel_event=None, on_part=None):
+        """Get response from the configured response engine
+        
+        Raises CircuitOpenError without calling OpenAI while the OpenAI circuit is open,
+        and RunCancelled if cancel_event is set before the reply is ready.
+        on_part is passed to streaming engines to send leading parts of the reply early.
+        """
         try:
-            thread_id = self.get_or_create_thread(phone_number)
-            
-            # Add user message to thread
-            client.beta.threads.messages.create(
-                thread_id=thread_id,
-                role="user",
-                content=user_message
-            )
-            
-            # Run the assistant
-            run = client.beta.threads.runs.create(
-                thread_id=thread_id,
-                assistant_id=OPENAI_ASSISTANT_ID
-            )
-            
-            # Wait for completion
-            while run.status in ['queued', 'in_progress']:
-                time.sleep(1)
-                run = client.beta.threads.runs.retrieve(
-                    thread_id=thread_id,
-                    run_id=run.id
-                )
-            
-            if run.status == 'completed':
-                # Get the assistant's response
-                messages = client.beta.threads.messages.list(
-                    thread_id=thread_id,
-                    order="desc",
-                    limit=1
+            with tracer.span('get_assistant_response', engine=self.engine.name):
+                response = openai_breaker.call(
+                    self.engine.get_response, phone_number, user_message,
+                    deadline=deadline, cancel_event=cancel_event, on_part=on_part
                 )
-                
-                if messages.data:
-                    response = messages.data[0].content[0].text.value
-                    return response
-            
-            return "I apologize, but I'm having trouble processing your request right now. Please try again."
+            if response:
+                return response
+            error = "The engine produced no reply"
             
+        except (CircuitOpenError, RunCancelled):
+            raise
         except Exception as e:
-            print(f"Error getting assistant response: {e}")
-            return "I'm sorry, I encountered an error while processing your message. Please try again later."
+            # Includes RunFailed: runs that ended failed, expired or incomplete
+            error = f"{type(e).__name__}: {e}"
+        
+        print(f"Error getting assistant response: {error}")
+        if dead_letters:
+            dead_letters.add('reply_failed', phone_number, self.tenant, message=user_message, error=error)
+        return ERROR_REPLY
+
+for tenant in tenants:
+    tenant.chat_manager = ChatManager(tenant.config, tenant.name)
+    tenant.intent_router = IntentRouter.load(
+        tenant.config.INTENT_RULES_FILE,
+        os.path.join(tenant.config.CHAT_DIRECTORY, 'opt_outs.jsonl')
+    )
+chat_manager = tenants.default.chat_manager
+
+# Webhook payloads are signed with the app secret (X-Hub-Signature-256); tenants may belong to other apps
+TENANT_APP_SECRETS = {}
+for tenant in tenants:
+    secret = tenant.config.WHATSAPP_APP_SECRET
+    TENANT_APP_SECRETS[tenant.name] = secret.encode('utf-8') if secret and not secret.startswith('your_') else None
+APP_SECRET_KEYS = list({secret for secret in TENANT_APP_SECRETS.values() if secret})
+if APP_SECRET_KEYS:
+    print("✅ WHATSAPP_APP_SECRET: webhook signature verification enabled")
+else:
+    print("⚠️  WHATSAPP_APP_SECRET not set: webhook signatures will NOT be verified")
+status_store = StatusStore(Config.STATUS_STORE_CAPACITY)
 
-chat_manager = ChatManager()
+# Why the last send on this thread failed, for dead letters
+send_errors = threading.local()
 
-def send_whatsapp_message(phone_number, message):
-    """Send a message via WhatsApp Business API"""
+def known_tenant(name, phone_number, action):
+    """Tenant a queued or persisted job belongs to, or None (logged) if it was removed from the config"""
+    tenant = tenants.get(name)
+    if tenant is None:
+        print(f"⚠️  Tenant '{name}' is no longer configured, dropping {action} for {phone_number}")
+    return tenant
+
+def send_whatsapp_message(phone_number, message, tenant=None):
+    """Send a message via WhatsApp Business API from the tenant's number (default tenant if None)"""
+    send_errors.last = None
+    sender = known_tenant(tenant, phone_number, 'message')
+    if sender is None:
+        send_errors.last = f"Unknown tenant '{tenant}'"
+        return False
     headers = {
-        'Authorization': f'Bearer {WHATSAPP_TOKEN}',
+        'Authorization': f'Bearer {sender.whatsapp_token}',
         'Content-Type': 'application/json'
     }
     
@@ -153,29 +321,397 @@ def send_whatsapp_message(phone_number, message):
         }
     }
     
-    try:
-        print(f"📤 Sending message to {phone_number}: {message[:50]}...")
-        response = requests.post(WHATSAPP_API_URL, headers=headers, json=data)
+    with tracer.span('whatsapp.send', phone_number=phone_number, message_length=len(message)) as span:
+        try:
+            print(f"📤 Sending message to {phone_number}: {message[:50]}...")
+            response = graph_breaker.call_http(
+                graph_session.post, sender.api_url, headers=headers, json=data, timeout=Config.GRAPH_REQUEST_TIMEOUT
+            )
+            span.set_attribute('http_status_code', response.status_code)
         
-        # Log detailed response information
-        print(f"📊 WhatsApp API Response Status: {response.status_code}")
-        print(f"📊 WhatsApp API Response Headers: {dict(response.headers)}")
+            # Log detailed response information
+            print(f"📊 WhatsApp API Response Status: {response.status_code}")
+            print(f"📊 WhatsApp API Response Headers: {dict(response.headers)}")
         
-        if response.status_code == 200:
-            response_data = response.json()
-            print(f"✅ Message sent successfully: {response_data}")
-            return True
-        else:
-            print(f"❌ WhatsApp API Error: {response.status_code}")
-            print(f"❌ Error Response: {response.text}")
-            return False
+            if response.status_code == 200:
+                response_data = response.json()
+                print(f"✅ Message sent successfully: {response_data}")
+                return True
+            else:
+                print(f"❌ WhatsApp API Error: {response.status_code}")
+                print(f"❌ Error Response: {response.text}")
+                send_errors.last = f"HTTP {response.status_code}: {response.text[:500]}"
+                return False
             
+        except CircuitOpenError:
+            print(f"🚫 Graph API circuit open, not sending message to {phone_number}")
+            span.set_attribute('circuit_open', True)
+            send_errors.last = "Graph API circuit open"
+            return False
+        except requests.exceptions.RequestException as e:
+            print(f"❌ Network error sending WhatsApp message: {e}")
+            send_errors.last = f"{type(e).__name__}: {e}"
+            return False
+        except Exception as e:
+            print(f"❌ Unexpected error sending WhatsApp message: {e}")
+            send_errors.last = f"{type(e).__name__}: {e}"
+            return False
+
+def send_read_receipt(tenant, phone_number, wamid, typing=False):
+    """Mark an inbound message as read, optionally showing the typing indicator"""
+    sender = known_tenant(tenant, phone_number, 'read receipt')
+    if sender is None:
+        return False
+    headers = {
+        'Authorization': f'Bearer {sender.whatsapp_token}',
+        'Content-Type': 'application/json'
+    }
+    
+    data = {
+        "messaging_product": "whatsapp",
+        "status": "read",
+        "message_id": wamid
+    }
+    if typing:
+        data["typing_indicator"] = {"type": "text"}
+    
+    try:
+        response = graph_breaker.call_http(
+            graph_session.post, sender.api_url, headers=headers, json=data, timeout=Config.GRAPH_REQUEST_TIMEOUT
+        )
+    except CircuitOpenError:
+        return False
     except requests.exceptions.RequestException as e:
-        print(f"❌ Network error sending WhatsApp message: {e}")
+        print(f"⚠️  Could not mark message from {phone_number} as read: {e}")
         return False
-    except Exception as e:
-        print(f"❌ Unexpected error sending WhatsApp message: {e}")
+    
+    if response.status_code != 200:
+        print(f"⚠️  Read receipt for {phone_number} failed: {response.status_code} {response.text}")
         return False
+    return True
+
+# Read receipts and typing indicators go out on their own threads, ahead of the reply
+read_receipts = ReadReceipts(send_read_receipt) if Config.READ_RECEIPTS_ENABLED else None
+
+def process_message(phone_number, message_text, cancel_event=None, trace_spans=(), tenant=None):
+    """Generate and send the reply to an incoming message (runs on a worker thread)
+    
+    The reply is abandoned if cancel_event is set, i.e. a newer message arrived.
+    trace_spans are the inbound-message spans of the messages being answered.
+    tenant is the name of the tenant whose number received the message.
+    """
+    parent = trace_spans[-1] if trace_spans else None
+    with tracer.span('process_message', parent=parent, phone_number=phone_number, tenant=tenant, batched_messages=len(trace_spans)) as span:
+        if parent is not None and parent.sampled and parent.end_time:
+            span.set_attribute('queue_wait_ms', round((time.time_ns() - parent.end_time) / 1e6, 3))
+        try:
+            print(f"🔄 Processing message from {phone_number}: {message_text}")
+            receiver = known_tenant(tenant, phone_number, 'reply')
+            if receiver is None:
+                span.set_attribute('outcome', 'unknown_tenant')
+                return
+            tenant_chats = receiver.chat_manager
+            
+            # Paragraphs of a streamed reply are sent as soon as they are complete
+            streamed = []
+            
+            def send_part(part):
+                streamed.append(part)
+                # A single paragraph can still exceed WhatsApp's message size
+                for piece in split_reply(part):
+                    tenant_chats.save_message(phone_number, "Assistant", piece)
+                    deliver_reply(phone_number, piece, tenant)
+            
+            # Get assistant response
+            deadline = Deadline(Config.REPLY_DEADLINE)
+            try:
+                response = tenant_chats.get_assistant_response(
+                    phone_number, message_text, deadline, cancel_event,
+                    on_part=send_part if Config.PROGRESSIVE_REPLIES else None
+                )
+            except CircuitOpenError:
+                span.set_attribute('outcome', 'deferred')
+                defer_reply(phone_number, message_text, tenant)
+                return
+            except RunCancelled:
+                if shutdown_coordinator.draining:
+                    span.set_attribute('outcome', 'persisted')
+                    print(f"💾 Reply to {phone_number} cancelled for shutdown, message persisted")
+                    return
+                span.set_attribute('outcome', 'superseded')
+                print(f"⏭️  Reply to {phone_number} superseded by a newer message")
+                return
+            
+            if cancel_event is not None and cancel_event.is_set():
+                span.set_attribute('outcome', 'superseded')
+                print(f"⏭️  Discarding outdated reply to {phone_number}")
+                return
+            print(f"🤖 Assistant response: {response[:100]}...")
+            
+            sent_text = ''.join(streamed)
+            if sent_text and response.startswith(sent_text):
+                response = response[len(sent_text):]
+            
+            # Save and send the rest of the response, in WhatsApp-sized parts
+            delivered = True
+            parts = split_reply(response)
+            for part in parts:
+                tenant_chats.save_message(phone_number, "Assistant", part)
+                delivered = deliver_reply(phone_number, part, tenant) and delivered
+            span.set_attribute('reply_parts', len(streamed) + len(parts))
+            span.set_attribute('outcome', 'sent' if delivered else 'send_failed')
+                
+        except Exception as e:
+            span.set_attribute('outcome', 'error')
+            print(f"❌ Error in background message processing: {e}")
+            import traceback
+            traceback.print_exc()
+
+def deliver_reply(phone_number, message, tenant=None):
+    """Send a reply, deferring it for retry if the Graph API circuit is open"""
+    degraded_phones.discard((tenant, phone_number))
+    success = send_whatsapp_message(phone_number, message, tenant)
+    if success:
+        print(f"✅ Successfully sent response to {phone_number}")
+    else:
+        print(f"❌ Failed to send response to {phone_number}")
+        if graph_breaker.state != CircuitBreaker.CLOSED and deferred_sends.push({'phone_number': phone_number, 'message': message, 'tenant': tenant}):
+            print(f"⏳ Deferred reply to {phone_number} until the Graph API recovers")
+        elif dead_letters and message != ERROR_REPLY:
+            dead_letters.add('send_failed', phone_number, tenant, reply=message, error=getattr(send_errors, 'last', None))
+    return success
+
+def defer_reply(phone_number, message_text, tenant=None):
+    """Queue a message for a later reply and tell the user once that we're running behind"""
+    receiver = known_tenant(tenant, phone_number, 'deferred reply')
+    if receiver is None:
+        return
+    if deferred_replies.push({'phone_number': phone_number, 'message': message_text, 'tenant': tenant}):
+        print(f"⏳ Deferred message from {phone_number} until OpenAI recovers")
+    else:
+        print(f"❌ Deferred queue full, dropping message from {phone_number}")
+        if dead_letters:
+            dead_letters.add('reply_failed', phone_number, tenant, message=message_text, error="Deferred queue full")
+    
+    if (tenant, phone_number) not in degraded_phones:
+        degraded_phones.add((tenant, phone_number))
+        send_whatsapp_message(phone_number, receiver.config.DEGRADED_REPLY, tenant)
+
+def submit_reply_job(phone_number, message_text, trace_span=None, tenant=None):
+    """Schedule a reply to a message, deferring it when the worker pool is saturated"""
+    if openai_breaker.state == CircuitBreaker.OPEN:
+        # While OpenAI is down the worker only queues the message and sends the canned reply
+        accepted = worker_pool.submit(defer_reply, phone_number, message_text, tenant)
+    else:
+        accepted = scheduler.submit(phone_number, message_text, trace_span, tenant)
+    if accepted:
+        return True
+    
+    print(f"⚠️  Worker pool saturated, deferring message from {phone_number}")
+    if not deferred_replies.push({'phone_number': phone_number, 'message': message_text, 'tenant': tenant}) and dead_letters:
+        dead_letters.add('reply_failed', phone_number, tenant, message=message_text, error="Worker pool saturated and deferred queue full")
+    return False
+
+def extract_message_text(message):
+    """Get the text of a text message or an interactive/button reply"""
+    message_type = message.get('type', 'text')
+    if message_type == 'interactive':
+        interactive = message.get('interactive', {})
+        reply = interactive.get('button_reply') or interactive.get('list_reply') or {}
+        return reply.get('title', '')
+    if message_type == 'button':
+        return message.get('button', {}).get('text', '')
+    return message.get('text', {}).get('body', '')
+
+def handle_incoming_message(message, tenant=None):
+    """Route one inbound webhook message to the media pipeline or the reply scheduler"""
+    phone_number = message['from']
+    message_type = message.get('type', 'text')
+    receiver = known_tenant(tenant, phone_number, 'inbound message')
+    if receiver is None:
+        return
+    
+    # One trace per inbound message, keyed by its wamid
+    with tracer.trace('whatsapp.inbound', key=message.get('id'), wamid=message.get('id'), phone_number=phone_number, tenant=receiver.name, message_type=message_type) as trace_span:
+        if read_receipts:
+            read_receipts.received(phone_number, message.get('id'), tenant)
+        
+        if message_type in MEDIA_TYPES:
+            print(f"📎 Incoming {message_type} from {phone_number}")
+            acknowledge(phone_number, tenant)  # The download may take a while
+            if not media_pipeline.submit(phone_number, message, trace_span, receiver.whatsapp_token, tenant):
+                print(f"⚠️  Media download pool full, replying to {phone_number} without the {message_type}")
+                accept_user_message(phone_number, media_pipeline.describe(message_type, message.get(message_type, {}), ''), trace_span, tenant)
+            return
+        
+        message_text = extract_message_text(message)
+        
+        print(f"📱 Incoming message from {phone_number}: {message_text}")
+        
+        if message_text:
+            accept_user_message(phone_number, message_text, trace_span, tenant)
+
+def acknowledge(phone_number, tenant=None, typing=False):
+    """Mark the conversation as read, with the typing indicator if a reply is on its way"""
+    if read_receipts:
+        read_receipts.mark_read(phone_number, tenant, typing and Config.TYPING_INDICATOR_ENABLED)
+
+def accept_user_message(phone_number, message_text, trace_span=None, tenant=None):
+    """Save an incoming message and schedule the reply, unless the sender is over the rate limit
+    
+    Messages matching an intent rule are answered locally without an assistant run.
+    """
+    receiver = tenants.get(tenant)
+    
+    # Save incoming message
+    receiver.chat_manager.save_message(phone_number, "User", message_text)
+    
+    intent = receiver.intent_router.route(phone_number, message_text) if receiver.intent_router else None
+    if intent is not None:
+        if trace_span is not None:
+            trace_span.set_attribute('intent', intent.name)
+        print(f"🧭 Matched intent '{intent.name}' ({intent.action}) for {phone_number}")
+        if intent.reply:
+            receiver.chat_manager.save_message(phone_number, "Assistant", intent.reply)
+            if not worker_pool.submit(deliver_reply, phone_number, intent.reply, tenant):
+                deferred_sends.push({'phone_number': phone_number, 'message': intent.reply, 'tenant': tenant})
+        acknowledge(phone_number, tenant)
+        return
+    
+    if not receiver.allow_message(phone_number):
+        print(f"🚦 {phone_number} is over the {receiver.name} rate limit, not replying")
+        acknowledge(phone_number, tenant)
+        return
+    
+    acknowledge(phone_number, tenant, typing=True)
+    
+    # Process message on the worker pool to avoid timeout
+    submit_reply_job(phone_number, message_text, trace_span, tenant)
+
+# Bounded background processing
+worker_pool = BoundedExecutor(Config.WORKER_THREADS, Config.MAX_PENDING_JOBS, name='reply-worker')
+scheduler = ConversationScheduler(worker_pool, process_message)
+degraded_phones = set()
+deferred_replies = DeferredQueue(
+    openai_breaker,
+    lambda job: scheduler.submit(job['phone_number'], job['message'], tenant=job.get('tenant')),
+    maxlen=Config.DEFERRED_QUEUE_SIZE,
+    interval=Config.DEFERRED_RETRY_INTERVAL
+)
+media_pipeline = MediaPipeline(Config, WHATSAPP_TOKEN, graph_breaker, accept_user_message, client=client, session=graph_session)
+deferred_sends = DeferredQueue(
+    graph_breaker,
+    lambda job: worker_pool.submit(deliver_reply, job['phone_number'], job['message'], job.get('tenant')),
+    maxlen=Config.DEFERRED_QUEUE_SIZE,
+    interval=Config.DEFERRED_RETRY_INTERVAL
+)
+dead_letter_replayer = None
+if dead_letters:
+    dead_letter_replayer = DeadLetterReplayer(dead_letters, {
+        'reply_failed': (lambda entry: scheduler.submit(entry['phone_number'], entry['message'], tenant=entry['tenant']), openai_breaker),
+        'send_failed': (lambda entry: worker_pool.submit(deliver_reply, entry['phone_number'], entry['reply'], entry['tenant']), graph_breaker),
+    }, rate=Config.DEAD_LETTER_REPLAY_RATE)
+
+def ping_openai():
+    """Cheapest authenticated OpenAI call, used when no reply has succeeded recently"""
+    if not client:
+        raise Exception("OpenAI client not initialized")
+    client.models.list(timeout=Config.HEALTH_PROBE_TIMEOUT)
+
+def ping_graph():
+    """Look up our own phone number ID, used when no message has been sent recently"""
+    response = graph_session.get(
+        f"{GRAPH_API_BASE}/{WHATSAPP_PHONE_NUMBER_ID}",
+        headers={'Authorization': f'Bearer {WHATSAPP_TOKEN}'},
+        params={'fields': 'id'},
+        timeout=Config.HEALTH_PROBE_TIMEOUT
+    )
+    response.raise_for_status()
+
+# Cached probes for /health/ready; circuit state is read live
+openai_ping = CachedProbe('openai', ping_check(ping_openai), Config.HEALTH_PROBE_INTERVAL)
+graph_ping = CachedProbe('graph', ping_check(ping_graph), Config.HEALTH_PROBE_INTERVAL)
+disk_paths = [tenant.chat_manager.chat_directory for tenant in tenants] + [Config.MEDIA_DIRECTORY]
+disk_probe = CachedProbe('disk', disk_check(disk_paths, Config.HEALTH_MIN_FREE_MB * 1024 * 1024), Config.HEALTH_CACHE_SECONDS)
+
+def handle_routed_message(payload):
+    """Handle a message whose conversation this process owns"""
+    handle_incoming_message(payload['message'], payload['tenant'])
+
+def create_shard_router():
+    """Conversation shard router for SHARDING_MODE, or None when sharding is off"""
+    if Config.SHARDING_MODE == 'local':
+        shards = [f"shard-{index}" for index in range(Config.SHARD_COUNT)]
+        transport = UnixSocketTransport(Config.SHARD_DIRECTORY, Config.SHARD_FORWARD_TIMEOUT)
+    elif Config.SHARDING_MODE == 'http':
+        peers = dict(pair.strip().split('=', 1) for pair in Config.SHARD_PEERS.split(',') if pair.strip())
+        if Config.SHARD_SELF not in peers or not Config.SHARD_SECRET:
+            raise ValueError("SHARDING_MODE=http needs SHARD_SECRET and SHARD_SELF listed in SHARD_PEERS")
+        shards = list(peers)
+        transport = HttpTransport(peers, Config.SHARD_SELF, Config.SHARD_SECRET, Config.SHARD_FORWARD_TIMEOUT)
+    elif Config.SHARDING_MODE == 'off':
+        return None
+    else:
+        raise ValueError(f"Unknown SHARDING_MODE '{Config.SHARDING_MODE}'. Use 'off', 'local' or 'http'")
+    return ShardRouter(shards, transport, handle_routed_message)
+
+shard_router = create_shard_router()
+
+# Graceful shutdown: drain, persist unanswered messages, flush writers
+shutdown_coordinator = ShutdownCoordinator(Config.SHUTDOWN_DEADLINE, Config.SHUTDOWN_JOURNAL_DIRECTORY, Config.JOURNAL_RECOVERY_INTERVAL)
+if shard_router:
+    shutdown_coordinator.on_drain(shard_router.close)
+shutdown_coordinator.on_drain(scheduler.close)
+if read_receipts:
+    shutdown_coordinator.on_drain(read_receipts.close)
+shutdown_coordinator.wait_for(worker_pool)
+shutdown_coordinator.wait_for(media_pipeline.pool)
+
+def unanswered_replies():
+    """Cancelled and deferred reply jobs, noting text a cancelled run already added to its thread"""
+    posted = {
+        (tenant.name, phone_number): entry
+        for tenant in tenants
+        for phone_number, entry in tenant.chat_manager.engine.posted_messages().items()
+    }
+    jobs = scheduler.cancel_all()
+    for job in jobs:
+        entry = posted.get((job['tenant'], job['phone_number']))
+        if entry is not None and job['message'].startswith(entry[1]):
+            job['thread_id'], job['posted'] = entry
+    return jobs + deferred_replies.drain()
+
+def restore_reply(job):
+    """Requeue a journalled reply job on the thread its message was already added to"""
+    receiver = tenants.get(job.get('tenant'))
+    if job.get('thread_id') and receiver is not None:
+        receiver.chat_manager.adopt_thread(job['phone_number'], job['thread_id'], job['posted'])
+    return deferred_replies.push(job)
+
+shutdown_coordinator.persist('replies', unanswered_replies, restore_reply)
+shutdown_coordinator.persist('sends', deferred_sends.drain, deferred_sends.push)
+shutdown_coordinator.on_flush('traces', tracer.exporter.flush)
+shutdown_coordinator.on_flush('profiler', profiler.stop)
+if thread_prewarmer:
+    shutdown_coordinator.on_flush('pre-warmed threads', thread_prewarmer.stop)
+for tenant in tenants:
+    if tenant.chat_manager.search_index:
+        shutdown_coordinator.on_flush(f"{tenant.name} search index", tenant.chat_manager.search_index.checkpoint)
+
+def start_serving():
+    """Start the background work of a process that answers webhooks
+    
+    Called from gunicorn's post_worker_init hook, or below when run directly,
+    so that scripts importing this module never claim a conversation shard,
+    claim persisted jobs, replay dead letters or create OpenAI threads.
+    """
+    if shard_router:
+        shard_router.start()
+    shutdown_coordinator.start_recovery()
+    if thread_prewarmer:
+        thread_prewarmer.start()
+    if dead_letter_replayer:
+        dead_letter_replayer.start()
 
 @app.route('/webhook', methods=['GET'])
 def verify_webhook():
@@ -189,56 +725,64 @@ def verify_webhook():
     else:
         return 'Forbidden', 403
 
+SIGNATURE_PREFIX = 'sha256='
+SIGNATURE_LENGTH = len(SIGNATURE_PREFIX) + hashlib.sha256().digest_size * 2
+
+def signing_secrets(raw_body, signature_header):
+    """App secrets whose HMAC-SHA256 of the raw request body matches X-Hub-Signature-256
+    
+    Tenants may belong to different Meta apps, so every configured secret is
+    tried; the webhook then accepts each message only if its tenant's own
+    secret is among the matches.
+    """
+    # Reject malformed headers before doing any hashing
+    if not signature_header or len(signature_header) != SIGNATURE_LENGTH or not signature_header.startswith(SIGNATURE_PREFIX):
+        return set()
+    signature = signature_header[len(SIGNATURE_PREFIX):]
+    return {
+        key for key in APP_SECRET_KEYS
+        if hmac.compare_digest(hmac.new(key, raw_body, hashlib.sha256).hexdigest(), signature)
+    }
+
 @app.route('/webhook', methods=['POST'])
 def webhook():
     """Handle incoming WhatsApp messages"""
+    # Authenticate the raw bytes before parsing anything
+    if request.content_length is not None and request.content_length > Config.MAX_WEBHOOK_BYTES:
+        return jsonify({'status': 'payload too large'}), 413
+    raw_body = request.get_data()
+    signed_with = signing_secrets(raw_body, request.headers.get('X-Hub-Signature-256')) if APP_SECRET_KEYS else None
+    if signed_with is not None and not signed_with:
+        return jsonify({'status': 'invalid signature'}), 403
+    
     try:
-        data = request.get_json()
-        print(f"📨 Received webhook data: {json.dumps(data, indent=2)}")
+        data = json.loads(raw_body)
         
-        if 'entry' in data:
-            for entry in data['entry']:
-                if 'changes' in entry:
-                    for change in entry['changes']:
-                        if 'value' in change and 'messages' in change['value']:
-                            for message in change['value']['messages']:
-                                phone_number = message['from']
-                                message_text = message.get('text', {}).get('body', '')
-                                
-                                print(f"📱 Incoming message from {phone_number}: {message_text}")
-                                
-                                if message_text:
-                                    # Save incoming message
-                                    chat_manager.save_message(phone_number, "User", message_text)
-                                    
-                                    # Process message in background to avoid timeout
-                                    def process_message():
-                                        try:
-                                            print(f"🔄 Processing message from {phone_number}: {message_text}")
-                                            
-                                            # Get assistant response
-                                            response = chat_manager.get_assistant_response(phone_number, message_text)
-                                            print(f"🤖 Assistant response: {response[:100]}...")
-                                            
-                                            # Save assistant response
-                                            chat_manager.save_message(phone_number, "Assistant", response)
-                                            
-                                            # Send response via WhatsApp
-                                            success = send_whatsapp_message(phone_number, response)
-                                            if success:
-                                                print(f"✅ Successfully sent response to {phone_number}")
-                                            else:
-                                                print(f"❌ Failed to send response to {phone_number}")
-                                                
-                                        except Exception as e:
-                                            print(f"❌ Error in background message processing: {e}")
-                                            import traceback
-                                            traceback.print_exc()
-                                    
-                                    # Run in background thread
-                                    thread = threading.Thread(target=process_message)
-                                    thread.daemon = True  # Ensure thread doesn't prevent app shutdown
-                                    thread.start()
+        for entry in data.get('entry', []):
+            for change in entry.get('changes', []):
+                value = change.get('value', {})
+                
+                # Delivery/read callbacks are recorded compactly, without payload logging
+                if 'statuses' in value:
+                    status_store.record_all(value['statuses'])
+                
+                if 'messages' in value:
+                    print(f"📨 Received webhook data: {json.dumps(value, indent=2)}")
+                    phone_number_id = value.get('metadata', {}).get('phone_number_id')
+                    tenant = tenants.resolve(phone_number_id)
+                    if tenant is None:
+                        print(f"⚠️  No tenant for phone_number_id {phone_number_id}, ignoring {len(value['messages'])} message(s)")
+                        continue
+                    if signed_with is not None and TENANT_APP_SECRETS[tenant.name] not in signed_with:
+                        # Signed by another tenant's app: it cannot speak for this number
+                        print(f"⚠️  Signature does not match the app secret of {tenant.name}, ignoring {len(value['messages'])} message(s)")
+                        continue
+                    for message in value['messages']:
+                        if shard_router:
+                            # Hand the message to the process that owns this conversation
+                            shard_router.dispatch(f"{tenant.name}:{message.get('from')}", {'tenant': tenant.name, 'message': message})
+                        else:
+                            handle_incoming_message(message, tenant.name)
         
         return jsonify({'status': 'success'}), 200
     
@@ -246,6 +790,17 @@ def webhook():
         print(f"Error processing webhook: {e}")
         return jsonify({'status': 'error'}), 500
 
+@app.route('/internal/shard', methods=['POST'])
+def receive_shard_message():
+    """Accept a message forwarded by another shard (SHARDING_MODE=http)"""
+    if shard_router is None or Config.SHARDING_MODE != 'http':
+        return jsonify({'error': 'HTTP sharding is not enabled'}), 404
+    provided = request.headers.get('X-Shard-Secret', '')
+    if not hmac.compare_digest(provided.encode(), Config.SHARD_SECRET.encode()):
+        return jsonify({'error': 'Invalid shard secret'}), 403
+    shard_router.receive(request.get_json())
+    return jsonify({'status': 'ok'})
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
@@ -255,17 +810,153 @@ def health_check():
         'service': 'WhatsApp ChatBot'
     })
 
+def worker_threads():
+    """Live threads of this process, grouped by pool name"""
+    groups = {}
+    for thread in threading.enumerate():
+        group = thread_group(thread.name)
+        groups[group] = groups.get(group, 0) + 1
+    return groups
+
+def readiness_report():
+    """Dependency and backlog checks behind /health/ready"""
+    pool = worker_pool.get_stats()
+    backlog_limit = int(pool['max_pending'] * Config.HEALTH_MAX_BACKLOG_RATIO)
+    checks = {
+        'openai': upstream_status(openai_breaker, openai_ping, Config.HEALTH_PROBE_INTERVAL),
+        'graph': upstream_status(graph_breaker, graph_ping, Config.HEALTH_PROBE_INTERVAL),
+        'disk': disk_probe.get(),
+        'backlog': {
+            'ok': pool['pending'] < backlog_limit,
+            'pending_jobs': pool['pending'],
+            'limit': backlog_limit,
+            'pending_messages': scheduler.get_stats()['pending_messages'],
+            'deferred_replies': deferred_replies.get_stats()['queued'],
+            'deferred_sends': deferred_sends.get_stats()['queued'],
+        },
+    }
+    return {
+        'ok': all(check['ok'] for check in checks.values()),
+        'checks': checks,
+        'in_flight_runs': sum(tenant.chat_manager.engine.in_flight() for tenant in tenants),
+        'worker_threads': worker_threads(),
+    }
+
+readiness_probe = CachedProbe('ready', readiness_report, Config.HEALTH_CACHE_SECONDS)
+
+@app.route('/health/live', methods=['GET'])
+def liveness_check():
+    """Liveness: the process is up and serving requests"""
+    return jsonify({
+        'status': 'alive',
+        'timestamp': datetime.now().isoformat(),
+        'pid': os.getpid(),
+        'uptime_seconds': round(time.time() - STARTED_AT, 1),
+        'threads': threading.active_count()
+    })
+
+@app.route('/health/ready', methods=['GET'])
+def readiness_check():
+    """Readiness: upstream APIs reachable, disk headroom and backlog within limits"""
+    report = readiness_probe.get()
+    ready = report['ok'] and not shutdown_coordinator.draining
+    return jsonify({
+        'status': 'ready' if ready else 'draining' if shutdown_coordinator.draining else 'not_ready',
+        'timestamp': datetime.now().isoformat(),
+        **{key: value for key, value in report.items() if key != 'ok'}
+    }), 200 if ready else 503
+
+@app.route('/resilience-stats', methods=['GET'])
+def get_resilience_stats():
+    """Get circuit breaker, worker pool and deferred queue statistics"""
+    return jsonify({
+        'circuits': {
+            'openai': openai_breaker.get_stats(),
+            'graph': graph_breaker.get_stats()
+        },
+        'worker_pool': worker_pool.get_stats(),
+        'scheduler': scheduler.get_stats(),
+        'deferred_replies': deferred_replies.get_stats(),
+        'deferred_sends': deferred_sends.get_stats(),
+        'media': media_pipeline.get_stats(),
+        'tracing': tracer.get_stats(),
+        'shutdown': shutdown_coordinator.get_stats(),
+        'sharding': shard_router.get_stats() if shard_router else None,
+        'thread_prewarm': thread_prewarmer.get_stats() if thread_prewarmer else None,
+        'history_cache': history_cache.get_stats() if history_cache else None
+    })
+
+@app.route('/engine-stats', methods=['GET'])
+def get_engine_stats():
+    """Get response engine statistics of the default tenant, or of ?tenant=name"""
+    tenant = tenants.get(request.args.get('tenant'))
+    if tenant is None:
+        return jsonify({'error': 'Unknown tenant'}), 404
+    return jsonify(tenant.chat_manager.engine.get_stats())
+
+@app.route('/tenants', methods=['GET'])
+def get_tenants():
+    """List the configured tenants with their rate limit and intent routing counters"""
+    return jsonify({tenant.name: tenant.get_stats() for tenant in tenants})
+
+def requested_chat_manager():
+    """Chat manager of the ?tenant= query parameter (default tenant if absent), or None if unknown"""
+    tenant = tenants.get(request.args.get('tenant'))
+    return tenant.chat_manager if tenant else None
+
+@app.route('/usage', methods=['GET'])
+def get_usage():
+    """Hourly token usage and run time over the last ?hours= (default 24), optionally for ?tenant="""
+    if not usage_store:
+        return jsonify({'error': 'Usage tracking is disabled'}), 503
+    hours = min(24 * Config.USAGE_ROLLUP_RETENTION_DAYS, max(1, request.args.get('hours', 24, type=int)))
+    return jsonify({'hours': hours, 'hourly': usage_store.hourly_totals(hours, request.args.get('tenant'))})
+
+@app.route('/usage/top', methods=['GET'])
+def get_usage_top():
+    """Heaviest conversations over the last ?hours=, by ?sort= (default prompt_tokens)"""
+    if not usage_store:
+        return jsonify({'error': 'Usage tracking is disabled'}), 503
+    hours = min(24 * Config.USAGE_ROLLUP_RETENTION_DAYS, max(1, request.args.get('hours', 24, type=int)))
+    limit = min(200, max(1, request.args.get('limit', 20, type=int)))
+    try:
+        conversations = usage_store.top_conversations(
+            hours, limit, request.args.get('sort', 'prompt_tokens'), request.args.get('tenant')
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'hours': hours, 'conversations': conversations})
+
+@app.route('/message-status/<wamid>', methods=['GET'])
+def get_message_status(wamid):
+    """Get the delivery status of an outbound message"""
+    record = status_store.get(wamid)
+    if record is None:
+        return jsonify({'wamid': wamid, 'status': 'No status found'}), 404
+    return jsonify(record)
+
+@app.route('/delivery-stats', methods=['GET'])
+def get_delivery_stats():
+    """Get aggregated delivery and read latency statistics"""
+    stats = status_store.get_stats()
+    stats['read_receipts'] = read_receipts.get_stats() if read_receipts else None
+    return jsonify(stats)
+
 @app.route('/chat-history/<phone_number>', methods=['GET'])
 def get_chat_history(phone_number):
     """Get chat history for a specific phone number"""
+    chat_manager = requested_chat_manager()
+    if chat_manager is None:
+        return jsonify({'error': 'Unknown tenant'}), 404
     try:
         chat_file = chat_manager.get_chat_file_path(phone_number)
         if os.path.exists(chat_file):
-            with open(chat_file, 'r', encoding='utf-8') as f:
-                content = f.read()
+            limit = request.args.get('limit', type=int)
+            messages = chat_manager.read_messages(phone_number, limit=limit)
             return jsonify({
                 'phone_number': phone_number,
-                'chat_history': content
+                'chat_history': ''.join(f"[{m['timestamp']}] {m['sender']}: {m['message']}\n" for m in messages),
+                'messages': [{'timestamp': m['timestamp'], 'sender': m['sender'], 'message': m['message']} for m in messages]
             })
         else:
             return jsonify({
@@ -275,16 +966,159 @@ def get_chat_history(phone_number):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def require_admin_key(view):
+    """Require the X-API-Key header on admin endpoints, whatever API_KEY_REQUIRED says
+    
+    Admin endpoints expose customer messages and can trigger paid runs, so
+    they are disabled (503) until API_KEY is configured.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not Config.API_KEY or Config.API_KEY.startswith('your_'):
+            return jsonify({'error': 'Admin endpoints are disabled until API_KEY is set'}), 503
+        provided = request.headers.get('X-API-Key', '')
+        if not hmac.compare_digest(provided.encode(), Config.API_KEY.encode()):
+            return jsonify({'error': 'Invalid or missing API key'}), 401
+        return view(*args, **kwargs)
+    return wrapper
+
+@app.route('/chat-search', methods=['GET'])
+@require_admin_key
+def search_chats():
+    """Full-text search over chat histories"""
+    chat_manager = requested_chat_manager()
+    if chat_manager is None:
+        return jsonify({'error': 'Unknown tenant'}), 404
+    if not chat_manager.search_index:
+        return jsonify({'error': 'Chat search is disabled'}), 503
+    
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': "Missing search query 'q'"}), 400
+    
+    phone_number = request.args.get('phone')
+    try:
+        since = parse_since(request.args['since']) if request.args.get('since') else None
+        page = max(1, int(request.args.get('page', 1)))
+        per_page = min(100, max(1, int(request.args.get('per_page', 20))))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        total, results = chat_manager.search_index.search(query, phone_number=phone_number, since=since, page=page, per_page=per_page)
+        return jsonify({
+            'query': query,
+            'phone_number': phone_number,
+            'since': since,
+            'page': page,
+            'per_page': per_page,
+            'total': total,
+            'results': results
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/admin/profile', methods=['GET'])
+@require_admin_key
+def get_profile():
+    """Profiler state and the heaviest functions by CPU (or ?sort=wall) time"""
+    sort = request.args.get('sort', 'cpu')
+    try:
+        limit = min(500, max(1, int(request.args.get('limit', 50))))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({
+        'profiler': profiler.get_stats(),
+        'functions': profiler.functions(limit=limit, sort=sort)
+    })
+
+@app.route('/admin/profile/start', methods=['POST'])
+@require_admin_key
+def start_profile():
+    """Start sampling this worker process for ?duration= seconds (default PROFILE_DURATION)"""
+    try:
+        duration = int(request.args.get('duration', Config.PROFILE_DURATION))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if not profiler.start(duration or None):
+        return jsonify({'error': 'Profiler already running', 'profiler': profiler.get_stats()}), 409
+    return jsonify({'profiler': profiler.get_stats()})
+
+@app.route('/admin/profile/stop', methods=['POST'])
+@require_admin_key
+def stop_profile():
+    """Stop sampling and write the folded stacks to PROFILE_DIRECTORY"""
+    if not profiler.stop():
+        return jsonify({'error': 'Profiler not running', 'profiler': profiler.get_stats()}), 409
+    return jsonify({'profiler': profiler.get_stats()})
+
+@app.route('/admin/profile/folded', methods=['GET'])
+@require_admin_key
+def get_profile_folded():
+    """Flamegraph-compatible folded stacks, weighted by ?weight=wall (samples) or cpu (microseconds)"""
+    weight = request.args.get('weight', 'wall')
+    if weight not in ('wall', 'cpu'):
+        return jsonify({'error': "weight must be 'wall' or 'cpu'"}), 400
+    return Response(profiler.folded(weight), mimetype='text/plain')
+
+def dead_letter_selection():
+    """ids, kind and tenant of a dead-letter admin request, or None unless it names ids or sets all"""
+    body = request.get_json(silent=True) or {}
+    ids = [int(entry_id) for entry_id in body.get('ids') or request.args.getlist('id', type=int)]
+    if not ids and not (body.get('all') or request.args.get('all') == 'true'):
+        return None
+    return {
+        'ids': ids or None,
+        'kind': body.get('kind') or request.args.get('kind'),
+        'tenant': body.get('tenant') or request.args.get('tenant'),
+    }
+
+@app.route('/admin/dead-letters', methods=['GET'])
+@require_admin_key
+def list_dead_letters():
+    """Failed replies, filtered by ?status=, ?kind= and ?tenant="""
+    if not dead_letters:
+        return jsonify({'error': 'Dead letters are disabled'}), 503
+    limit = min(500, max(1, request.args.get('limit', 50, type=int)))
+    offset = max(0, request.args.get('offset', 0, type=int))
+    return jsonify({
+        'replay': dead_letter_replayer.get_stats(),
+        'dead_letters': dead_letters.list(
+            request.args.get('status'), request.args.get('kind'), request.args.get('tenant'), limit, offset
+        ),
+    })
+
+@app.route('/admin/dead-letters/replay', methods=['POST'])
+@require_admin_key
+def replay_dead_letters():
+    """Queue dead letters for rate-limited replay: the given ids, or all pending ones matching kind/tenant"""
+    if not dead_letters:
+        return jsonify({'error': 'Dead letters are disabled'}), 503
+    selection = dead_letter_selection()
+    if selection is None:
+        return jsonify({'error': "Give the entry 'ids', or 'all': true to replay every pending entry"}), 400
+    queued = dead_letters.queue(**selection)
+    return jsonify({'queued': queued, 'rate_per_second': Config.DEAD_LETTER_REPLAY_RATE})
+
+@app.route('/admin/dead-letters/discard', methods=['POST'])
+@require_admin_key
+def discard_dead_letters():
+    """Discard dead letters: the given ids, or all pending ones matching kind/tenant"""
+    if not dead_letters:
+        return jsonify({'error': 'Dead letters are disabled'}), 503
+    selection = dead_letter_selection()
+    if selection is None:
+        return jsonify({'error': "Give the entry 'ids', or 'all': true to discard every pending entry"}), 400
+    return jsonify({'discarded': dead_letters.discard(**selection)})
+
 @app.route('/active-chats', methods=['GET'])
 def get_active_chats():
     """Get list of all active chat files"""
+    chat_manager = requested_chat_manager()
+    if chat_manager is None:
+        return jsonify({'error': 'Unknown tenant'}), 404
     try:
-        chat_files = []
-        if os.path.exists(chat_manager.chat_directory):
-            for filename in os.listdir(chat_manager.chat_directory):
-                if filename.startswith('chat_') and filename.endswith('.txt'):
-                    phone_number = filename.replace('chat_', '').replace('.txt', '')
-                    chat_files.append(phone_number)
+        chat_files = chat_manager.list_chats()
         
         return jsonify({
             'active_chats': chat_files,
@@ -293,6 +1127,13 @@ def get_active_chats():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def handle_sigterm(signum, frame):
+    """Drain before exiting when run directly (gunicorn uses the worker_exit hook instead)"""
+    shutdown_coordinator.shutdown('SIGTERM')
+    sys.exit(0)
+
 if __name__ == '__main__':
+    signal.signal(signal.SIGTERM, handle_sigterm)
+    start_serving()
     port = int(os.getenv('PORT', 5000))
     app.run(host='0.0.0.0', port=port, debug=os.getenv('FLASK_DEBUG', 'False').lower() == 'true')
\ No newline at end of file
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Chat Export and Analytics
+Streams every conversation in the chat directory through a process pool and
+produces a message-level export plus aggregate numbers: messages per day,
+reply latency and the busiest phone numbers.
+
+Each worker reads one chat file in batches of records and writes its own export
+part, returning only small aggregates, so memory use does not grow with the
+total chat volume.
+
+Usage:
+    python chat_analytics.py --out exports/ --format jsonl
+    python chat_analytics.py --out exports/ --format parquet --workers 8
+"""
+
+import os
+import csv
+import json
+import heapq
+import argparse
+from collections import Counter
+from datetime import datetime
+from multiprocessing import Pool
+
+from chat_records import iter_record_batches, phone_of
+from status_store import LatencyStats
+
+
+FORMATS = ('jsonl', 'csv', 'parquet')
+EXPORT_FIELDS = ('phone_number', 'timestamp', 'sender', 'message')
+
+
+def iter_chat_files(directory):
+    """Yield (phone_number, path) for every chat file in directory"""
+    for entry in sorted(os.scandir(directory), key=lambda e: e.name):
+        phone_number = phone_of(entry.name)
+        if entry.is_file() and phone_number:
+            yield phone_number, entry.path
+
+
+class PartWriter:
+    """Writes one worker's share of the message export"""
+
+    def __init__(self, path, export_format):
+        self.path = path
+        self.format = export_format
+        self.rows = 0
+        if export_format == 'parquet':
+            import pyarrow
+            import pyarrow.parquet
+            self._pa = pyarrow
+            self._schema = pyarrow.schema([(field, pyarrow.string()) for field in EXPORT_FIELDS])
+            self._writer = pyarrow.parquet.ParquetWriter(path, self._schema)
+        else:
+            self._file = open(path, 'w', encoding='utf-8', newline='')
+            if export_format == 'csv':
+                self._csv = csv.writer(self._file)
+
+    def write_batch(self, phone_number, batch):
+        if self.format == 'parquet':
+            columns = [[phone_number] * len(batch)] + [list(column) for column in zip(*batch)]
+            self._writer.write_table(self._pa.Table.from_arrays(
+                [self._pa.array(column, type=self._pa.string()) for column in columns],
+                schema=self._schema
+            ))
+        elif self.format == 'csv':
+            self._csv.writerows((phone_number,) + record for record in batch)
+        else:
+            self._file.write(''.join(
+                json.dumps(dict(zip(EXPORT_FIELDS, (phone_number,) + record)), ensure_ascii=False) + '\n'
+                for record in batch
+            ))
+        self.rows += len(batch)
+
+    def close(self):
+        if self.format == 'parquet':
+            self._writer.close()
+        else:
+            self._file.close()
+
+
+def analyze_chat_file(task):
+    """Export and summarize one chat file (runs in a worker process)"""
+    phone_number, path, out_directory, export_format, batch_lines = task
+
+    daily = Counter()
+    senders = Counter()
+    reply_latency = LatencyStats()
+    waiting_since = None
+    first_timestamp = last_timestamp = None
+
+    part_path = os.path.join(out_directory, 'messages', f"part-{phone_number}.{export_format}")
+    writer = PartWriter(part_path, export_format) if export_format else None
+
+    for batch in iter_record_batches(path, batch_lines):
+        if writer:
+            writer.write_batch(phone_number, batch)
+
+        for timestamp, sender, _ in batch:
+            daily[(timestamp[:10], sender)] += 1
+            senders[sender] += 1
+            if first_timestamp is None:
+                first_timestamp = timestamp
+            last_timestamp = timestamp
+
+            # Reply latency: first unanswered user message to the next assistant message
+            if sender == 'User':
+                if waiting_since is None:
+                    waiting_since = timestamp
+            elif sender == 'Assistant' and waiting_since is not None:
+                reply_latency.add((datetime.fromisoformat(timestamp) - datetime.fromisoformat(waiting_since)).total_seconds())
+                waiting_since = None
+
+    if writer:
+        writer.close()
+        if not writer.rows:
+            os.remove(part_path)
+
+    return {
+        'phone_number': phone_number,
+        'messages': sum(senders.values()),
+        'senders': senders,
+        'daily': daily,
+        'reply_latency': reply_latency,
+        'first_message_at': first_timestamp,
+        'last_message_at': last_timestamp,
+    }
+
+
+def run(chat_directory, out_directory, export_format=None, workers=None, batch_lines=5000, top=20):
+    """Analyze every chat in chat_directory, writing exports and summary.json to out_directory"""
+    if export_format == 'parquet':
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise SystemExit("❌ Parquet export requires pyarrow: pip install pyarrow")
+
+    os.makedirs(os.path.join(out_directory, 'messages'), exist_ok=True)
+    tasks = (
+        (phone_number, path, out_directory, export_format, batch_lines)
+        for phone_number, path in iter_chat_files(chat_directory)
+    )
+
+    daily = Counter()
+    senders = Counter()
+    reply_latency = LatencyStats()
+    top_phones = []
+    conversations = 0
+
+    with Pool(processes=workers) as pool:
+        for summary in pool.imap_unordered(analyze_chat_file, tasks, chunksize=4):
+            conversations += 1
+            daily.update(summary['daily'])
+            senders.update(summary['senders'])
+            reply_latency.merge(summary['reply_latency'])
+
+            # Keep only the busiest phones instead of one entry per conversation
+            entry = (summary['messages'], summary['phone_number'], summary['last_message_at'])
+            if len(top_phones) < top:
+                heapq.heappush(top_phones, entry)
+            else:
+                heapq.heappushpop(top_phones, entry)
+
+            if conversations % 100 == 0:
+                print(f"📊 Processed {conversations} conversations...")
+
+    messages_per_day = {}
+    for (day, sender), count in sorted(daily.items()):
+        messages_per_day.setdefault(day, {})[sender] = count
+
+    report = {
+        'generated_at': datetime.now().isoformat(),
+        'conversations': conversations,
+        'messages': sum(senders.values()),
+        'messages_by_sender': dict(senders),
+        'messages_per_day': messages_per_day,
+        'reply_latency': reply_latency.to_dict(),
+        'top_phones': [
+            {'phone_number': phone, 'messages': count, 'last_message_at': last}
+            for count, phone, last in sorted(top_phones, reverse=True)
+        ],
+    }
+
+    with open(os.path.join(out_directory, 'summary.json'), 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    with open(os.path.join(out_directory, 'messages_per_day.csv'), 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['day', 'sender', 'messages'])
+        for (day, sender), count in sorted(daily.items()):
+            writer.writerow([day, sender, count])
+
+    return report
+
+
+def main():
+    """Run the export from the command line"""
+    from config import Config
+
+    parser = argparse.ArgumentParser(description="Export and analyze WhatsApp chat histories")
+    parser.add_argument('--chats', default=Config.CHAT_DIRECTORY, help="chat directory (default: CHAT_DIRECTORY)")
+    parser.add_argument('--out', default='exports', help="output directory (default: exports)")
+    parser.add_argument('--format', choices=FORMATS, help="also export every message in this format")
+    parser.add_argument('--workers', type=int, help="worker processes (default: CPU count)")
+    parser.add_argument('--batch-lines', type=int, default=5000, help="records parsed per batch")
+    parser.add_argument('--top', type=int, default=20, help="number of busiest phones to report")
+    args = parser.parse_args()
+
+    print("📈 WhatsApp Chat Analytics")
+    print("=" * 50)
+    report = run(args.chats, args.out, args.format, args.workers, args.batch_lines, args.top)
+
+    latency = report['reply_latency']
+    print(f"✅ {report['conversations']} conversations, {report['messages']} messages")
+    print(f"⏱️  Reply latency: avg {latency['avg_seconds']}s, p50 <= {latency['p50_seconds']}s, p95 <= {latency['p95_seconds']}s")
+    for entry in report['top_phones'][:5]:
+        print(f"📱 {entry['phone_number']}: {entry['messages']} messages")
+    print(f"📁 Results written to {args.out}/")
+
+
+if __name__ == "__main__":
+    main()
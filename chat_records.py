@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+Chat record format for WhatsApp ChatBot
+
+Chat files store one self-describing record per message:
+
+- ``jsonl`` (default): one JSON object per line,
+  ``{"v": 1, "timestamp": "...", "sender": "...", "message": "..."}``.
+  Newlines inside messages are escaped, so every line is exactly one record
+  and the last N messages can be read from the end of the file.
+- ``msgpack``: the same records as a stream of MessagePack maps (needs the
+  ``msgpack`` package); smaller and faster to decode, but tails are read by
+  scanning the file.
+
+Legacy ``[timestamp] sender: message`` text files are still readable and can
+be converted with ``python chat_records.py migrate``.
+"""
+
+import os
+import re
+import json
+import fcntl
+from collections import deque
+from itertools import islice
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+FORMAT_VERSION = 1
+
+EXTENSIONS = {
+    'jsonl': '.jsonl',
+    'msgpack': '.msgpack',
+    'text': '.txt',
+}
+
+# Start of a legacy text record: [timestamp] sender:
+LEGACY_RECORD_START = re.compile(r'^\[(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})\] (\w+): ', re.MULTILINE)
+
+TAIL_BLOCK_SIZE = 65536
+
+
+def format_of(path):
+    """Record format of a chat file, from its extension"""
+    for name, extension in EXTENSIONS.items():
+        if path.endswith(extension):
+            return name
+    raise ValueError(f"Unknown chat file format: {path}")
+
+
+def phone_of(filename):
+    """Phone number of a chat file name like chat_<number>.jsonl, or None"""
+    if not filename.startswith('chat_'):
+        return None
+    for extension in EXTENSIONS.values():
+        if filename.endswith(extension):
+            return filename[len('chat_'):-len(extension)]
+    return None
+
+
+def chat_files(directory):
+    """{phone_number: [paths]} of the chat files in directory, each phone's history in order
+
+    A legacy text file not yet migrated holds the history before the records
+    written in the new format, so it comes first.
+    """
+    files = {}
+    for filename in sorted(os.listdir(directory)) if os.path.isdir(directory) else []:
+        phone_number = phone_of(filename)
+        if phone_number:
+            files.setdefault(phone_number, []).append(os.path.join(directory, filename))
+    for paths in files.values():
+        paths.sort(key=lambda path: format_of(path) != 'text')
+    return files
+
+
+def check_format(name):
+    """Raise if records cannot be written in the named format"""
+    if name not in ('jsonl', 'msgpack'):
+        raise ValueError(f"Unsupported chat record format '{name}'. Use 'jsonl' or 'msgpack'")
+    if name == 'msgpack' and msgpack is None:
+        raise ValueError("CHAT_RECORD_FORMAT=msgpack requires the msgpack package: pip install msgpack")
+
+
+def make_record(timestamp, sender, message):
+    return {'v': FORMAT_VERSION, 'timestamp': timestamp, 'sender': sender, 'message': message}
+
+
+def encode_record(record, record_format):
+    """Serialize a record for appending to a chat file"""
+    if record_format == 'msgpack':
+        return msgpack.packb(record, use_bin_type=True)
+    return (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')
+
+
+def append_record(path, record):
+    """Append one record to a chat file with a single write"""
+    data = encode_record(record, format_of(path))
+    with open(path, 'ab') as f:
+        f.write(data)
+
+
+def iter_legacy_batches(f, batch_lines=5000):
+    """Yield lists of (timestamp, sender, message) from a legacy text chat file
+
+    Each batch is parsed with one regex scan over the joined lines. The last
+    record of a batch may continue on the next lines (multi-line messages),
+    so it is carried over and completed with the following batch.
+    """
+    carry = ''
+    while True:
+        lines = list(islice(f, batch_lines))
+        if not lines:
+            break
+        text = carry + ''.join(lines)
+        starts = list(LEGACY_RECORD_START.finditer(text))
+        if not starts:
+            carry = text
+            continue
+
+        batch = []
+        for current, following in zip(starts, starts[1:]):
+            batch.append((current.group(1), current.group(2), text[current.end():following.start()].rstrip('\n')))
+        carry = text[starts[-1].start():]
+        if batch:
+            yield batch
+
+    if carry:
+        match = LEGACY_RECORD_START.match(carry)
+        if match:
+            yield [(match.group(1), match.group(2), carry[match.end():].rstrip('\n'))]
+
+
+def iter_record_batches(path, batch_size=5000):
+    """Yield lists of (timestamp, sender, message) tuples from a chat file of any format"""
+    record_format = format_of(path)
+
+    if record_format == 'text':
+        with open(path, 'r', encoding='utf-8', errors='replace') as f:
+            yield from iter_legacy_batches(f, batch_size)
+        return
+
+    batch = []
+    for record in iter_records(path):
+        batch.append((record['timestamp'], record['sender'], record['message']))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def iter_records(path):
+    """Stream the records of a chat file of any format as dicts"""
+    record_format = format_of(path)
+
+    if record_format == 'text':
+        for batch in iter_record_batches(path):
+            for timestamp, sender, message in batch:
+                yield make_record(timestamp, sender, message)
+    elif record_format == 'msgpack':
+        with open(path, 'rb') as f:
+            yield from msgpack.Unpacker(f, raw=False)
+    else:
+        with open(path, 'rb') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def tail_records(path, limit):
+    """Return the last limit records of a chat file
+
+    JSONL files are read backwards from the end in blocks, so the cost
+    depends on limit rather than on the size of the history.
+    """
+    if limit <= 0:
+        return []
+    if format_of(path) != 'jsonl':
+        return list(deque(iter_records(path), maxlen=limit))
+
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        data = b''
+        # One more newline than records wanted, so the first line is complete
+        while position > 0 and data.count(b'\n') <= limit:
+            step = min(TAIL_BLOCK_SIZE, position)
+            position -= step
+            f.seek(position)
+            data = f.read(step) + data
+
+    lines = [line for line in data.split(b'\n') if line.strip()]
+    if position > 0:
+        lines = lines[1:]
+    return [json.loads(line) for line in lines[-limit:]]
+
+
+def migrate_file(legacy_path, record_format='jsonl', keep_backup=True):
+    """Convert a legacy text chat file, returning the path of the new file
+
+    Records already written in the new format are kept after the migrated
+    history. The legacy file is renamed to .bak, or removed if keep_backup
+    is False. An exclusive lock on the legacy file serializes worker
+    processes migrating the same chat; the ones that waited find it done.
+    """
+    check_format(record_format)
+    base = legacy_path[:-len(EXTENSIONS['text'])]
+    target = base + EXTENSIONS[record_format]
+
+    try:
+        legacy = open(legacy_path, 'rb')
+    except FileNotFoundError:
+        return target  # Already migrated by another process
+    with legacy:
+        fcntl.flock(legacy, fcntl.LOCK_EX)
+        try:
+            if not os.path.samestat(os.fstat(legacy.fileno()), os.stat(legacy_path)):
+                return target
+        except FileNotFoundError:
+            return target
+
+        temp_path = f"{target}.{os.getpid()}.migrating"
+        count = 0
+        with open(temp_path, 'wb') as out:
+            for batch in iter_record_batches(legacy_path):
+                out.write(b''.join(encode_record(make_record(*record), record_format) for record in batch))
+                count += len(batch)
+            if os.path.exists(target):
+                with open(target, 'rb') as existing:
+                    while True:
+                        block = existing.read(TAIL_BLOCK_SIZE)
+                        if not block:
+                            break
+                        out.write(block)
+
+        os.replace(temp_path, target)
+        if keep_backup:
+            os.replace(legacy_path, legacy_path + '.bak')
+        else:
+            os.remove(legacy_path)
+    print(f"📦 Migrated {count} messages: {os.path.basename(legacy_path)} -> {os.path.basename(target)}")
+    return target
+
+
+def migrate_directory(directory, record_format='jsonl', keep_backup=True):
+    """Convert every legacy text chat file in directory"""
+    migrated = 0
+    for filename in sorted(os.listdir(directory)):
+        if filename.startswith('chat_') and filename.endswith(EXTENSIONS['text']):
+            migrate_file(os.path.join(directory, filename), record_format, keep_backup)
+            migrated += 1
+    return migrated
+
+
+def main():
+    """Migrate legacy chat files from the command line"""
+    import argparse
+    from config import Config
+
+    parser = argparse.ArgumentParser(description="Chat record format tools")
+    subparsers = parser.add_subparsers(dest='command')
+    migrate = subparsers.add_parser('migrate', help="convert legacy text chat files")
+    migrate.add_argument('--chats', default=Config.CHAT_DIRECTORY, help="chat directory (default: CHAT_DIRECTORY)")
+    migrate.add_argument('--format', default=Config.CHAT_RECORD_FORMAT, choices=['jsonl', 'msgpack'])
+    migrate.add_argument('--no-backup', action='store_true', help="delete legacy files instead of keeping .bak copies")
+    show = subparsers.add_parser('show', help="print the records of a chat file")
+    show.add_argument('path')
+    show.add_argument('--tail', type=int, help="only the last N records")
+    args = parser.parse_args()
+
+    if args.command == 'migrate':
+        count = migrate_directory(args.chats, args.format, keep_backup=not args.no_backup)
+        print(f"✅ Migrated {count} chat file(s) to {args.format}")
+    elif args.command == 'show':
+        records = tail_records(args.path, args.tail) if args.tail else iter_records(args.path)
+        for record in records:
+            print(f"[{record['timestamp']}] {record['sender']}: {record['message']}")
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+Full-text search over chat histories
+
+Messages are indexed in SQLite FTS5 as they are saved, so searching every
+conversation for an order number is an index lookup instead of a scan of
+every chat file. Run this module with --rebuild to index existing chats.
+"""
+
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+import chat_records
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    phone_number TEXT NOT NULL,
+    sender TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    message TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_phone_timestamp ON messages(phone_number, timestamp);
+CREATE INDEX IF NOT EXISTS messages_timestamp ON messages(timestamp);
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    message,
+    content='messages',
+    content_rowid='id'
+);
+"""
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def normalize_phone(phone_number):
+    """Phone number in the form used for chat file names"""
+    return phone_number.replace('+', '').replace(' ', '')
+
+
+def parse_since(value):
+    """Parse an ISO date or datetime into the chat timestamp format"""
+    return datetime.fromisoformat(value).strftime(TIMESTAMP_FORMAT)
+
+
+def build_match_query(query):
+    """Turn free text into an FTS5 query that matches all terms
+
+    Each term is quoted so characters such as '#' or '-' in order numbers
+    are treated as text rather than FTS5 syntax.
+    """
+    terms = [term.replace('"', '""') for term in query.split()]
+    return ' '.join(f'"{term}"' for term in terms if term)
+
+
+class ChatSearchIndex:
+    """SQLite FTS5 index of chat messages"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(SCHEMA)
+
+    def add(self, phone_number, sender, message, timestamp):
+        """Index one saved message"""
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                'INSERT INTO messages (phone_number, sender, timestamp, message) VALUES (?, ?, ?, ?)',
+                (normalize_phone(phone_number), sender, timestamp, message)
+            )
+            self._conn.execute(
+                'INSERT INTO messages_fts (rowid, message) VALUES (?, ?)',
+                (cursor.lastrowid, message)
+            )
+
+    def add_many(self, rows):
+        """Index (phone_number, sender, message, timestamp) rows in one transaction"""
+        count = 0
+        with self._lock, self._conn:
+            for phone_number, sender, message, timestamp in rows:
+                cursor = self._conn.execute(
+                    'INSERT INTO messages (phone_number, sender, timestamp, message) VALUES (?, ?, ?, ?)',
+                    (normalize_phone(phone_number), sender, timestamp, message)
+                )
+                self._conn.execute(
+                    'INSERT INTO messages_fts (rowid, message) VALUES (?, ?)',
+                    (cursor.lastrowid, message)
+                )
+                count += 1
+        return count
+
+    def clear(self):
+        """Remove every message from the index"""
+        with self._lock, self._conn:
+            self._conn.execute("INSERT INTO messages_fts (messages_fts) VALUES ('delete-all')")
+            self._conn.execute('DELETE FROM messages')
+
+    def search(self, query, phone_number=None, since=None, page=1, per_page=20):
+        """Search messages, best matches first
+
+        Returns (total, results) where results is the requested page.
+        """
+        match = build_match_query(query)
+        if not match:
+            return 0, []
+
+        conditions = ['messages_fts MATCH ?']
+        params = [match]
+        if phone_number:
+            conditions.append('m.phone_number = ?')
+            params.append(normalize_phone(phone_number))
+        if since:
+            conditions.append('m.timestamp >= ?')
+            params.append(since)
+        where = ' AND '.join(conditions)
+
+        with self._lock:
+            total = self._conn.execute(
+                f'SELECT COUNT(*) FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid WHERE {where}',
+                params
+            ).fetchone()[0]
+            rows = self._conn.execute(
+                f"""SELECT m.phone_number, m.sender, m.timestamp, m.message,
+                           snippet(messages_fts, 0, '[', ']', '...', 16), bm25(messages_fts) AS rank
+                    FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid
+                    WHERE {where}
+                    ORDER BY rank, m.timestamp DESC
+                    LIMIT ? OFFSET ?""",
+                params + [per_page, (page - 1) * per_page]
+            ).fetchall()
+
+        results = [
+            {
+                'phone_number': phone,
+                'sender': sender,
+                'timestamp': timestamp,
+                'message': message,
+                'snippet': snippet,
+                'score': round(-rank, 4),
+            }
+            for phone, sender, timestamp, message, snippet, rank in rows
+        ]
+        return total, results
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM messages').fetchone()[0]
+
+    def checkpoint(self):
+        """Copy the write-ahead log into the database file"""
+        with self._lock:
+            self._conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def rebuild(index, chat_directory):
+    """Re-index every chat file in chat_directory, straight from the chat records"""
+    index.clear()
+    total = 0
+    for phone_number, paths in chat_records.chat_files(chat_directory).items():
+        rows = (
+            (phone_number, record['sender'], record['message'], record['timestamp'])
+            for path in paths
+            for record in chat_records.iter_records(path)
+        )
+        count = index.add_many(rows)
+        total += count
+        print(f"📇 Indexed {count} messages for {phone_number}")
+    return total
+
+
+def main():
+    """Rebuild or query the search index from the command line
+
+    The index of each tenant is rebuilt from its chat directory without
+    starting the app, so this is safe to run next to the serving workers.
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Chat history search index")
+    parser.add_argument('--rebuild', action='store_true', help="re-index all existing chat files")
+    parser.add_argument('query', nargs='?', help="search the index from the command line")
+    parser.add_argument('--phone', help="only search this phone number's chats")
+    parser.add_argument('--since', help="only messages at or after this ISO date/time")
+    parser.add_argument('--tenant', help="only this tenant's index (default: rebuild all, search the default tenant)")
+    args = parser.parse_args()
+
+    from config import Config
+    from tenants import TenantRegistry
+
+    registry = TenantRegistry.load(Config, os.getenv('WHATSAPP_TOKEN'), os.getenv('WHATSAPP_PHONE_NUMBER_ID'))
+    if args.tenant and registry.get(args.tenant) is None:
+        parser.error(f"Unknown tenant '{args.tenant}'")
+
+    if args.rebuild:
+        for tenant in registry:
+            if args.tenant and tenant.name != args.tenant:
+                continue
+            if not os.path.isdir(tenant.config.CHAT_DIRECTORY):
+                print(f"⏭️  No chats for {tenant.name} in {tenant.config.CHAT_DIRECTORY}")
+                continue
+            index = ChatSearchIndex(tenant.config.SEARCH_INDEX_PATH)
+            total = rebuild(index, tenant.config.CHAT_DIRECTORY)
+            index.checkpoint()
+            print(f"✅ Indexed {total} {tenant.name} messages into {index.path}")
+    elif args.query:
+        index = ChatSearchIndex(registry.get(args.tenant).config.SEARCH_INDEX_PATH)
+        since = parse_since(args.since) if args.since else None
+        total, results = index.search(args.query, phone_number=args.phone, since=since)
+        print(f"🔎 {total} match(es) for '{args.query}'")
+        for result in results:
+            print(f"[{result['timestamp']}] {result['phone_number']} {result['sender']}: {result['snippet']}")
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
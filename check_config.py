@@ -2,11 +2,17 @@
 """
 Configuration Checker
 Quick script to check if your WhatsApp API credentials are properly configured
+
+With --probe it also measures network latency to the configured Graph API
+number and OpenAI (see netprobe.py for the options).
 """
 
 import os
+import argparse
 from dotenv import load_dotenv
 
+import netprobe
+
 # Load environment variables
 load_dotenv()
 
@@ -107,5 +113,18 @@ def check_config():
         
         return True
 
+def probe_config(args):
+    """Measure latency to the endpoints the configured credentials use"""
+    print("\n⏱️  Probing upstream latency...")
+    endpoints = netprobe.upstream_endpoints(
+        os.getenv('WHATSAPP_TOKEN'), os.getenv('WHATSAPP_PHONE_NUMBER_ID'), os.getenv('OPENAI_API_KEY')
+    )
+    netprobe.probe_endpoints(args, endpoints)
+
 if __name__ == "__main__":
-    check_config()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Check the bot's configuration")
+    netprobe.add_probe_arguments(parser)
+    args = parser.parse_args()
+    check_config()
+    if args.probe:
+        probe_config(args)
\ No newline at end of file
@@ -21,27 +21,128 @@ class Config:
     WHATSAPP_TOKEN = os.getenv('WHATSAPP_TOKEN')
     WHATSAPP_PHONE_NUMBER_ID = os.getenv('WHATSAPP_PHONE_NUMBER_ID')
     VERIFY_TOKEN = os.getenv('VERIFY_TOKEN')
+    WHATSAPP_APP_SECRET = os.getenv('WHATSAPP_APP_SECRET')  # Meta app secret used to sign webhook payloads
+    MAX_WEBHOOK_BYTES = int(os.getenv('MAX_WEBHOOK_BYTES', 1048576))  # Larger webhook bodies are rejected unread
     WEBHOOK_URL = os.getenv('WEBHOOK_URL', 'https://hexawhite.quantumautomata.in/webhook')
+    TENANTS_FILE = os.getenv('TENANTS_FILE', 'tenants.json')  # Extra WhatsApp numbers served by this deployment
     
     # OpenAI Configuration
     OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
     OPENAI_ASSISTANT_ID = os.getenv('OPENAI_ASSISTANT_ID')
     OPENAI_MODEL = os.getenv('OPENAI_MODEL', 'gpt-4')
+    OPENAI_SYSTEM_PROMPT = os.getenv('OPENAI_SYSTEM_PROMPT', 'You are a helpful customer support assistant replying over WhatsApp.')
+    
+    # Response Engine Configuration
+    RESPONSE_ENGINE = os.getenv('RESPONSE_ENGINE', 'assistants')  # 'assistants' or 'chat_completions'
+    CHAT_CONTEXT_MESSAGES = int(os.getenv('CHAT_CONTEXT_MESSAGES', 20))  # History messages sent to chat completions
     
     # Chat Configuration
     CHAT_DIRECTORY = os.getenv('CHAT_DIRECTORY', 'chats')
+    CHAT_RECORD_FORMAT = os.getenv('CHAT_RECORD_FORMAT', 'jsonl')  # 'jsonl' or 'msgpack'
     MAX_CHAT_HISTORY = int(os.getenv('MAX_CHAT_HISTORY', 1000))  # Max messages per chat file
     CHAT_BACKUP_ENABLED = os.getenv('CHAT_BACKUP_ENABLED', 'True').lower() == 'true'
+    SEARCH_INDEX_ENABLED = os.getenv('SEARCH_INDEX_ENABLED', 'True').lower() == 'true'
+    SEARCH_INDEX_PATH = os.getenv('SEARCH_INDEX_PATH', 'chat_search.db')  # SQLite FTS5 index of chat messages
+    
+    # Conversation Sharding
+    SHARDING_MODE = os.getenv('SHARDING_MODE', 'off')  # 'off', 'local' (gunicorn workers) or 'http' (app instances)
+    SHARD_COUNT = int(os.getenv('SHARD_COUNT', 4))  # local: number of shards, one per gunicorn worker
+    SHARD_DIRECTORY = os.getenv('SHARD_DIRECTORY', 'state/shards')  # local: lock files and sockets
+    SHARD_PEERS = os.getenv('SHARD_PEERS', '')  # http: comma-separated name=base_url pairs
+    SHARD_SELF = os.getenv('SHARD_SELF', '')  # http: this instance's name in SHARD_PEERS
+    SHARD_SECRET = os.getenv('SHARD_SECRET', '')  # http: shared secret for /internal/shard
+    SHARD_FORWARD_TIMEOUT = int(os.getenv('SHARD_FORWARD_TIMEOUT', 2))
+    
+    # Media Configuration
+    # Media is stored; the engine sees only a placeholder, captions and (optionally) voice transcripts
+    MEDIA_DIRECTORY = os.getenv('MEDIA_DIRECTORY', 'media')
+    MEDIA_MAX_BYTES = int(os.getenv('MEDIA_MAX_BYTES', 16777216))  # 16MB
+    MEDIA_CHUNK_SIZE = int(os.getenv('MEDIA_CHUNK_SIZE', 65536))  # Streaming download chunk size
+    MEDIA_DOWNLOAD_WORKERS = int(os.getenv('MEDIA_DOWNLOAD_WORKERS', 2))
+    MEDIA_MAX_PENDING = int(os.getenv('MEDIA_MAX_PENDING', 20))  # Queued + running downloads
+    MEDIA_TRANSCRIBE_AUDIO = os.getenv('MEDIA_TRANSCRIBE_AUDIO', 'False').lower() == 'true'
+    MEDIA_TRANSCRIPTION_MODEL = os.getenv('MEDIA_TRANSCRIPTION_MODEL', 'whisper-1')
+    
+    # Delivery Status Tracking
+    STATUS_STORE_CAPACITY = int(os.getenv('STATUS_STORE_CAPACITY', 100000))  # Outbound messages tracked in memory
+    
+    # Recent History Cache
+    HISTORY_CACHE_MESSAGES = int(os.getenv('HISTORY_CACHE_MESSAGES', 50))  # Latest messages kept in memory per conversation (0 disables)
+    HISTORY_CACHE_MB = int(os.getenv('HISTORY_CACHE_MB', 64))  # Memory cap across all cached conversations
+    
+    # Reply Delivery
+    READ_RECEIPTS_ENABLED = os.getenv('READ_RECEIPTS_ENABLED', 'True').lower() == 'true'  # Mark inbound messages read on arrival
+    TYPING_INDICATOR_ENABLED = os.getenv('TYPING_INDICATOR_ENABLED', 'True').lower() == 'true'  # Show typing while a reply is generated
+    PROGRESSIVE_REPLIES = os.getenv('PROGRESSIVE_REPLIES', 'True').lower() == 'true'  # Send streamed paragraphs as they complete
+    REPLY_PART_MIN_CHARS = int(os.getenv('REPLY_PART_MIN_CHARS', 300))  # Smallest streamed part sent on its own
     
     # Thread Management
     THREAD_TIMEOUT = int(os.getenv('THREAD_TIMEOUT', 3600))  # 1 hour in seconds
     MAX_ACTIVE_THREADS = int(os.getenv('MAX_ACTIVE_THREADS', 100))
     
+    # Pre-warmed threads: new conversations claim a ready thread instead of creating one inline
+    THREAD_PREWARM_ENABLED = os.getenv('THREAD_PREWARM_ENABLED', 'True').lower() == 'true'
+    THREAD_PREWARM_MIN = int(os.getenv('THREAD_PREWARM_MIN', 1))
+    THREAD_PREWARM_MAX = int(os.getenv('THREAD_PREWARM_MAX', 20))
+    THREAD_PREWARM_HORIZON = int(os.getenv('THREAD_PREWARM_HORIZON', 120))  # seconds of new conversations to cover
+    THREAD_PREWARM_RATE_WINDOW = int(os.getenv('THREAD_PREWARM_RATE_WINDOW', 900))  # seconds
+    THREAD_PREWARM_MAX_AGE = int(os.getenv('THREAD_PREWARM_MAX_AGE', 3600))  # delete unclaimed threads after this
+    
+    # Worker Pool and Resilience
+    WORKER_THREADS = int(os.getenv('WORKER_THREADS', 8))  # Background reply workers
+    MAX_PENDING_JOBS = int(os.getenv('MAX_PENDING_JOBS', 200))  # Queued + running jobs before new work is deferred
+    REPLY_DEADLINE = int(os.getenv('REPLY_DEADLINE', 90))  # Seconds budget to produce a reply
+    OPENAI_REQUEST_TIMEOUT = int(os.getenv('OPENAI_REQUEST_TIMEOUT', 30))  # Max seconds per OpenAI API call
+    GRAPH_REQUEST_TIMEOUT = int(os.getenv('GRAPH_REQUEST_TIMEOUT', 10))  # Max seconds per Graph API call
+    BREAKER_FAILURE_THRESHOLD = int(os.getenv('BREAKER_FAILURE_THRESHOLD', 5))  # Consecutive failures before opening
+    BREAKER_RECOVERY_TIMEOUT = int(os.getenv('BREAKER_RECOVERY_TIMEOUT', 30))  # Seconds open before a probe call
+    DEFERRED_QUEUE_SIZE = int(os.getenv('DEFERRED_QUEUE_SIZE', 500))
+    DEFERRED_RETRY_INTERVAL = int(os.getenv('DEFERRED_RETRY_INTERVAL', 15))  # Seconds between retry batches
+    DEGRADED_REPLY = os.getenv('DEGRADED_REPLY', "Thanks for your message! We're experiencing high demand right now and will reply as soon as possible.")
+    
     # Rate Limiting
     RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', 'True').lower() == 'true'
     RATE_LIMIT_MESSAGES = int(os.getenv('RATE_LIMIT_MESSAGES', 10))  # Messages per minute
     RATE_LIMIT_WINDOW = int(os.getenv('RATE_LIMIT_WINDOW', 60))  # Window in seconds
     
+    # Intent Routing: canned replies for trivial messages, without an assistant run
+    INTENT_RULES_FILE = os.getenv('INTENT_RULES_FILE', 'intents.json')
+    
+    # Graceful Shutdown
+    SHUTDOWN_DEADLINE = int(os.getenv('SHUTDOWN_DEADLINE', 20))  # Seconds to let in-flight replies finish
+    SHUTDOWN_JOURNAL_DIRECTORY = os.getenv('SHUTDOWN_JOURNAL_DIRECTORY', 'state')
+    JOURNAL_RECOVERY_INTERVAL = int(os.getenv('JOURNAL_RECOVERY_INTERVAL', 30))
+    
+    # Dead Letters: replies that failed for good, kept for inspection and replay
+    DEAD_LETTER_ENABLED = os.getenv('DEAD_LETTER_ENABLED', 'True').lower() == 'true'
+    DEAD_LETTER_PATH = os.getenv('DEAD_LETTER_PATH', 'state/dead_letters.db')
+    DEAD_LETTER_REPLAY_RATE = float(os.getenv('DEAD_LETTER_REPLAY_RATE', 2))  # Replays per second per worker process
+    
+    # Token Usage Accounting
+    USAGE_TRACKING_ENABLED = os.getenv('USAGE_TRACKING_ENABLED', 'True').lower() == 'true'
+    USAGE_DB_PATH = os.getenv('USAGE_DB_PATH', 'state/usage.db')
+    USAGE_RETENTION_DAYS = int(os.getenv('USAGE_RETENTION_DAYS', 7))  # Raw per-run records
+    USAGE_ROLLUP_RETENTION_DAYS = int(os.getenv('USAGE_ROLLUP_RETENTION_DAYS', 90))  # Hourly rollups
+    USAGE_PRICES = os.getenv('USAGE_PRICES', '')  # e.g. gpt-4o-mini=0.15:0.60 (USD per 1M prompt:completion tokens)
+    
+    # Health Checks
+    HEALTH_CACHE_SECONDS = int(os.getenv('HEALTH_CACHE_SECONDS', 5))  # How long readiness results are reused
+    HEALTH_PROBE_INTERVAL = int(os.getenv('HEALTH_PROBE_INTERVAL', 60))  # Ping OpenAI/Graph if idle this long
+    HEALTH_PROBE_TIMEOUT = int(os.getenv('HEALTH_PROBE_TIMEOUT', 5))
+    HEALTH_MIN_FREE_MB = int(os.getenv('HEALTH_MIN_FREE_MB', 500))
+    HEALTH_MAX_BACKLOG_RATIO = float(os.getenv('HEALTH_MAX_BACKLOG_RATIO', 0.9))  # Of MAX_PENDING_JOBS
+    
+    # Tracing Configuration
+    TRACING_ENABLED = os.getenv('TRACING_ENABLED', 'False').lower() == 'true'
+    TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', 0.1))  # Fraction of inbound messages traced
+    TRACE_EXPORT_PATH = os.getenv('TRACE_EXPORT_PATH', 'logs/traces.jsonl')
+    
+    # Profiling Configuration
+    PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', 'False').lower() == 'true'  # Start sampling at startup
+    PROFILE_INTERVAL_MS = int(os.getenv('PROFILE_INTERVAL_MS', 10))
+    PROFILE_DURATION = int(os.getenv('PROFILE_DURATION', 300))  # Seconds; 0 samples until stopped
+    PROFILE_DIRECTORY = os.getenv('PROFILE_DIRECTORY', 'profiles')
+    
     # Logging Configuration
     LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
     LOG_FILE = os.getenv('LOG_FILE', 'logs/chatbot.log')
@@ -83,7 +184,8 @@ class Config:
     def get_chat_file_path(cls, phone_number):
         """Get chat file path for a phone number"""
         safe_number = phone_number.replace('+', '').replace(' ', '').replace('-', '')
-        return os.path.join(cls.CHAT_DIRECTORY, f"chat_{safe_number}.txt")
+        extension = '.msgpack' if cls.CHAT_RECORD_FORMAT == 'msgpack' else '.jsonl'
+        return os.path.join(cls.CHAT_DIRECTORY, f"chat_{safe_number}{extension}")
 
 class DevelopmentConfig(Config):
     """Development configuration"""
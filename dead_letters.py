@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""
+Dead-letter store for WhatsApp ChatBot
+
+Replies that fail for good would otherwise only be logged. They are kept in
+SQLite with enough context to try again:
+
+- ``reply_failed``: no reply was generated (engine error, or the deferred
+  queue was full). Replaying schedules the customer's message again.
+- ``send_failed``: a reply was generated but the Graph API did not accept
+  it. Replaying sends the saved reply again.
+
+Entries start as ``pending``. Queuing them for replay (admin endpoint or this
+module's CLI) marks them ``queued``; every app worker runs a replayer that
+claims queued entries one at a time, at a limited rate, and hands them to the
+worker pool. A replay that fails again becomes a new dead letter.
+
+    python dead_letters.py list --kind send_failed
+    python dead_letters.py replay --all
+    python dead_letters.py discard 12 13
+"""
+
+import os
+import time
+import sqlite3
+import threading
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dead_letters (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    kind TEXT NOT NULL,
+    tenant TEXT,
+    phone_number TEXT NOT NULL,
+    message TEXT,
+    reply TEXT,
+    error TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS dead_letters_status ON dead_letters(status, id);
+"""
+
+KINDS = ('reply_failed', 'send_failed')
+STATUSES = ('pending', 'queued', 'replaying', 'replayed', 'discarded')
+
+# A replaying entry whose worker died is queued again after this long
+CLAIM_TIMEOUT = 300
+
+
+class DeadLetterStore:
+    """SQLite table of failed replies"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(SCHEMA)
+
+    def add(self, kind, phone_number, tenant=None, message=None, reply=None, error=None):
+        """Record a failed reply, returning its id"""
+        now = time.time()
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                'INSERT INTO dead_letters (created_at, updated_at, kind, tenant, phone_number, message, reply, error)'
+                ' VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (now, now, kind, tenant, phone_number, message, reply, error)
+            )
+        print(f"☠️  Dead letter #{cursor.lastrowid} ({kind}) for {phone_number}: {error}")
+        return cursor.lastrowid
+
+    @staticmethod
+    def _where(ids=None, status=None, kind=None, tenant=None):
+        conditions, params = [], []
+        if ids:
+            conditions.append(f"id IN ({', '.join('?' * len(ids))})")
+            params.extend(ids)
+        if status:
+            conditions.append('status = ?')
+            params.append(status)
+        if kind:
+            conditions.append('kind = ?')
+            params.append(kind)
+        if tenant:
+            conditions.append('tenant = ?')
+            params.append(tenant)
+        return (' WHERE ' + ' AND '.join(conditions)) if conditions else '', params
+
+    def list(self, status=None, kind=None, tenant=None, limit=50, offset=0):
+        """Entries matching the filters, oldest first"""
+        where, params = self._where(status=status, kind=kind, tenant=tenant)
+        with self._lock:
+            rows = self._conn.execute(
+                f'SELECT * FROM dead_letters{where} ORDER BY id LIMIT ? OFFSET ?',
+                params + [limit, offset]
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def get(self, entry_id):
+        with self._lock:
+            row = self._conn.execute('SELECT * FROM dead_letters WHERE id = ?', (entry_id,)).fetchone()
+        return dict(row) if row else None
+
+    def counts(self):
+        """Number of entries by status and kind"""
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT status, kind, COUNT(*) FROM dead_letters GROUP BY status, kind'
+            ).fetchall()
+        counts = {}
+        for status, kind, count in rows:
+            counts.setdefault(status, {})[kind] = count
+        return counts
+
+    def queue(self, ids=None, kind=None, tenant=None):
+        """Queue entries for replay: the given ids, or every pending entry matching the filters"""
+        status = None if ids else 'pending'
+        where, params = self._where(ids, status, kind, tenant)
+        where += (' AND' if where else ' WHERE') + " status NOT IN ('queued', 'replaying')"
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                f"UPDATE dead_letters SET status = 'queued', updated_at = ?{where}",
+                [time.time()] + params
+            )
+        return cursor.rowcount
+
+    def discard(self, ids=None, kind=None, tenant=None):
+        """Discard the given ids, or every pending entry matching the filters"""
+        status = None if ids else 'pending'
+        where, params = self._where(ids, status, kind, tenant)
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                f"UPDATE dead_letters SET status = 'discarded', updated_at = ?{where}",
+                [time.time()] + params
+            )
+        return cursor.rowcount
+
+    def claim(self):
+        """Take the oldest queued entry for replay, or None"""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute('BEGIN IMMEDIATE')  # Other workers claim from the same table
+            row = self._conn.execute(
+                "SELECT * FROM dead_letters WHERE status = 'queued'"
+                " OR (status = 'replaying' AND updated_at < ?) ORDER BY id LIMIT 1",
+                (now - CLAIM_TIMEOUT,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE dead_letters SET status = 'replaying', updated_at = ? WHERE id = ?",
+                (now, row['id'])
+            )
+        return dict(row)
+
+    def finish(self, entry_id, replayed):
+        """Mark a claimed entry replayed, or put it back in the queue"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                'UPDATE dead_letters SET status = ?, attempts = attempts + ?, updated_at = ? WHERE id = ?',
+                ('replayed' if replayed else 'queued', 1 if replayed else 0, time.time(), entry_id)
+            )
+
+
+class DeadLetterReplayer:
+    """Replays queued dead letters at a limited rate"""
+
+    def __init__(self, store, handlers, rate=2, poll_interval=5):
+        """handlers maps kind -> (handler(entry) returning True once accepted, breaker)"""
+        self.store = store
+        self.handlers = handlers
+        self.rate = rate
+        self.poll_interval = poll_interval
+        self.replayed = 0
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='dead-letter-replay', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                entry = self.store.claim()
+            except sqlite3.Error as e:
+                print(f"⚠️  Could not claim dead letters: {e}")
+                entry = None
+            if entry is None:
+                time.sleep(self.poll_interval)
+                continue
+
+            handler, breaker = self.handlers[entry['kind']]
+            accepted = False
+            if breaker.state != breaker.OPEN:
+                try:
+                    accepted = handler(entry)
+                except Exception as e:
+                    print(f"❌ Error replaying dead letter #{entry['id']}: {e}")
+            self.store.finish(entry['id'], accepted)
+            if accepted:
+                self.replayed += 1
+                print(f"🔁 Replayed dead letter #{entry['id']} ({entry['kind']}) for {entry['phone_number']}")
+                time.sleep(1 / self.rate)
+            else:
+                time.sleep(self.poll_interval)  # Upstream down or worker pool full; try again later
+
+    def get_stats(self):
+        return {
+            'rate_per_second': self.rate,
+            'replayed': self.replayed,
+            'entries': self.store.counts(),
+        }
+
+
+def main():
+    """Inspect, replay or discard dead letters from the command line"""
+    import argparse
+    import json
+    from datetime import datetime
+
+    parser = argparse.ArgumentParser(description="Dead-letter store of failed replies")
+    parser.add_argument('command', choices=['list', 'show', 'replay', 'discard', 'stats'])
+    parser.add_argument('ids', nargs='*', type=int, help="entry ids (replay/discard/show)")
+    parser.add_argument('--status', choices=STATUSES, help="list: only entries with this status")
+    parser.add_argument('--kind', choices=KINDS, help="only entries of this kind")
+    parser.add_argument('--tenant', help="only entries of this tenant")
+    parser.add_argument('--all', action='store_true', help="replay/discard every pending entry matching the filters")
+    parser.add_argument('--limit', type=int, default=50)
+    args = parser.parse_args()
+
+    from config import Config
+    store = DeadLetterStore(Config.DEAD_LETTER_PATH)
+
+    if args.command == 'list':
+        for entry in store.list(args.status, args.kind, args.tenant, args.limit):
+            created = datetime.fromtimestamp(entry['created_at']).strftime('%Y-%m-%d %H:%M:%S')
+            text = entry['reply'] if entry['kind'] == 'send_failed' else entry['message']
+            print(f"#{entry['id']} [{created}] {entry['status']:<9} {entry['kind']:<12} "
+                  f"{entry['tenant'] or '-'}/{entry['phone_number']}: {(text or '')[:60]!r}  ({entry['error']})")
+    elif args.command == 'show':
+        for entry_id in args.ids:
+            print(json.dumps(store.get(entry_id), indent=2, ensure_ascii=False))
+    elif args.command == 'stats':
+        print(json.dumps(store.counts(), indent=2))
+    else:
+        if not args.ids and not args.all:
+            parser.error(f"{args.command} needs entry ids or --all")
+        action = store.queue if args.command == 'replay' else store.discard
+        count = action(args.ids or None, args.kind, args.tenant)
+        if args.command == 'replay':
+            print(f"🔁 Queued {count} dead letter(s); running app workers replay them")
+        else:
+            print(f"🗑️  Discarded {count} dead letter(s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,13 +2,19 @@
 """
 WhatsApp API Debug Script
 This script helps diagnose issues with WhatsApp message sending
+
+Run with --probe to measure network latency to the Graph API and OpenAI
+instead (see netprobe.py for the options).
 """
 
 import os
+import argparse
 import requests
 import json
 from dotenv import load_dotenv
 
+import netprobe
+
 # Load environment variables
 load_dotenv()
 
@@ -126,8 +132,24 @@ def test_send_message(test_phone_number):
         print(f"❌ Error sending message: {e}")
         return False
 
+def run_latency_probe(args):
+    """Measure where request time goes on the way to the upstream APIs"""
+    print("⏱️  Network Latency Probe")
+    print("=" * 50)
+    print(f"   {args.requests} requests per endpoint, {args.concurrency} concurrent, "
+          f"{'new connection per request' if args.no_reuse else 'keep-alive'}")
+    endpoints = netprobe.upstream_endpoints(WHATSAPP_TOKEN, WHATSAPP_PHONE_NUMBER_ID, os.getenv('OPENAI_API_KEY'))
+    netprobe.probe_endpoints(args, endpoints)
+
 def main():
     """Run all diagnostic tests"""
+    parser = argparse.ArgumentParser(description="Diagnose WhatsApp message sending")
+    netprobe.add_probe_arguments(parser)
+    args = parser.parse_args()
+    if args.probe:
+        run_latency_probe(args)
+        return
+    
     print("🔍 WhatsApp API Diagnostic Tool")
     print("=" * 50)
     
@@ -0,0 +1,128 @@
+"""
+Reply delivery helpers for WhatsApp ChatBot
+
+Customers otherwise see nothing until the whole reply is ready. ReadReceipts
+marks inbound messages as read and shows the typing indicator as soon as a
+reply is being generated, on background threads so the webhook is not held
+up by Graph API calls. Receipts for a conversation are coalesced: marking the
+newest message as read also marks everything before it, so a burst of
+messages costs one call.
+
+split_reply breaks a long answer into WhatsApp-sized parts at paragraph or
+sentence boundaries so they can be sent one after another.
+"""
+
+import re
+import threading
+from collections import OrderedDict
+
+
+# WhatsApp rejects text bodies longer than this
+MAX_MESSAGE_CHARS = 4096
+
+SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+
+
+def split_reply(text, max_chars=MAX_MESSAGE_CHARS):
+    """Split text into parts of at most max_chars, preferring paragraph, then sentence, then word breaks"""
+    parts = []
+    text = text.strip()
+    while len(text) > max_chars:
+        window = text[:max_chars + 1]
+        cut = window.rfind('\n\n')
+        if cut <= 0:
+            cut = window.rfind('\n')
+        if cut <= 0:
+            ends = [match.start() for match in SENTENCE_END.finditer(window)]
+            cut = ends[-1] if ends else -1
+        if cut <= 0:
+            cut = window.rfind(' ')
+        if cut <= 0:
+            cut = max_chars
+        parts.append(text[:cut].rstrip())
+        text = text[cut:].lstrip()
+    if text:
+        parts.append(text)
+    return parts
+
+
+class ReadReceipts:
+    """Sends read receipts and typing indicators for inbound messages in the background"""
+
+    def __init__(self, send, workers=2, max_tracked=10000):
+        """send(tenant, phone_number, wamid, typing) makes the Graph API call and returns True on success"""
+        self.send = send
+        self.max_tracked = max_tracked
+        self._cond = threading.Condition()
+        self._pending = OrderedDict()  # (tenant, phone) -> (wamid, typing)
+        self._latest = OrderedDict()  # (tenant, phone) -> newest inbound wamid
+        self._closed = False
+        self.stats = {'requested': 0, 'coalesced': 0, 'sent': 0, 'typing': 0, 'failed': 0}
+        for index in range(workers):
+            threading.Thread(target=self._run, name=f"read-receipts-{index}", daemon=True).start()
+
+    def received(self, phone_number, wamid, tenant=None):
+        """Remember the newest inbound message of a conversation, to be marked read later"""
+        if not wamid:
+            return
+        key = (tenant, phone_number)
+        with self._cond:
+            self._latest[key] = wamid
+            self._latest.move_to_end(key)
+            while len(self._latest) > self.max_tracked:
+                self._latest.popitem(last=False)
+
+    def mark_read(self, phone_number, tenant=None, typing=False):
+        """Mark the conversation's newest message (and every earlier one) as read
+
+        With typing, the typing indicator is shown until the reply arrives or
+        for about 25 seconds.
+        """
+        key = (tenant, phone_number)
+        with self._cond:
+            wamid = self._latest.get(key)
+            if wamid is None:
+                return
+            self.stats['requested'] += 1
+            if key in self._pending:
+                self.stats['coalesced'] += 1
+                typing = typing or self._pending[key][1]
+            self._pending[key] = (wamid, typing)
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                (tenant, phone_number), (wamid, typing) = self._pending.popitem(last=False)
+
+            try:
+                sent = self.send(tenant, phone_number, wamid, typing)
+            except Exception as e:
+                print(f"⚠️  Could not send read receipt to {phone_number}: {e}")
+                sent = False
+
+            with self._cond:
+                if sent:
+                    self.stats['sent'] += 1
+                    if typing:
+                        self.stats['typing'] += 1
+                else:
+                    self.stats['failed'] += 1
+
+    def close(self):
+        """Stop sending; receipts still pending are dropped"""
+        with self._cond:
+            self._closed = True
+            self._pending.clear()
+            self._cond.notify_all()
+
+    def get_stats(self):
+        with self._cond:
+            return {
+                'pending': len(self._pending),
+                **self.stats,
+            }
@@ -80,6 +80,9 @@ setup_python_env() {
     pip install --upgrade pip
     pip install -r requirements.txt
     
+    # Convert legacy text chat files now rather than on the first webhook for each number
+    python chat_records.py migrate
+    
     print_status "Python environment setup complete"
 }
 
@@ -98,7 +101,12 @@ User=$USER
 Group=$USER
 WorkingDirectory=$APP_DIR
 Environment=PATH=$APP_DIR/venv/bin
-ExecStart=$APP_DIR/venv/bin/gunicorn -w 4 -b 127.0.0.1:5000 app:app
+ExecStart=$APP_DIR/venv/bin/gunicorn -c gunicorn.conf.py app:app
+# HUP starts fresh workers and drains the old ones without dropping requests
+ExecReload=/bin/kill -s HUP \$MAINPID
+# Only the gunicorn master gets SIGTERM; it drains its workers within graceful_timeout
+KillMode=mixed
+TimeoutStopSec=60
 Restart=always
 RestartSec=3
 
@@ -167,7 +175,8 @@ start_services() {
     print_status "Starting services..."
     
     cd $APP_DIR
-    sudo systemctl start $SERVICE_NAME
+    # Reload a running service so in-flight replies are drained rather than killed
+    sudo systemctl reload-or-restart $SERVICE_NAME
     sudo systemctl restart nginx
     
     print_status "Services started"
@@ -203,8 +212,8 @@ show_summary() {
     echo "1. Update your .env file with the correct API keys:"
     echo "   sudo nano $APP_DIR/.env"
     echo ""
-    echo "2. Restart the service after updating environment:"
-    echo "   sudo systemctl restart $SERVICE_NAME"
+    echo "2. Reload the service after updating environment (drains in-flight replies):"
+    echo "   sudo systemctl reload $SERVICE_NAME"
     echo ""
     echo "3. Configure your WhatsApp webhook URL in Meta Developer Console:"
     echo "   Webhook URL: https://$DOMAIN/webhook"
@@ -0,0 +1,33 @@
+"""
+Gunicorn settings for WhatsApp ChatBot
+
+Workers get SHUTDOWN_DEADLINE seconds to finish in-flight replies, plus time
+to persist and flush, before gunicorn kills them on stop or reload (HUP).
+"""
+
+import sys
+
+from config import Config
+
+bind = '127.0.0.1:5000'
+# With SHARDING_MODE=local each worker owns one conversation shard; with http the
+# whole instance is one shard, so a single worker keeps each conversation in one process
+if Config.SHARDING_MODE == 'local':
+    workers = Config.SHARD_COUNT
+elif Config.SHARDING_MODE == 'http':
+    workers = 1
+else:
+    workers = 4
+graceful_timeout = Config.SHUTDOWN_DEADLINE + 10
+
+
+def post_worker_init(worker):
+    """Start the background work only serving workers do, such as journal recovery"""
+    sys.modules['app'].start_serving()
+
+
+def worker_exit(server, worker):
+    """Drain the exiting worker's reply jobs and persist what is left"""
+    app_module = sys.modules.get('app')
+    if app_module is not None:
+        app_module.shutdown_coordinator.shutdown(f"worker {worker.pid} exit")
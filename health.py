@@ -0,0 +1,105 @@
+"""
+Health probes for WhatsApp ChatBot
+
+Readiness depends on upstream APIs and the local disk. Checking those on
+every poll would make the health endpoint itself a source of load, so each
+probe caches its result for a few seconds and only one caller refreshes an
+expired result while the others keep getting the previous one.
+"""
+
+import time
+import shutil
+import threading
+
+
+class CachedProbe:
+    """Runs a check at most once per ttl seconds and shares the result"""
+
+    def __init__(self, name, check, ttl):
+        """check() returns a dict with an 'ok' key, or raises to report failure"""
+        self.name = name
+        self.check = check
+        self.ttl = ttl
+        self.runs = 0
+        self._lock = threading.Lock()
+        self._result = None
+        self._checked_at = 0.0
+
+    def _fresh(self):
+        return self._result is not None and time.monotonic() - self._checked_at < self.ttl
+
+    def get(self):
+        if self._fresh():
+            return self._result
+        # Only the first caller waits; the rest are served the stale result meanwhile
+        if not self._lock.acquire(blocking=self._result is None):
+            return self._result
+        try:
+            if self._fresh():
+                return self._result
+            started = time.perf_counter()
+            try:
+                result = dict(self.check())
+            except Exception as e:
+                result = {'ok': False, 'error': str(e)}
+            result['checked_at'] = time.time()
+            result['probe_ms'] = round((time.perf_counter() - started) * 1000, 3)
+            self._result = result
+            self._checked_at = time.monotonic()
+            self.runs += 1
+            return result
+        finally:
+            self._lock.release()
+
+
+def disk_check(paths, min_free_bytes):
+    """Check that every path's filesystem has at least min_free_bytes free"""
+    def check():
+        volumes = {}
+        for path in paths:
+            usage = shutil.disk_usage(path)
+            volumes[path] = {
+                'free_bytes': usage.free,
+                'total_bytes': usage.total,
+                'free_percent': round(usage.free / usage.total * 100, 1) if usage.total else None,
+            }
+        return {
+            'ok': all(volume['free_bytes'] >= min_free_bytes for volume in volumes.values()),
+            'min_free_bytes': min_free_bytes,
+            'volumes': volumes,
+        }
+    return check
+
+
+def ping_check(ping):
+    """Wrap a function that raises on failure as a probe check"""
+    def check():
+        ping()
+        return {'ok': True}
+    return check
+
+
+def upstream_status(breaker, ping_probe, max_age):
+    """Status of an upstream API from its circuit breaker
+
+    Traffic keeps last_success_at current, so the (cached) ping probe is
+    only consulted when the last successful call is older than max_age.
+    """
+    stats = breaker.get_stats()
+    result = {
+        'circuit': stats['state'],
+        'last_success_at': stats['last_success_at'],
+        'last_failure_at': stats['last_failure_at'],
+        'last_error': stats['last_error'],
+    }
+    if stats['state'] == breaker.OPEN:
+        result['ok'] = False
+        return result
+
+    last_success = stats['last_success_at']
+    if last_success is None or time.time() - last_success > max_age:
+        result['ping'] = ping_probe.get()
+        result['ok'] = result['ping']['ok']
+    else:
+        result['ok'] = True
+    return result
@@ -0,0 +1,152 @@
+"""
+Recent chat history cache for WhatsApp ChatBot
+
+Building a reply's context, the chat history endpoint and search
+reindexing all read the latest messages of a conversation. RecentHistory
+keeps the last N records of active conversations in memory, fed by
+ChatManager.save_message, so those reads rarely touch the chat file.
+
+Memory is bounded twice: each conversation keeps at most N records, and when
+the estimated size of all cached records exceeds the byte cap, the least
+recently used conversations are dropped.
+
+An entry remembers the size of its chat file when it last matched the file's
+tail. If the file has grown or shrunk since (another worker process wrote to
+it, or it was rewritten), the entry is reloaded from disk instead of serving
+stale history.
+"""
+
+import os
+import sys
+import threading
+from collections import OrderedDict, deque
+
+import chat_records
+
+
+def record_size(record):
+    """Approximate memory used by a record dict and its values"""
+    return sys.getsizeof(record) + sum(sys.getsizeof(value) for value in record.values())
+
+
+def file_size(path):
+    try:
+        return os.path.getsize(path)
+    except FileNotFoundError:
+        return 0
+
+
+class CachedHistory:
+    """Last records of one chat file"""
+
+    __slots__ = ('records', 'nbytes', 'file_size', 'complete')
+
+    def __init__(self, records, file_size, complete):
+        self.records = deque(records)
+        self.nbytes = sum(record_size(record) for record in self.records)
+        self.file_size = file_size
+        self.complete = complete  # The file holds no older records than these
+
+
+class RecentHistory:
+    """LRU cache of the most recent records of each chat file"""
+
+    def __init__(self, max_messages=50, max_bytes=64 * 1024 * 1024):
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # chat file path -> CachedHistory
+        self.nbytes = 0
+        self.stats = {'hits': 0, 'misses': 0, 'stale': 0, 'evictions': 0}
+
+    def _remove(self, path):
+        entry = self._entries.pop(path, None)
+        if entry is not None:
+            self.nbytes -= entry.nbytes
+
+    def _store(self, path, entry):
+        self._remove(path)
+        self._entries[path] = entry
+        self.nbytes += entry.nbytes
+        self._trim(entry)
+
+    def _trim(self, entry):
+        """Drop the oldest records beyond max_messages and the LRU entries beyond max_bytes"""
+        while len(entry.records) > self.max_messages:
+            old = entry.records.popleft()
+            entry.nbytes -= record_size(old)
+            self.nbytes -= record_size(old)
+            entry.complete = False
+        while self.nbytes > self.max_bytes and len(self._entries) > 1:
+            _, evicted = self._entries.popitem(last=False)
+            self.nbytes -= evicted.nbytes
+            self.stats['evictions'] += 1
+
+    def append(self, path, record, size_before, size_after):
+        """Record a message just appended to path, which grew from size_before to size_after bytes"""
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None:
+                # A new conversation starts a complete entry; otherwise we only know the newest record
+                entry = CachedHistory([], size_before, size_before == 0)
+                self._entries[path] = entry
+            elif entry.file_size != size_before:
+                # Someone else wrote to the file in between; reload on the next read
+                self._remove(path)
+                self.stats['stale'] += 1
+                return
+
+            self._entries.move_to_end(path)
+            entry.records.append(record)
+            size = record_size(record)
+            entry.nbytes += size
+            self.nbytes += size
+            entry.file_size = size_after
+            self._trim(entry)
+
+    def read(self, path, limit=None):
+        """Last limit records of a chat file (all records if limit is None), from memory when possible"""
+        current_size = file_size(path)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry.file_size != current_size:
+                self._remove(path)
+                self.stats['stale'] += 1
+                entry = None
+            if entry is not None and (entry.complete or (limit is not None and limit <= len(entry.records))):
+                self._entries.move_to_end(path)
+                self.stats['hits'] += 1
+                records = list(entry.records)
+                if limit is None:
+                    return records
+                return records[-limit:] if limit > 0 else []
+            self.stats['misses'] += 1
+
+        if current_size == 0:
+            return []
+
+        # Cold history: read the file, keeping its tail for the next read
+        if limit is None:
+            records = list(chat_records.iter_records(path))
+            complete = len(records) <= self.max_messages
+        else:
+            wanted = max(limit, self.max_messages)
+            records = chat_records.tail_records(path, wanted)
+            complete = len(records) < wanted and len(records) <= self.max_messages
+        with self._lock:
+            self._store(path, CachedHistory(records[-self.max_messages:], current_size, complete))
+        if limit is None:
+            return records
+        return records[-limit:] if limit > 0 else []
+
+    def get_stats(self):
+        with self._lock:
+            lookups = self.stats['hits'] + self.stats['misses']
+            return {
+                'conversations': len(self._entries),
+                'bytes': self.nbytes,
+                'max_bytes': self.max_bytes,
+                'max_messages': self.max_messages,
+                'hit_ratio': round(self.stats['hits'] / lookups, 4) if lookups else None,
+                **self.stats,
+            }
@@ -0,0 +1,225 @@
+"""
+Local intent routing for WhatsApp ChatBot
+
+Greetings, thanks, acknowledgements and keyword commands do not need an
+Assistants run. The intent router matches each inbound message against rules
+loaded from a JSON file (INTENT_RULES_FILE) and answers matches locally:
+
+    {
+      "intents": [
+        {"name": "greeting", "keywords": ["hi", "hello"], "reply": "Hi! How can I help?"},
+        {"name": "thanks", "patterns": ["thanks?( you)?( so much)?"], "reply": "You're welcome!"},
+        {"name": "emoji", "emoji_only": true, "action": "ignore"},
+        {"name": "stop", "keywords": ["stop"], "action": "opt_out", "reply": "Unsubscribed. Send START to resume."}
+      ]
+    }
+
+Rules match the whole message after normalisation (case folded, surrounding
+punctuation and repeated spaces removed), so "Thanks!!" matches but "thanks,
+where is my order?" still goes to the assistant. Keywords are a dict lookup
+and all patterns are compiled into one regex, so a message is routed with a
+single pass whatever the number of rules.
+
+Actions:
+
+- ``reply`` (default): send the canned reply.
+- ``ignore``: save the message without replying.
+- ``opt_out``: send the reply, then ignore the number until it opts back in.
+- ``opt_in``: clear an opt-out and send the reply.
+
+Opt-outs are appended to a small log file so every worker process sees them.
+"""
+
+import os
+import re
+import json
+import time
+import threading
+import unicodedata
+from collections import Counter, namedtuple
+
+
+ACTIONS = ('reply', 'ignore', 'opt_out', 'opt_in')
+
+Intent = namedtuple('Intent', 'name action reply')
+
+# Matched by a message from an opted-out number
+OPTED_OUT = Intent('opted_out', 'ignore', None)
+
+# Characters that may accompany emoji: skin tones, variation selectors, joiners
+EMOJI_MODIFIER_CATEGORIES = ('Sk', 'Mn', 'Me', 'Cf')
+
+
+def normalize(text):
+    """Case-folded text without surrounding punctuation or repeated whitespace"""
+    text = ' '.join(text.casefold().split())
+    return text.strip(' .,!?¡¿;:-~*')
+
+
+def is_emoji_only(text):
+    """True if text consists only of symbols such as emoji (and whitespace)"""
+    has_symbol = False
+    for ch in text:
+        if ch.isspace():
+            continue
+        category = unicodedata.category(ch)
+        if category == 'So':
+            has_symbol = True
+        elif category not in EMOJI_MODIFIER_CATEGORIES:
+            return False
+    return has_symbol
+
+
+class OptOutList:
+    """Opted-out phone numbers, shared between processes through an append-only log"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._phones = set()
+        self._offset = 0
+
+    def _refresh(self):
+        """Apply entries appended since the last read (by any process)"""
+        try:
+            size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            return
+        if size < self._offset:
+            self._phones.clear()  # Log was truncated or replaced
+            self._offset = 0
+        if size == self._offset:
+            return
+
+        with open(self.path, 'rb') as f:
+            f.seek(self._offset)
+            data = f.read(size - self._offset)
+        complete = data.rfind(b'\n') + 1  # Leave a partially written line for the next read
+        for line in data[:complete].splitlines():
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if entry.get('opted_out'):
+                self._phones.add(entry['phone_number'])
+            else:
+                self._phones.discard(entry['phone_number'])
+        self._offset += complete
+
+    def __contains__(self, phone_number):
+        with self._lock:
+            self._refresh()
+            return phone_number in self._phones
+
+    def __len__(self):
+        with self._lock:
+            self._refresh()
+            return len(self._phones)
+
+    def set(self, phone_number, opted_out):
+        line = json.dumps({'phone_number': phone_number, 'opted_out': opted_out, 'timestamp': time.time()}) + '\n'
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            # O_APPEND keeps single-line writes from different workers from interleaving
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line.encode('utf-8'))
+            finally:
+                os.close(fd)
+            self._refresh()
+
+
+class IntentRouter:
+    """Matches trivial messages to canned replies and actions"""
+
+    def __init__(self, intents, opt_outs=None):
+        """intents: rule dicts as in the rules file; opt_outs: OptOutList for opt_out/opt_in actions"""
+        self.opt_outs = opt_outs
+        self._keywords = {}
+        self._emoji_intent = None
+        self._intents = []
+        alternatives = []
+
+        for index, rule in enumerate(intents):
+            action = rule.get('action', 'reply')
+            if action not in ACTIONS:
+                raise ValueError(f"Intent {rule.get('name')!r} has unknown action {action!r}. Use one of {', '.join(ACTIONS)}")
+            if action == 'reply' and not rule.get('reply'):
+                raise ValueError(f"Intent {rule.get('name')!r} needs a reply")
+            intent = Intent(rule.get('name') or f"intent_{index}", action, rule.get('reply'))
+            self._intents.append(intent)
+
+            for keyword in rule.get('keywords', []):
+                # The first rule to claim a keyword wins, as it would for patterns
+                self._keywords.setdefault(normalize(keyword), intent)
+            for pattern in rule.get('patterns', []):
+                re.compile(pattern)  # Report a bad pattern against its own rule
+                alternatives.append(f"(?P<i{len(self._intents) - 1}>{pattern})")
+            if rule.get('emoji_only') and self._emoji_intent is None:
+                self._emoji_intent = intent
+
+        self._pattern = re.compile('|'.join(alternatives), re.IGNORECASE) if alternatives else None
+        self._lock = threading.Lock()
+        self.stats = {'messages': 0, 'absorbed': 0, 'match_seconds': 0.0}
+        self.matches = Counter()
+
+    @classmethod
+    def load(cls, path, opt_out_path=None):
+        """Router for the rules in path, or None if there is no rules file"""
+        if not path or not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            intents = json.load(f).get('intents', [])
+        router = cls(intents, OptOutList(opt_out_path) if opt_out_path else None)
+        print(f"✅ Loaded {len(intents)} intent rule(s) from {path}")
+        return router
+
+    def match(self, text):
+        """Intent whose rule matches the whole message, or None"""
+        normalized = normalize(text)
+        intent = self._keywords.get(normalized)
+        if intent is None and self._pattern is not None:
+            found = self._pattern.fullmatch(normalized)
+            if found is not None:
+                intent = self._intents[int(found.lastgroup[1:])]
+        if intent is None and self._emoji_intent is not None and is_emoji_only(text):
+            intent = self._emoji_intent
+        return intent
+
+    def route(self, phone_number, text):
+        """Intent to handle the message locally, or None if it needs the assistant
+
+        opt_out/opt_in actions are applied here; messages from opted-out numbers
+        match OPTED_OUT unless they opt back in.
+        """
+        started = time.perf_counter()
+        intent = self.match(text)
+        if self.opt_outs is not None:
+            if intent is not None and intent.action in ('opt_out', 'opt_in'):
+                self.opt_outs.set(phone_number, intent.action == 'opt_out')
+            elif phone_number in self.opt_outs:
+                intent = OPTED_OUT
+        elapsed = time.perf_counter() - started
+
+        with self._lock:
+            self.stats['messages'] += 1
+            self.stats['match_seconds'] += elapsed
+            if intent is not None:
+                self.stats['absorbed'] += 1
+                self.matches[intent.name] += 1
+        return intent
+
+    def get_stats(self):
+        with self._lock:
+            messages = self.stats['messages']
+            return {
+                'rules': len(self._intents),
+                'messages': messages,
+                'absorbed': self.stats['absorbed'],
+                'absorbed_ratio': round(self.stats['absorbed'] / messages, 4) if messages else 0.0,
+                'avg_match_us': round(self.stats['match_seconds'] / messages * 1e6, 2) if messages else None,
+                'matches': dict(self.matches),
+                'opted_out': len(self.opt_outs) if self.opt_outs is not None else None,
+            }
@@ -0,0 +1,212 @@
+"""
+Media pipeline for WhatsApp ChatBot
+
+Inbound images, voice notes, videos, documents and stickers arrive as Graph
+API media IDs. The pipeline resolves each ID to a download URL, streams the
+file to disk in chunks, stores it under its SHA-256 (so repeated media is
+kept once) and hands a text description of it to the reply pipeline. The
+engine does not see image, video or document content, only a placeholder
+with the caption; voice notes can be transcribed (MEDIA_TRANSCRIBE_AUDIO).
+
+Downloads run on their own small bounded pool so that large voice notes never
+occupy the workers that answer text messages.
+"""
+
+import os
+import hashlib
+import mimetypes
+import tempfile
+import threading
+
+import requests
+
+from resilience import BoundedExecutor
+from tracing import tracer
+
+
+# WhatsApp message types that carry a downloadable media object
+MEDIA_TYPES = ('image', 'audio', 'video', 'document', 'sticker')
+
+# How each type is named in the description passed to the response engine
+MEDIA_LABELS = {'audio': 'audio file'}
+
+GRAPH_API_BASE = "https://graph.facebook.com/v18.0"
+
+
+class MediaTooLarge(Exception):
+    """Raised when a media file exceeds the configured size cap"""
+
+
+class MediaPipeline:
+    """Downloads inbound media and passes a description of it on for a reply"""
+
+    def __init__(self, config, token, breaker, on_ready, client=None, session=None):
+        """on_ready(phone_number, message_text, trace_span, tenant) is called once the media is stored"""
+        self.config = config
+        self.token = token
+        self.breaker = breaker
+        self.on_ready = on_ready
+        self.client = client
+        self.session = session or requests.Session()
+        self.directory = config.MEDIA_DIRECTORY
+        os.makedirs(self.directory, exist_ok=True)
+        self.pool = BoundedExecutor(config.MEDIA_DOWNLOAD_WORKERS, config.MEDIA_MAX_PENDING, name='media-download')
+        self._lock = threading.Lock()
+        self.stats = {
+            'downloaded': 0,
+            'deduplicated': 0,
+            'too_large': 0,
+            'failed': 0,
+            'bytes_downloaded': 0,
+        }
+
+    def submit(self, phone_number, message, trace_span=None, token=None, tenant=None):
+        """Queue a media message for download, returning False if the download pool is full
+
+        token is the Graph API token of the tenant that received the message.
+        """
+        return self.pool.submit(self._process, phone_number, message, trace_span, token, tenant)
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self.stats[key] += amount
+
+    def _process(self, phone_number, message, trace_span=None, token=None, tenant=None):
+        message_type = message.get('type')
+        media = message.get(message_type, {})
+        caption = media.get('caption', '')
+
+        with tracer.span('media.download', parent=trace_span, message_type=message_type) as span:
+            try:
+                path, mime_type = self.download(media['id'], token)
+                span.set_attribute('mime_type', mime_type)
+                description = self.describe(message_type, media, caption, path, mime_type)
+            except MediaTooLarge as e:
+                self._count('too_large')
+                span.set_attribute('outcome', 'too_large')
+                print(f"⚠️  Skipping {message_type} from {phone_number}: {e}")
+                description = self.describe(message_type, media, caption)
+            except Exception as e:
+                self._count('failed')
+                span.set_attribute('outcome', 'failed')
+                print(f"❌ Error downloading {message_type} from {phone_number}: {e}")
+                description = self.describe(message_type, media, caption)
+
+        self.on_ready(phone_number, description, trace_span, tenant)
+
+    def resolve(self, media_id, token=None):
+        """Look up the download URL and metadata for a Graph API media ID"""
+        response = self.breaker.call_http(
+            self.session.get,
+            f"{GRAPH_API_BASE}/{media_id}",
+            headers={'Authorization': f'Bearer {token or self.token}'},
+            timeout=self.config.GRAPH_REQUEST_TIMEOUT
+        )
+        response.raise_for_status()
+        return response.json()
+
+    def download(self, media_id, token=None):
+        """Stream a media file to disk, returning (path, mime_type)
+
+        Files are named by the SHA-256 of their content, so a file that is
+        already stored is not written twice.
+        """
+        info = self.resolve(media_id, token)
+        mime_type = info.get('mime_type', 'application/octet-stream').split(';')[0].strip()
+        extension = mimetypes.guess_extension(mime_type) or '.bin'
+        max_bytes = self.config.MEDIA_MAX_BYTES
+
+        file_size = info.get('file_size')
+        if file_size and int(file_size) > max_bytes:
+            raise MediaTooLarge(f"{file_size} bytes exceeds the {max_bytes} byte limit")
+
+        # Graph reports the file's SHA-256, so known media needs no download
+        known_hash = info.get('sha256')
+        if known_hash:
+            existing = os.path.join(self.directory, f"{known_hash}{extension}")
+            if os.path.exists(existing):
+                self._count('deduplicated')
+                return existing, mime_type
+
+        digest = hashlib.sha256()
+        size = 0
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                with self.session.get(
+                    info['url'],
+                    headers={'Authorization': f'Bearer {token or self.token}'},
+                    stream=True,
+                    timeout=self.config.GRAPH_REQUEST_TIMEOUT
+                ) as response:
+                    response.raise_for_status()
+                    for chunk in response.iter_content(chunk_size=self.config.MEDIA_CHUNK_SIZE):
+                        size += len(chunk)
+                        if size > max_bytes:
+                            raise MediaTooLarge(f"download exceeded the {max_bytes} byte limit")
+                        digest.update(chunk)
+                        f.write(chunk)
+
+            path = os.path.join(self.directory, f"{digest.hexdigest()}{extension}")
+            if os.path.exists(path):
+                os.remove(temp_path)
+                self._count('deduplicated')
+            else:
+                os.replace(temp_path, path)
+                self._count('downloaded')
+                self._count('bytes_downloaded', size)
+            return path, mime_type
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def transcribe(self, path):
+        """Transcribe a voice note with OpenAI, or return None if transcription is off"""
+        if not self.config.MEDIA_TRANSCRIBE_AUDIO or not self.client:
+            return None
+        try:
+            with open(path, 'rb') as f:
+                result = self.client.audio.transcriptions.create(
+                    model=self.config.MEDIA_TRANSCRIPTION_MODEL,
+                    file=f,
+                    timeout=self.config.OPENAI_REQUEST_TIMEOUT
+                )
+            return result.text
+        except Exception as e:
+            print(f"⚠️  Could not transcribe {path}: {e}")
+            return None
+
+    def describe(self, message_type, media, caption, path=None, mime_type=None):
+        """Build the text the response engine sees for a media message
+
+        Only voice note transcripts and captions carry the content; images, videos
+        and documents reach the engine as a placeholder naming the stored file.
+        """
+        label = MEDIA_LABELS.get(message_type, message_type)
+        if media.get('voice'):
+            label = 'voice message'
+        elif message_type == 'document' and media.get('filename'):
+            label = f"document '{media['filename']}'"
+        label = f"{'an' if label[0] in 'aeiou' else 'a'} {label}"
+
+        if path is None:
+            description = f"[User sent {label} that could not be downloaded]"
+        elif message_type == 'audio':
+            transcript = self.transcribe(path)
+            if transcript:
+                description = f"[User sent {label}. Transcript: {transcript}]"
+            else:
+                description = f"[User sent {label} ({mime_type}), saved as {os.path.basename(path)}]"
+        else:
+            description = f"[User sent {label} ({mime_type}), saved as {os.path.basename(path)}]"
+
+        if caption:
+            description += f"\n{caption}"
+        return description
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+        stats['pool'] = self.pool.get_stats()
+        return stats
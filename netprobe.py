@@ -0,0 +1,303 @@
+"""
+Network latency probes for WhatsApp ChatBot
+
+Slow replies can come from this box, the network path or the upstream API.
+The probe sends repeated requests to an endpoint from several threads and
+times each phase separately:
+
+- dns: name resolution (getaddrinfo)
+- connect: TCP handshake, roughly one network round trip
+- tls: TLS handshake
+- ttfb: request sent until the response headers arrive
+
+Connections are kept alive between requests, so requests on a reused
+connection only pay for ttfb. Comparing the two shows how much the
+connection pool saves. ttfb on a reused connection minus the TCP connect
+time estimates how long the upstream took to answer.
+
+Used by ``debug_whatsapp.py --probe`` and ``check_config.py --probe``. URLs
+may be plain http:// for local stand-ins.
+"""
+
+import os
+import ssl
+import json
+import math
+import time
+import socket
+import threading
+import http.client
+from collections import Counter
+from urllib.parse import urlsplit
+
+
+PHASES = ('dns', 'connect', 'tls', 'ttfb_new', 'ttfb_reused')
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a list of numbers, or None if empty"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered), math.ceil(fraction * len(ordered))) - 1)
+    return ordered[index]
+
+
+def summarize(values):
+    """p50/p90/p99/max of durations in seconds, as milliseconds"""
+    if not values:
+        return None
+    return {
+        'count': len(values),
+        'p50_ms': round(percentile(values, 0.5) * 1000, 1),
+        'p90_ms': round(percentile(values, 0.9) * 1000, 1),
+        'p99_ms': round(percentile(values, 0.99) * 1000, 1),
+        'max_ms': round(max(values) * 1000, 1),
+    }
+
+
+class ProbeConnection:
+    """One keep-alive connection whose setup phases are timed"""
+
+    def __init__(self, url, timeout):
+        parts = urlsplit(url)
+        self.https = parts.scheme == 'https'
+        self.host = parts.hostname
+        self.port = parts.port or (443 if self.https else 80)
+        self.timeout = timeout
+        self.conn = None
+        self.timings = {}
+
+    def open(self):
+        started = time.perf_counter()
+        family, socktype, proto, _, address = socket.getaddrinfo(self.host, self.port, type=socket.SOCK_STREAM)[0]
+        resolved = time.perf_counter()
+
+        sock = socket.socket(family, socktype, proto)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(address)
+            connected = time.perf_counter()
+            self.timings = {'dns': resolved - started, 'connect': connected - resolved}
+            if self.https:
+                sock = ssl.create_default_context().wrap_socket(sock, server_hostname=self.host)
+                self.timings['tls'] = time.perf_counter() - connected
+        except Exception:
+            sock.close()
+            raise
+
+        connection_class = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+        self.conn = connection_class(self.host, self.port, timeout=self.timeout)
+        self.conn.sock = sock
+
+    def request(self, method, path, headers):
+        """Send one request, returning (status, ttfb seconds, connection still usable)"""
+        started = time.perf_counter()
+        self.conn.request(method, path, headers=headers)
+        response = self.conn.getresponse()
+        ttfb = time.perf_counter() - started
+        response.read()
+        return response.status, ttfb, not response.will_close
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+class Probe:
+    """Repeatedly requests one URL from several threads and collects phase timings"""
+
+    def __init__(self, name, url, headers=None, method='GET', requests=20, concurrency=4, reuse=True, timeout=10):
+        self.name = name
+        self.url = url
+        self.headers = dict(headers or {})
+        self.method = method
+        self.requests = requests
+        self.concurrency = concurrency
+        self.reuse = reuse
+        self.timeout = timeout
+        parts = urlsplit(url)
+        self.path = (parts.path or '/') + (f"?{parts.query}" if parts.query else '')
+        self._lock = threading.Lock()
+        self.samples = {phase: [] for phase in PHASES}
+        self.statuses = Counter()
+        self.errors = Counter()
+        self.connections = 0
+        self.elapsed = None
+
+    def _record(self, timings=None, **values):
+        with self._lock:
+            for phase, seconds in (timings or {}).items():
+                self.samples[phase].append(seconds)
+            for phase, seconds in values.items():
+                self.samples[phase].append(seconds)
+
+    def _worker(self, count):
+        connection = None
+        for _ in range(count):
+            try:
+                new = connection is None
+                if new:
+                    connection = ProbeConnection(self.url, self.timeout)
+                    connection.open()
+                    with self._lock:
+                        self.connections += 1
+                status, ttfb, keep_alive = connection.request(self.method, self.path, self.headers)
+                with self._lock:
+                    self.statuses[status] += 1
+                if new:
+                    self._record(connection.timings, ttfb_new=ttfb)
+                else:
+                    self._record(ttfb_reused=ttfb)
+                if not (self.reuse and keep_alive):
+                    connection.close()
+                    connection = None
+            except Exception as e:
+                with self._lock:
+                    self.errors[type(e).__name__] += 1
+                if connection is not None:
+                    connection.close()
+                    connection = None
+        if connection is not None:
+            connection.close()
+
+    def run(self):
+        started = time.perf_counter()
+        workers = min(self.concurrency, self.requests)
+        threads = []
+        for index in range(workers):
+            count = self.requests // workers + (1 if index < self.requests % workers else 0)
+            thread = threading.Thread(target=self._worker, args=(count,), name=f"probe-{self.name}-{index}", daemon=True)
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        self.elapsed = time.perf_counter() - started
+        return self.report()
+
+    def report(self):
+        with self._lock:
+            completed = sum(self.statuses.values())
+            phases = {phase: summarize(values) for phase, values in self.samples.items()}
+            connect, reused, new = phases['connect'], phases['ttfb_reused'], phases['ttfb_new']
+            report = {
+                'name': self.name,
+                'url': self.url,
+                'requests': completed,
+                'errors': dict(self.errors),
+                'statuses': dict(self.statuses),
+                'connections': self.connections,
+                'requests_per_connection': round(completed / self.connections, 2) if self.connections else None,
+                'elapsed_seconds': round(self.elapsed, 3) if self.elapsed is not None else None,
+                'phases': phases,
+            }
+
+        if new and connect:
+            setup = sum(phases[phase]['p50_ms'] for phase in ('dns', 'connect', 'tls') if phases[phase])
+            report['new_connection_p50_ms'] = round(setup + new['p50_ms'], 1)
+        if reused:
+            report['reused_connection_p50_ms'] = reused['p50_ms']
+            if 'new_connection_p50_ms' in report:
+                report['reuse_saves_ms'] = round(report['new_connection_p50_ms'] - reused['p50_ms'], 1)
+        if connect:
+            ttfb = reused or new
+            report['network_rtt_p50_ms'] = connect['p50_ms']
+            report['upstream_p50_ms'] = round(max(0.0, ttfb['p50_ms'] - connect['p50_ms']), 1) if ttfb else None
+        return report
+
+
+def diagnose(report):
+    """Plain-language hints about where the time goes"""
+    hints = []
+    phases = report['phases']
+    if report['errors']:
+        hints.append(f"{sum(report['errors'].values())} request(s) failed: {report['errors']}")
+    if phases['dns'] and phases['dns']['p90_ms'] > 100:
+        hints.append("DNS lookups are slow: check the resolver on this box (or run a local cache)")
+    if phases['connect'] and phases['connect']['p90_ms'] > 3 * phases['connect']['p50_ms'] + 20:
+        hints.append("TCP connect times vary a lot: packet loss or congestion on the network path")
+    if report.get('upstream_p50_ms') is not None and report.get('network_rtt_p50_ms') is not None \
+            and report['upstream_p50_ms'] > 4 * report['network_rtt_p50_ms'] + 50:
+        hints.append("Most of the time is spent upstream, after the request reached the server")
+    if report['requests_per_connection'] is not None and report['requests_per_connection'] < 1.5 and report['requests'] > 1:
+        hints.append("Connections are rarely reused: the server or a proxy is closing keep-alive connections")
+    if hasattr(os, 'getloadavg') and os.getloadavg()[0] > (os.cpu_count() or 1):
+        hints.append(f"This box is busy (load average {os.getloadavg()[0]:.1f} on {os.cpu_count()} CPUs)")
+    return hints
+
+
+def run_probes(probes):
+    """Run probes concurrently, returning their reports in order"""
+    reports = [None] * len(probes)
+
+    def run(index, probe):
+        reports[index] = probe.run()
+
+    threads = [threading.Thread(target=run, args=(index, probe), daemon=True) for index, probe in enumerate(probes)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return reports
+
+
+def print_report(report):
+    print(f"\n📡 {report['name']}: {report['url']}")
+    print("-" * 50)
+    print(f"   Requests: {report['requests']} in {report['elapsed_seconds']}s over {report['connections']} connection(s)"
+          f" | statuses {report['statuses'] or '-'}")
+    print(f"   {'phase':<12}{'count':>7}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}")
+    for phase in PHASES:
+        stats = report['phases'][phase]
+        if stats:
+            print(f"   {phase:<12}{stats['count']:>7}{stats['p50_ms']:>8.1f}ms{stats['p90_ms']:>8.1f}ms"
+                  f"{stats['p99_ms']:>8.1f}ms{stats['max_ms']:>8.1f}ms")
+    if 'reuse_saves_ms' in report:
+        print(f"   ♻️  New connection {report['new_connection_p50_ms']}ms vs reused {report['reused_connection_p50_ms']}ms"
+              f" (reuse saves {report['reuse_saves_ms']}ms per request)")
+    if report.get('upstream_p50_ms') is not None:
+        print(f"   🌐 Network round trip ~{report['network_rtt_p50_ms']}ms, upstream processing ~{report['upstream_p50_ms']}ms")
+    for hint in diagnose(report):
+        print(f"   ⚠️  {hint}")
+
+
+def add_probe_arguments(parser):
+    """Options shared by the scripts that offer a --probe mode"""
+    parser.add_argument('--probe', action='store_true', help="Measure DNS/TCP/TLS/TTFB latency to the upstream APIs")
+    parser.add_argument('--requests', type=int, default=20, help="Requests per endpoint (default 20)")
+    parser.add_argument('--concurrency', type=int, default=4, help="Concurrent connections per endpoint (default 4)")
+    parser.add_argument('--no-reuse', action='store_true', help="Open a new connection for every request")
+    parser.add_argument('--timeout', type=float, default=10, help="Seconds per network operation (default 10)")
+    parser.add_argument('--url', action='append', default=[], metavar='URL',
+                        help="Probe this URL instead of the default endpoints (repeatable; http:// works for local stand-ins)")
+    parser.add_argument('--json', action='store_true', help="Print the reports as JSON")
+
+
+def upstream_endpoints(whatsapp_token, phone_number_id, openai_api_key):
+    """The Graph API and OpenAI endpoints the bot calls, as (name, url, headers)"""
+    endpoints = []
+    if phone_number_id:
+        endpoints.append(('Graph API', f"https://graph.facebook.com/v18.0/{phone_number_id}",
+                          {'Authorization': f"Bearer {whatsapp_token}"} if whatsapp_token else {}))
+    endpoints.append(('OpenAI', 'https://api.openai.com/v1/models',
+                      {'Authorization': f"Bearer {openai_api_key}"} if openai_api_key else {}))
+    return endpoints
+
+
+def probe_endpoints(args, endpoints):
+    """Run probes for endpoints [(name, url, headers)] (or args.url) and print the reports"""
+    if args.url:
+        endpoints = [(urlsplit(url).netloc, url, {}) for url in args.url]
+    probes = [
+        Probe(name, url, headers, requests=args.requests, concurrency=args.concurrency,
+              reuse=not args.no_reuse, timeout=args.timeout)
+        for name, url, headers in endpoints
+    ]
+    reports = run_probes(probes)
+    if args.json:
+        print(json.dumps(reports, indent=2))
+    else:
+        for report in reports:
+            print_report(report)
+    return reports
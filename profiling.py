@@ -0,0 +1,218 @@
+"""
+Sampling profiler for WhatsApp ChatBot
+
+Samples the stacks of every thread in this process (webhook handlers, reply
+workers, media downloads) at a fixed interval from a background thread, so
+production gunicorn workers can be profiled without attaching external tools.
+
+Each sample adds wall time to its stack. On Linux the thread's CPU clock is
+read too, so CPU time is attributed only to stacks that were actually running;
+time spent waiting on OpenAI or the Graph API shows up as wall time only.
+Results are available as a per-function table and as folded stacks
+(``frame;frame;frame weight``) for flamegraph.pl or speedscope.
+"""
+
+import os
+import re
+import sys
+import time
+import threading
+from collections import Counter
+
+
+# Frames a thread sits in while it has nothing to do
+IDLE_MODULES = ('threading.py', 'queue.py', 'selectors.py', 'socketserver.py')
+
+THREAD_NUMBER = re.compile(r'_\d+$')
+DEFAULT_THREAD_NAME = re.compile(r'^Thread-\d+(?: \((.*)\))?$')
+
+
+def thread_group(name):
+    """Collapse numbered thread names: 'reply-worker_3' -> 'reply-worker'"""
+    match = DEFAULT_THREAD_NAME.match(name)
+    if match:
+        return match.group(1) or 'Thread'
+    return THREAD_NUMBER.sub('', name)
+
+
+def thread_cpu_time(ident):
+    """CPU seconds used by a thread so far, or None where unsupported"""
+    try:
+        return time.clock_gettime(time.pthread_getcpuclockid(ident))
+    except (AttributeError, OSError):
+        return None
+
+
+def frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """Periodically samples thread stacks and aggregates wall and CPU time per stack"""
+
+    def __init__(self, interval=0.01, include_idle=False, max_stacks=20000, output_directory=None):
+        """output_directory: if set, folded stacks are written there whenever sampling stops"""
+        self.interval = interval
+        self.output_directory = output_directory
+        self.include_idle = include_idle
+        self.max_stacks = max_stacks
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._reset()
+
+    def _reset(self):
+        self.wall = Counter()  # folded stack -> samples
+        self.cpu = Counter()  # folded stack -> CPU seconds
+        self.samples = 0
+        self.idle_samples = 0
+        self.truncated = 0
+        self.started_at = None
+        self.stopped_at = None
+        self._last_cpu = {}
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, duration=None):
+        """Start sampling, discarding earlier results; stops by itself after duration seconds"""
+        if self.running:
+            return False
+        with self._lock:
+            self._reset()
+            self.started_at = time.time()
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, args=(duration,), name='profiler', daemon=True)
+        self._thread.start()
+        print(f"🔬 Profiler started: sampling every {self.interval * 1000:.0f}ms")
+        return True
+
+    def stop(self):
+        """Stop sampling, keeping the results"""
+        if not self.running:
+            return False
+        self._stop_event.set()
+        self._thread.join()
+        return True
+
+    def _run(self, duration):
+        deadline = time.monotonic() + duration if duration else None
+        own_ident = threading.get_ident()
+        while not self._stop_event.wait(self.interval):
+            self._sample(own_ident)
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+        with self._lock:
+            self.stopped_at = time.time()
+        print(f"🔬 Profiler stopped after {self.samples} samples")
+        if self.output_directory:
+            try:
+                for path in self.dump(self.output_directory):
+                    print(f"🔬 Wrote {path}")
+            except OSError as e:
+                print(f"⚠️  Could not write profile: {e}")
+
+    def _sample(self, own_ident):
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        frames = sys._current_frames()
+        with self._lock:
+            for ident, frame in frames.items():
+                if ident == own_ident:
+                    continue
+
+                cpu_now = thread_cpu_time(ident)
+                cpu_used = 0.0
+                if cpu_now is not None:
+                    cpu_used = max(cpu_now - self._last_cpu.get(ident, cpu_now), 0.0)
+                    self._last_cpu[ident] = cpu_now
+
+                if not self.include_idle and not cpu_used and frame.f_code.co_filename.endswith(IDLE_MODULES):
+                    self.idle_samples += 1
+                    continue
+
+                stack = []
+                while frame is not None:
+                    stack.append(frame_label(frame.f_code))
+                    frame = frame.f_back
+                stack.append(thread_group(names.get(ident, 'unknown')))
+                folded = ';'.join(reversed(stack))
+
+                if folded not in self.wall and len(self.wall) >= self.max_stacks:
+                    self.truncated += 1
+                    folded = '[truncated]'
+                self.samples += 1
+                self.wall[folded] += 1
+                if cpu_used:
+                    self.cpu[folded] += cpu_used
+
+    def folded(self, weight='wall'):
+        """Folded stacks, one 'frame;frame;frame count' line each
+
+        weight='wall' counts samples; weight='cpu' counts CPU microseconds.
+        """
+        with self._lock:
+            if weight == 'cpu':
+                items = [(stack, round(seconds * 1e6)) for stack, seconds in self.cpu.items()]
+            else:
+                items = list(self.wall.items())
+        return ''.join(f"{stack} {count}\n" for stack, count in sorted(items) if count)
+
+    def functions(self, limit=50, sort='cpu'):
+        """Per-function inclusive and self wall/CPU seconds, heaviest first"""
+        wall_total = Counter()
+        wall_self = Counter()
+        cpu_total = Counter()
+        cpu_self = Counter()
+        with self._lock:
+            for stack, count in self.wall.items():
+                frames = stack.split(';')[1:]
+                if not frames:
+                    continue
+                seconds = count * self.interval
+                cpu = self.cpu.get(stack, 0.0)
+                # Recursive functions count once per stack
+                for label in set(frames):
+                    wall_total[label] += seconds
+                    cpu_total[label] += cpu
+                wall_self[frames[-1]] += seconds
+                cpu_self[frames[-1]] += cpu
+
+        key = cpu_total if sort == 'cpu' else wall_total
+        return [
+            {
+                'function': label,
+                'wall_seconds': round(wall_total[label], 3),
+                'self_wall_seconds': round(wall_self[label], 3),
+                'cpu_seconds': round(cpu_total[label], 3),
+                'self_cpu_seconds': round(cpu_self[label], 3),
+            }
+            for label, _ in key.most_common(limit)
+        ]
+
+    def dump(self, directory):
+        """Write wall and CPU folded stacks to directory, returning the file paths"""
+        os.makedirs(directory, exist_ok=True)
+        stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(self.started_at or time.time()))
+        paths = []
+        for weight in ('wall', 'cpu'):
+            path = os.path.join(directory, f"profile-{stamp}-{os.getpid()}-{weight}.folded")
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(self.folded(weight))
+            paths.append(path)
+        return paths
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'running': self.running,
+                'interval_ms': self.interval * 1000,
+                'started_at': self.started_at,
+                'stopped_at': self.stopped_at,
+                'samples': self.samples,
+                'idle_samples_skipped': self.idle_samples,
+                'distinct_stacks': len(self.wall),
+                'truncated_samples': self.truncated,
+                'cpu_seconds': round(sum(self.cpu.values()), 3),
+                'pid': os.getpid(),
+            }
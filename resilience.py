@@ -0,0 +1,296 @@
+"""
+Resilience helpers for WhatsApp ChatBot
+
+Circuit breakers around upstream APIs (OpenAI, WhatsApp Graph API), per
+request deadline budgets, a bounded worker pool and a bounded deferred-retry
+queue. Together they keep thread count and memory bounded while an upstream
+service is slow or down.
+"""
+
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class CircuitOpenError(Exception):
+    """Raised when a call is rejected because the circuit breaker is open"""
+
+    def __init__(self, name):
+        super().__init__(f"Circuit breaker '{name}' is open")
+        self.name = name
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a request runs out of its deadline budget"""
+
+
+class Deadline:
+    """Time budget for a single request"""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        """Seconds left before the deadline, never negative"""
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        return time.monotonic() >= self.expires_at
+
+    def check(self, what='request'):
+        """Raise DeadlineExceeded if the deadline has passed"""
+        if self.expired():
+            raise DeadlineExceeded(f"{what} exceeded its {self.seconds}s deadline")
+
+    def timeout(self, cap):
+        """Per-call timeout: the remaining budget, capped at cap seconds"""
+        return min(cap, self.remaining())
+
+
+class CircuitBreaker:
+    """Closed / open / half-open circuit breaker
+
+    After failure_threshold consecutive failures the breaker opens and rejects
+    calls for recovery_timeout seconds. It then lets a single probe call
+    through (half-open); success closes it, failure opens it again.
+    Exceptions listed in ignore propagate without counting as failures.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name, failure_threshold=5, recovery_timeout=30, ignore=()):
+        self.name = name
+        self.ignore = tuple(ignore)
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._consecutive_failures = 0
+        self._opened_at = None
+        self._probe_in_flight = False
+        self.total_failures = 0
+        self.total_rejected = 0
+        self.last_success_at = None
+        self.last_failure_at = None
+        self.last_error = None
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self):
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.recovery_timeout:
+            self._state = self.HALF_OPEN
+            self._probe_in_flight = False
+        return self._state
+
+    def allow(self):
+        """Return True if a call may proceed; in half-open state only one probe is allowed"""
+        with self._lock:
+            state = self._current_state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                print(f"🔌 Circuit '{self.name}' half-open, probing upstream")
+                return True
+            self.total_rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self._state != self.CLOSED:
+                print(f"✅ Circuit '{self.name}' closed, upstream recovered")
+            self._state = self.CLOSED
+            self._consecutive_failures = 0
+            self._probe_in_flight = False
+            self.last_success_at = time.time()
+
+    def record_failure(self, error=None):
+        with self._lock:
+            self._consecutive_failures += 1
+            self.total_failures += 1
+            self.last_failure_at = time.time()
+            self.last_error = str(error) if error else None
+            if self._state == self.HALF_OPEN or self._consecutive_failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    print(f"🚫 Circuit '{self.name}' opened after {self._consecutive_failures} failure(s): {error}")
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._probe_in_flight = False
+
+    def call(self, func, *args, **kwargs):
+        """Call func through the breaker, raising CircuitOpenError when open"""
+        if not self.allow():
+            raise CircuitOpenError(self.name)
+        try:
+            result = func(*args, **kwargs)
+        except self.ignore:
+            self.record_success()
+            raise
+        except Exception as e:
+            self.record_failure(e)
+            raise
+        self.record_success()
+        return result
+
+    def call_http(self, request, *args, **kwargs):
+        """Make an HTTP request through the breaker and return the response
+
+        Raises CircuitOpenError when open. Network errors, throttling (429) and
+        server errors (5xx) count as failures; other responses, including 4xx
+        errors caused by the request itself, mean the service is healthy.
+        """
+        if not self.allow():
+            raise CircuitOpenError(self.name)
+        try:
+            response = request(*args, **kwargs)
+        except Exception as e:
+            self.record_failure(e)
+            raise
+        if response.status_code == 429 or response.status_code >= 500:
+            self.record_failure(f"HTTP {response.status_code}")
+        else:
+            self.record_success()
+        return response
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'state': self._current_state(),
+                'consecutive_failures': self._consecutive_failures,
+                'total_failures': self.total_failures,
+                'total_rejected': self.total_rejected,
+                'last_success_at': self.last_success_at,
+                'last_failure_at': self.last_failure_at,
+                'last_error': self.last_error,
+            }
+
+
+class BoundedExecutor:
+    """Fixed-size worker pool that refuses work once max_pending jobs are queued or running"""
+
+    def __init__(self, max_workers, max_pending, name='worker'):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.rejected = 0
+
+    def submit(self, func, *args, **kwargs):
+        """Submit a job, returning False without queueing it if the pool is saturated"""
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            return False
+
+        with self._lock:
+            self.pending += 1
+        try:
+            future = self._executor.submit(func, *args, **kwargs)
+        except Exception:
+            self._release()
+            raise
+        future.add_done_callback(lambda _: self._release())
+        return True
+
+    def _release(self):
+        with self._lock:
+            self.pending -= 1
+        self._slots.release()
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'workers': self.max_workers,
+                'pending': self.pending,
+                'max_pending': self.max_pending,
+                'rejected': self.rejected,
+            }
+
+
+class DeferredQueue:
+    """Bounded queue of jobs retried once the guarding circuit breaker lets calls through
+
+    A single background thread drains the queue, submitting at most batch_size
+    jobs per interval so recovery does not turn into a burst against an
+    upstream that has only just come back.
+    """
+
+    def __init__(self, breaker, handler, maxlen=500, interval=15, batch_size=10):
+        self.breaker = breaker
+        self.handler = handler
+        self.interval = interval
+        self.batch_size = batch_size
+        self._jobs = deque()
+        self._maxlen = maxlen
+        self._lock = threading.Lock()
+        self.dropped = 0
+        self.retried = 0
+        self._thread = threading.Thread(target=self._run, name=f"deferred-{breaker.name}", daemon=True)
+        self._thread.start()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._jobs)
+
+    def push(self, job):
+        """Queue a job for a later retry, returning False if the queue is full"""
+        with self._lock:
+            if len(self._jobs) >= self._maxlen:
+                self.dropped += 1
+                return False
+            self._jobs.append(job)
+            return True
+
+    def drain(self):
+        """Remove and return every queued job"""
+        with self._lock:
+            jobs = list(self._jobs)
+            self._jobs.clear()
+            return jobs
+
+    def _pop_batch(self):
+        with self._lock:
+            batch = []
+            while self._jobs and len(batch) < self.batch_size:
+                batch.append(self._jobs.popleft())
+            return batch
+
+    def _requeue_front(self, jobs):
+        with self._lock:
+            self._jobs.extendleft(reversed(jobs))
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            if not len(self) or self.breaker.state == CircuitBreaker.OPEN:
+                continue
+
+            batch = self._pop_batch()
+            for index, job in enumerate(batch):
+                try:
+                    accepted = self.handler(job)
+                except Exception as e:
+                    print(f"❌ Error retrying deferred job: {e}")
+                    accepted = True
+                if not accepted:
+                    self._requeue_front(batch[index:])
+                    break
+                self.retried += 1
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'queued': len(self._jobs),
+                'max_queued': self._maxlen,
+                'dropped': self.dropped,
+                'retried': self.retried,
+            }
@@ -0,0 +1,384 @@
+"""
+Response engines for WhatsApp ChatBot
+
+An engine turns an incoming user message into the assistant's reply. Two
+implementations are available:
+
+- ``assistants``: the OpenAI Assistants thread/run flow (messages.create,
+  runs.create, polling runs.retrieve, messages.list)
+- ``chat_completions``: builds the conversation context from the local chat
+  store and makes a single streaming chat completion request
+"""
+
+import time
+import threading
+
+from resilience import DeadlineExceeded
+from tracing import tracer
+
+
+class RunCancelled(Exception):
+    """Raised when a reply is abandoned because a newer message superseded it"""
+
+
+class RunFailed(Exception):
+    """Raised when a run ends failed, expired or incomplete, so the OpenAI breaker counts it"""
+
+    def __init__(self, run):
+        self.status = run.status
+        self.last_error = getattr(run, 'last_error', None)
+        incomplete = getattr(run, 'incomplete_details', None)
+        if self.last_error:
+            detail = f"{self.last_error.code}: {self.last_error.message}"
+        elif incomplete and incomplete.reason:
+            detail = incomplete.reason
+        else:
+            detail = 'no error given'
+        super().__init__(f"Run {run.id} ended {run.status} ({detail})")
+
+
+class ResponseEngine:
+    """Base class for response engines"""
+
+    name = 'base'
+
+    def __init__(self, client, chat_manager, config):
+        self.client = client
+        self.chat_manager = chat_manager
+        self.config = config
+        self._runs_lock = threading.Lock()
+        self.active_runs = {}
+
+    def get_response(self, phone_number, user_message, deadline=None, cancel_event=None, on_part=None):
+        """Return the reply text for a message, or None if no reply was produced
+
+        Raises RunCancelled if cancel_event is set before the reply is complete,
+        and RunFailed if the run ended without a reply.
+        Engines that stream may call on_part(text) with leading parts of the reply
+        as they become complete; the returned text still contains the whole reply.
+        """
+        raise NotImplementedError
+
+    def _track_run(self, phone_number, run_id):
+        with self._runs_lock:
+            self.active_runs[phone_number] = run_id
+
+    def _untrack_run(self, phone_number):
+        with self._runs_lock:
+            self.active_runs.pop(phone_number, None)
+
+    def in_flight(self):
+        """Number of runs currently generating a reply"""
+        with self._runs_lock:
+            return len(self.active_runs)
+
+    def posted_messages(self):
+        """{phone_number: (thread_id, text)} of messages already sent upstream but not yet answered"""
+        return {}
+
+    def restore_posted(self, phone_number, thread_id, text):
+        """Remember that text is already on thread_id, so replaying it does not send it twice"""
+
+    def _record_usage(self, phone_number, **usage):
+        """Pass a run's token usage to the chat manager; accounting never fails a reply"""
+        try:
+            self.chat_manager.record_usage(phone_number, **usage)
+        except Exception as e:
+            print(f"⚠️  Could not record token usage for {phone_number}: {e}")
+
+    def request_timeout(self, deadline):
+        """Timeout for a single OpenAI call within the request's deadline budget"""
+        if deadline is None:
+            return self.config.OPENAI_REQUEST_TIMEOUT
+        deadline.check('OpenAI request')
+        return deadline.timeout(self.config.OPENAI_REQUEST_TIMEOUT)
+
+    def get_stats(self):
+        """Return engine statistics for monitoring"""
+        return {'engine': self.name, 'in_flight_runs': self.in_flight()}
+
+
+class AssistantsEngine(ResponseEngine):
+    """Replies through an OpenAI Assistant thread and run"""
+
+    name = 'assistants'
+
+    def __init__(self, client, chat_manager, config):
+        super().__init__(client, chat_manager, config)
+        self._posted = {}  # phone_number -> (thread_id, text) added to the thread, run not finished
+        self._restored = {}  # phone_number -> (thread_id, text) posted by a stopped worker
+
+    def posted_messages(self):
+        with self._runs_lock:
+            return dict(self._posted)
+
+    def restore_posted(self, phone_number, thread_id, text):
+        with self._runs_lock:
+            self._restored[phone_number] = (thread_id, text)
+
+    def get_response(self, phone_number, user_message, deadline=None, cancel_event=None, on_part=None):
+        """Add the message to the phone's thread, run the assistant and wait for the reply
+
+        A replayed message whose leading text is already on the thread (its run was
+        cancelled by a shutdown) only has the rest added.
+        """
+        thread_id = self.chat_manager.get_or_create_thread(phone_number)
+
+        content = user_message
+        with self._runs_lock:
+            self._posted.pop(phone_number, None)  # Left by a superseded run, already answered by this one
+            restored = self._restored.pop(phone_number, None)
+        if restored is not None and restored[0] == thread_id and user_message.startswith(restored[1]):
+            content = user_message[len(restored[1]):].lstrip('\n')
+
+        # Add user message to thread
+        if content:
+            with tracer.span('openai.messages.create'):
+                self.client.beta.threads.messages.create(
+                    thread_id=thread_id,
+                    role="user",
+                    content=content,
+                    timeout=self.request_timeout(deadline)
+                )
+        with self._runs_lock:
+            self._posted[phone_number] = (thread_id, user_message)
+
+        # Run the assistant
+        started = time.perf_counter()
+        with tracer.span('openai.runs.create'):
+            run = self.client.beta.threads.runs.create(
+                thread_id=thread_id,
+                assistant_id=self.config.OPENAI_ASSISTANT_ID,
+                timeout=self.request_timeout(deadline)
+            )
+
+        self._track_run(phone_number, run.id)
+        try:
+            with tracer.span('openai.runs.poll', run_id=run.id) as span:
+                run, cancelled, polls = self._wait_for_run(thread_id, run, deadline, cancel_event)
+                span.set_attribute('run_status', run.status)
+        finally:
+            self._untrack_run(phone_number)
+
+        usage = getattr(run, 'usage', None)
+        self._record_usage(
+            phone_number,
+            assistant=self.config.OPENAI_ASSISTANT_ID,
+            model=getattr(run, 'model', None),
+            status=run.status,
+            prompt_tokens=usage.prompt_tokens if usage else 0,
+            completion_tokens=usage.completion_tokens if usage else 0,
+            duration=time.perf_counter() - started,
+            polls=polls
+        )
+
+        if cancelled:
+            raise RunCancelled(f"Run {run.id} for {phone_number} was superseded")
+        with self._runs_lock:
+            self._posted.pop(phone_number, None)
+
+        if run.status != 'completed':
+            raise RunFailed(run)
+
+        # Get the assistant's response
+        with tracer.span('openai.messages.list'):
+            messages = self.client.beta.threads.messages.list(
+                thread_id=thread_id,
+                order="desc",
+                limit=1,
+                timeout=self.request_timeout(deadline)
+            )
+
+        if messages.data:
+            return messages.data[0].content[0].text.value
+
+        return None
+
+    def _wait_for_run(self, thread_id, run, deadline, cancel_event):
+        """Poll a run until it finishes, cancelling it when superseded or out of time"""
+        cancelled = False
+        polls = 0
+        span = tracer.current()
+
+        # Keep polling through 'cancelling' so the thread is free for the next run
+        while run.status in ['queued', 'in_progress', 'cancelling']:
+            if not cancelled and cancel_event is not None and cancel_event.is_set():
+                self._cancel_run(thread_id, run.id)
+                cancelled = True
+            if deadline is not None and deadline.remaining() < 1:
+                if not cancelled:
+                    self._cancel_run(thread_id, run.id)
+                raise DeadlineExceeded(f"Run {run.id} exceeded its {deadline.seconds}s deadline")
+
+            if cancel_event is not None and not cancelled:
+                cancel_event.wait(1)
+            else:
+                time.sleep(1)
+            run = self.client.beta.threads.runs.retrieve(
+                thread_id=thread_id,
+                run_id=run.id,
+                timeout=self.request_timeout(deadline)
+            )
+            polls += 1
+            span.set_attribute('polls', polls)
+
+        return run, cancelled or run.status == 'cancelled', polls
+
+    def _cancel_run(self, thread_id, run_id):
+        """Best-effort cancel of a run that outlived its deadline"""
+        try:
+            self.client.beta.threads.runs.cancel(
+                thread_id=thread_id,
+                run_id=run_id,
+                timeout=self.config.OPENAI_REQUEST_TIMEOUT
+            )
+            print(f"🛑 Cancelled run {run_id} on thread {thread_id}")
+        except Exception as e:
+            print(f"⚠️  Could not cancel run {run_id}: {e}")
+
+
+class ChatCompletionsEngine(ResponseEngine):
+    """Replies with one streaming chat completion built from the local chat store"""
+
+    name = 'chat_completions'
+
+    ROLES = {
+        'User': 'user',
+        'Assistant': 'assistant',
+    }
+
+    def __init__(self, client, chat_manager, config):
+        super().__init__(client, chat_manager, config)
+        self._stats_lock = threading.Lock()
+        self.replies = 0
+        self.total_ttft = 0.0
+        self.max_ttft = 0.0
+        self.last_ttft = None
+        self.total_duration = 0.0
+
+    def build_context(self, phone_number, user_message):
+        """Build the chat completion messages from the system prompt and recent history"""
+        messages = [{'role': 'system', 'content': self.config.OPENAI_SYSTEM_PROMPT}]
+
+        history = self.chat_manager.read_messages(phone_number, limit=self.config.CHAT_CONTEXT_MESSAGES)
+        for entry in history:
+            role = self.ROLES.get(entry['sender'])
+            if role:
+                messages.append({'role': role, 'content': entry['message']})
+
+        # The webhook saves inbound messages before processing, so pending
+        # user input is normally already at the end of the history
+        if messages[-1]['role'] != 'user':
+            messages.append({'role': 'user', 'content': user_message})
+
+        return messages
+
+    def get_response(self, phone_number, user_message, deadline=None, cancel_event=None, on_part=None):
+        """Stream a chat completion and return the assembled reply
+
+        Completed paragraphs are passed to on_part once at least REPLY_PART_MIN_CHARS
+        of the reply are waiting to be sent.
+        """
+        if not self.client:
+            raise Exception("OpenAI client not initialized")
+
+        messages = self.build_context(phone_number, user_message)
+
+        started = time.perf_counter()
+        first_token_at = None
+        parts = []
+        unsent = ''  # Reply text not yet passed to on_part
+        usage = None
+
+        with tracer.span('openai.chat.completions', model=self.config.OPENAI_MODEL, context_messages=len(messages)) as span:
+            stream = self.client.chat.completions.create(
+                model=self.config.OPENAI_MODEL,
+                messages=messages,
+                stream=True,
+                stream_options={'include_usage': True},
+                timeout=self.request_timeout(deadline)
+            )
+            self._track_run(phone_number, id(stream))
+            try:
+                for chunk in stream:
+                    if cancel_event is not None and cancel_event.is_set():
+                        stream.close()
+                        raise RunCancelled(f"Chat completion for {phone_number} was superseded")
+                    if deadline is not None and deadline.expired():
+                        stream.close()
+                        deadline.check('Chat completion stream')
+                    if not chunk.choices:
+                        # The last chunk carries the usage of the whole request
+                        usage = getattr(chunk, 'usage', None) or usage
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        if first_token_at is None:
+                            first_token_at = time.perf_counter()
+                            span.set_attribute('ttft_ms', round((first_token_at - started) * 1000, 3))
+                        parts.append(delta)
+                        if on_part is not None:
+                            unsent += delta
+                            cut = unsent.rfind('\n\n') + 2
+                            if cut >= self.config.REPLY_PART_MIN_CHARS:
+                                on_part(unsent[:cut])
+                                unsent = unsent[cut:]
+            finally:
+                self._untrack_run(phone_number)
+
+        finished = time.perf_counter()
+        if first_token_at is None:
+            return None
+
+        ttft = first_token_at - started
+        self._record_timing(ttft, finished - started)
+        self._record_usage(
+            phone_number,
+            assistant=self.config.OPENAI_MODEL,
+            model=self.config.OPENAI_MODEL,
+            status='completed',
+            prompt_tokens=usage.prompt_tokens if usage else 0,
+            completion_tokens=usage.completion_tokens if usage else 0,
+            duration=finished - started
+        )
+        print(f"⏱️  Chat completion for {phone_number}: first token {ttft * 1000:.0f}ms, total {(finished - started) * 1000:.0f}ms")
+
+        return ''.join(parts)
+
+    def _record_timing(self, ttft, duration):
+        with self._stats_lock:
+            self.replies += 1
+            self.total_ttft += ttft
+            self.total_duration += duration
+            self.last_ttft = ttft
+            if ttft > self.max_ttft:
+                self.max_ttft = ttft
+
+    def get_stats(self):
+        """Return time-to-first-token statistics"""
+        with self._stats_lock:
+            replies = self.replies
+            return {
+                'engine': self.name,
+                'model': self.config.OPENAI_MODEL,
+                'in_flight_runs': self.in_flight(),
+                'replies': replies,
+                'avg_ttft_ms': round(self.total_ttft / replies * 1000, 1) if replies else None,
+                'max_ttft_ms': round(self.max_ttft * 1000, 1) if replies else None,
+                'last_ttft_ms': round(self.last_ttft * 1000, 1) if self.last_ttft is not None else None,
+                'avg_duration_ms': round(self.total_duration / replies * 1000, 1) if replies else None,
+            }
+
+
+# Engine mapping
+engine_map = {
+    AssistantsEngine.name: AssistantsEngine,
+    ChatCompletionsEngine.name: ChatCompletionsEngine,
+}
+
+def create_engine(name, client, chat_manager, config):
+    """Create the response engine registered under name"""
+    engine_class = engine_map.get(name)
+    if engine_class is None:
+        raise ValueError(f"Unknown response engine '{name}'. Available: {', '.join(engine_map)}")
+    return engine_class(client, chat_manager, config)
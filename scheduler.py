@@ -0,0 +1,119 @@
+"""
+Conversation scheduler for WhatsApp ChatBot
+
+Runs at most one reply job per phone number at a time. Messages that arrive
+while a reply is being generated are queued for that conversation and the
+in-flight run is told to cancel itself, because its answer is already
+outdated. The job then starts one fresh run over all pending input.
+"""
+
+import threading
+
+
+class Conversation:
+    """Scheduling state of one phone number's conversation"""
+
+    def __init__(self):
+        self.pending = []  # (message_text, trace_span) pairs
+        self.current = None  # Text of the batch being answered
+        self.cancel_event = None
+
+
+class ConversationScheduler:
+    """Serializes reply jobs per phone number on a shared worker pool"""
+
+    def __init__(self, worker_pool, handler):
+        """handler(phone_number, message_text, cancel_event, trace_spans, tenant) produces
+        and sends the reply, abandoning it once cancel_event is set"""
+        self.worker_pool = worker_pool
+        self.handler = handler
+        self._lock = threading.Lock()
+        self._conversations = {}
+        self.superseded = 0
+        self.closed = False
+
+    def submit(self, phone_number, message_text, trace_span=None, tenant=None):
+        """Schedule a reply to message_text, returning False if the worker pool is saturated
+
+        Conversations are keyed by tenant and phone number, so a customer who
+        writes to two of our numbers gets two independent conversations.
+        """
+        key = (tenant, phone_number)
+        with self._lock:
+            if self.closed:
+                return False
+            conversation = self._conversations.get(key)
+            if conversation is not None:
+                conversation.pending.append((message_text, trace_span))
+                if conversation.cancel_event is not None and not conversation.cancel_event.is_set():
+                    conversation.cancel_event.set()
+                    self.superseded += 1
+                    print(f"⏭️  Newer message from {phone_number}, superseding the in-flight reply")
+                return True
+
+            conversation = Conversation()
+            conversation.pending.append((message_text, trace_span))
+
+            # Submitted under the lock (the pool never blocks), so no message can join
+            # a conversation whose job the pool then rejects
+            if not self.worker_pool.submit(self._run, key, conversation):
+                return False
+            self._conversations[key] = conversation
+            return True
+
+    def _run(self, key, conversation):
+        tenant, phone_number = key
+        while True:
+            with self._lock:
+                conversation.current = None
+                if self.closed and conversation.cancel_event is not None and conversation.cancel_event.is_set():
+                    # Shutting down: cancel_all() has collected the rest
+                    return
+                if not conversation.pending:
+                    self._conversations.pop(key, None)
+                    return
+                batch = conversation.pending
+                conversation.pending = []
+                conversation.current = message_text = '\n'.join(text for text, _ in batch)
+                conversation.cancel_event = cancel_event = threading.Event()
+
+            trace_spans = tuple(span for _, span in batch if span is not None and span.sampled)
+            try:
+                self.handler(phone_number, message_text, cancel_event, trace_spans, tenant)
+            except Exception as e:
+                print(f"❌ Error in conversation job for {phone_number}: {e}")
+
+    def close(self):
+        """Refuse new messages; conversations already scheduled keep draining"""
+        with self._lock:
+            self.closed = True
+
+    def cancel_all(self):
+        """Cancel every in-flight reply and return the unanswered messages
+
+        Returns {'phone_number', 'message', 'tenant'} jobs covering both the batches
+        being answered and the messages still waiting behind them, the batch
+        being answered first. The engine may already have sent that batch
+        upstream; the caller notes this so a replay does not send it twice.
+        """
+        jobs = []
+        with self._lock:
+            self.closed = True
+            for (tenant, phone_number), conversation in self._conversations.items():
+                if conversation.cancel_event is not None:
+                    conversation.cancel_event.set()
+                texts = [conversation.current] if conversation.current else []
+                texts.extend(text for text, _ in conversation.pending)
+                if texts:
+                    jobs.append({'phone_number': phone_number, 'message': '\n'.join(texts), 'tenant': tenant})
+                conversation.pending = []
+                conversation.current = None
+        return jobs
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'active_conversations': len(self._conversations),
+                'pending_messages': sum(len(c.pending) for c in self._conversations.values()),
+                'superseded': self.superseded,
+            }
@@ -0,0 +1,224 @@
+"""
+Conversation sharding for WhatsApp ChatBot
+
+nginx hands each webhook to whichever worker is free, but a conversation's
+ordering and OpenAI thread live in one process. In sharded mode every
+inbound message is routed to the shard that owns its conversation, chosen by
+a consistent hash of tenant and phone number, so adding a shard only moves
+about 1/N of the conversations.
+
+Transports deliver messages to the owning shard:
+
+- ``local``: gunicorn workers on one host. Each worker claims a shard slot
+  with a lock file and listens on a Unix socket next to it; a replacement
+  worker takes over the slot when the old one exits.
+- ``http``: shards are separate app instances (one worker each, on one or
+  more hosts) and messages are POSTed to the owner's /internal/shard.
+
+If the owner cannot be reached (e.g. while it restarts) the message is
+handled where it arrived rather than being lost.
+"""
+
+import os
+import json
+import time
+import bisect
+import fcntl
+import socket
+import hashlib
+import threading
+import socketserver
+
+import requests
+
+
+class HashRing:
+    """Consistent hash ring with virtual nodes"""
+
+    def __init__(self, members, vnodes=100):
+        self.members = list(members)
+        self._points = []
+        self._owners = []
+        ring = sorted(
+            (self._hash(f"{member}#{index}"), member)
+            for member in self.members
+            for index in range(vnodes)
+        )
+        for point, member in ring:
+            self._points.append(point)
+            self._owners.append(member)
+
+    @staticmethod
+    def _hash(key):
+        return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+
+    def lookup(self, key):
+        """Member that owns key"""
+        index = bisect.bisect(self._points, self._hash(key)) % len(self._points)
+        return self._owners[index]
+
+
+class UnixSocketTransport:
+    """Delivers messages between worker processes on one host over Unix sockets"""
+
+    def __init__(self, directory, timeout=2):
+        self.directory = directory
+        self.timeout = timeout
+        self._server = None
+        self._lock_file = None
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, shard, suffix):
+        return os.path.join(self.directory, f"{shard}{suffix}")
+
+    def claim(self, shards):
+        """Lock the first free shard slot, returning its name or None if all are taken"""
+        for shard in shards:
+            lock_file = open(self._path(shard, '.lock'), 'a')
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lock_file.close()
+                continue
+            self._lock_file = lock_file
+            return shard
+        return None
+
+    def send(self, shard, payload):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(self.timeout)
+            sock.connect(self._path(shard, '.sock'))
+            sock.sendall(json.dumps(payload).encode('utf-8') + b'\n')
+            if sock.makefile('rb').readline().strip() != b'ok':
+                raise ConnectionError(f"Shard {shard} did not accept the message")
+
+    def serve(self, shard, handler):
+        """Accept messages for shard on a background thread"""
+        path = self._path(shard, '.sock')
+        if os.path.exists(path):
+            os.remove(path)  # Left by a worker that died; we hold the slot's lock now
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    handler(json.loads(line))
+                    self.wfile.write(b'ok\n')
+
+        self._server = socketserver.ThreadingUnixStreamServer(path, Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name=f"shard-{shard}", daemon=True).start()
+
+    def close(self):
+        """Stop serving and release the slot for a replacement worker"""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+
+class HttpTransport:
+    """Delivers messages to shards running as separate app instances"""
+
+    def __init__(self, peers, self_name, secret, timeout=2, session=None):
+        """peers maps shard name -> base URL; messages carry secret in X-Shard-Secret"""
+        self.peers = peers
+        self.self_name = self_name
+        self.secret = secret
+        self.timeout = timeout
+        self.session = session or requests.Session()
+
+    def claim(self, shards):
+        return self.self_name if self.self_name in shards else None
+
+    def send(self, shard, payload):
+        response = self.session.post(
+            f"{self.peers[shard].rstrip('/')}/internal/shard",
+            json=payload,
+            headers={'X-Shard-Secret': self.secret},
+            timeout=self.timeout
+        )
+        response.raise_for_status()
+
+    def serve(self, shard, handler):
+        pass  # Messages arrive through the app's /internal/shard endpoint
+
+    def close(self):
+        pass
+
+
+class ShardRouter:
+    """Handles messages for conversations this process owns and forwards the rest"""
+
+    def __init__(self, shards, transport, handler, claim_interval=5):
+        """handler(payload) processes a message locally"""
+        self.shards = list(shards)
+        self.ring = HashRing(self.shards)
+        self.transport = transport
+        self.handler = handler
+        self.claim_interval = claim_interval
+        self.shard = None
+        self.closed = False
+        self._lock = threading.Lock()
+        self.stats = {'local': 0, 'forwarded': 0, 'received': 0, 'fallbacks': 0}
+
+    def start(self):
+        """Claim a shard slot, retrying in the background while all slots are taken"""
+        if self._try_claim():
+            return
+
+        def retry():
+            while not self.closed and not self._try_claim():
+                time.sleep(self.claim_interval)
+
+        threading.Thread(target=retry, name='shard-claim', daemon=True).start()
+
+    def _try_claim(self):
+        shard = self.transport.claim(self.shards)
+        if shard is None:
+            return False
+        self.transport.serve(shard, self.receive)
+        self.shard = shard
+        print(f"🧩 Serving conversation shard {shard} of {len(self.shards)}")
+        return True
+
+    def _count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def owner(self, key):
+        return self.ring.lookup(key)
+
+    def dispatch(self, key, payload):
+        """Process payload here if this shard owns key, otherwise forward it to the owner"""
+        owner = self.ring.lookup(key)
+        if owner != self.shard and not self.closed:
+            try:
+                self.transport.send(owner, payload)
+                self._count('forwarded')
+                return
+            except Exception as e:
+                self._count('fallbacks')
+                print(f"⚠️  Shard {owner} unreachable ({e}), handling {key} locally")
+        self._count('local')
+        self.handler(payload)
+
+    def receive(self, payload):
+        """Process a message forwarded by another shard"""
+        self._count('received')
+        self.handler(payload)
+
+    def close(self):
+        """Stop receiving; messages that arrive from now on are handled locally"""
+        self.closed = True
+        self.transport.close()
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'shard': self.shard,
+                'shards': len(self.shards),
+                **self.stats,
+            }
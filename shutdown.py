@@ -0,0 +1,176 @@
+"""
+Graceful shutdown for WhatsApp ChatBot
+
+On SIGTERM (systemctl stop/restart, or gunicorn retiring a worker on reload)
+the coordinator stops taking new reply work, lets in-flight replies finish
+until a deadline, then cancels what is left and writes every unanswered
+message to a journal file. Workers that start later pick journals up one at a
+time and feed them through the rate-limited deferred queues, so a restart
+neither loses replies nor replays them all at once.
+"""
+
+import os
+import json
+import time
+import itertools
+import threading
+
+
+JOURNAL_PREFIX = 'pending-'
+JOURNAL_SUFFIX = '.jsonl'
+
+
+class ShutdownCoordinator:
+    """Drains, persists and flushes in-process work in a fixed order"""
+
+    def __init__(self, deadline, journal_directory, recovery_interval=30):
+        self.deadline = deadline
+        self.journal_directory = journal_directory
+        self.recovery_interval = recovery_interval
+        self.draining = False
+        self.persisted = 0
+        self.recovered = 0
+        self._lock = threading.Lock()
+        self._done = False
+        self._stop_accepting = []
+        self._pools = []
+        self._sources = {}
+        self._restorers = {}
+        self._flushers = []
+        self._journal_sequence = itertools.count()
+        os.makedirs(journal_directory, exist_ok=True)
+
+    def on_drain(self, callback):
+        """callback() stops new work from being scheduled"""
+        self._stop_accepting.append(callback)
+
+    def wait_for(self, pool):
+        """Wait for pool.pending to reach zero before persisting"""
+        self._pools.append(pool)
+
+    def persist(self, queue, collect, restore):
+        """collect() returns the unfinished jobs of queue; restore(job) requeues one after restart"""
+        self._sources[queue] = collect
+        self._restorers[queue] = restore
+
+    def on_flush(self, name, callback):
+        """callback() runs last, once all jobs are persisted"""
+        self._flushers.append((name, callback))
+
+    def _busy(self):
+        return sum(pool.pending for pool in self._pools)
+
+    def shutdown(self, reason='shutdown'):
+        """Drain and persist all work; safe to call more than once"""
+        with self._lock:
+            if self._done:
+                return
+            self._done = True
+            self.draining = True
+
+        started = time.monotonic()
+        print(f"🛑 Draining for {reason}: waiting up to {self.deadline}s for {self._busy()} job(s)")
+        for callback in self._stop_accepting:
+            callback()
+
+        while self._busy() and time.monotonic() - started < self.deadline:
+            time.sleep(0.2)
+
+        jobs = []
+        for queue, collect in self._sources.items():
+            try:
+                jobs.extend(dict(job, queue=queue) for job in collect())
+            except Exception as e:
+                print(f"❌ Could not collect {queue} jobs: {e}")
+        if jobs:
+            self._write_journal(jobs)
+
+        for name, callback in self._flushers:
+            try:
+                callback()
+            except Exception as e:
+                print(f"⚠️  Could not flush {name}: {e}")
+
+        print(f"🛑 Shutdown complete in {time.monotonic() - started:.1f}s, {len(jobs)} job(s) persisted")
+
+    def _write_journal(self, jobs, returned=False):
+        """Write jobs to a new journal; returned jobs came from a journal that could not be fully requeued"""
+        name = f"{JOURNAL_PREFIX}{int(time.time())}-{os.getpid()}-{next(self._journal_sequence)}{JOURNAL_SUFFIX}"
+        path = os.path.join(self.journal_directory, name)
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(''.join(json.dumps(job, ensure_ascii=False) + '\n' for job in jobs))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+        if returned:
+            print(f"💾 Returned {len(jobs)} job(s) that could not be requeued to {path}")
+        else:
+            self.persisted += len(jobs)
+            print(f"💾 Persisted {len(jobs)} unfinished job(s) to {path}")
+
+    def recover_one(self):
+        """Claim one journal left by a stopped worker and requeue its jobs
+
+        The rename makes the claim atomic, so concurrent workers never
+        replay the same journal. Jobs the deferred queues refuse (they are
+        full) are written back to a new journal for a later poll. Returns
+        the number of jobs requeued.
+        """
+        for filename in sorted(os.listdir(self.journal_directory)):
+            if not (filename.startswith(JOURNAL_PREFIX) and filename.endswith(JOURNAL_SUFFIX)):
+                continue
+            path = os.path.join(self.journal_directory, filename)
+            claimed = f"{path}.{os.getpid()}.replaying"
+            try:
+                os.rename(path, claimed)
+            except FileNotFoundError:
+                continue
+
+            count = 0
+            unrestored = []
+            with open(claimed, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    job = json.loads(line)
+                    restore = self._restorers.get(job.get('queue'))
+                    if restore is not None and restore({key: value for key, value in job.items() if key != 'queue'}):
+                        count += 1
+                    else:
+                        unrestored.append(job)
+            if unrestored:
+                self._write_journal(unrestored, returned=True)
+            os.remove(claimed)
+            self.recovered += count
+            print(f"♻️  Requeued {count} job(s) from {filename}")
+            return count
+        return 0
+
+    def start_recovery(self):
+        """Poll for journals in the background
+
+        Only serving workers may call this (gunicorn's post_worker_init, or
+        app.py run directly): a process that claims a journal must be able to
+        answer its jobs. Journals of workers retired by a gunicorn reload are
+        written after the new workers have started, so they are picked up on a
+        later poll.
+        """
+        def run():
+            while not self.draining:
+                try:
+                    self.recover_one()
+                except Exception as e:
+                    print(f"❌ Error recovering persisted jobs: {e}")
+                time.sleep(self.recovery_interval)
+
+        threading.Thread(target=run, name='journal-recovery', daemon=True).start()
+
+    def get_stats(self):
+        return {
+            'draining': self.draining,
+            'deadline_seconds': self.deadline,
+            'busy_jobs': self._busy(),
+            'persisted': self.persisted,
+            'recovered': self.recovered,
+        }
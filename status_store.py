@@ -0,0 +1,198 @@
+"""
+Delivery status store for WhatsApp ChatBot
+
+Keeps the sent/delivered/read/failed callbacks of outbound messages in a
+fixed-capacity ring of packed arrays keyed by wamid, so memory stays flat no
+matter how many status callbacks arrive. Delivery and read latencies are
+aggregated as they are recorded.
+"""
+
+import threading
+from array import array
+
+
+STATUS_NAMES = ('unknown', 'sent', 'delivered', 'read', 'failed')
+STATUS_CODES = {name: code for code, name in enumerate(STATUS_NAMES)}
+
+# Upper bounds (seconds) of the latency histogram buckets; the last bucket is open-ended
+LATENCY_BUCKETS = (0.5, 1, 2, 5, 10, 30, 60, 300, 900, 3600)
+
+
+class LatencyStats:
+    """Count, sum, max and a bucketed histogram of latencies"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = array('L', [0] * (len(LATENCY_BUCKETS) + 1))
+
+    def add(self, seconds):
+        if seconds < 0:
+            return
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.buckets[index] += 1
+                return
+        self.buckets[-1] += 1
+
+    def merge(self, other):
+        """Fold another LatencyStats into this one"""
+        self.count += other.count
+        self.total += other.total
+        if other.max > self.max:
+            self.max = other.max
+        for index, bucket_count in enumerate(other.buckets):
+            self.buckets[index] += bucket_count
+
+    def percentile(self, fraction):
+        """Upper bound of the bucket holding the given percentile"""
+        if not self.count:
+            return None
+        target = fraction * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.buckets):
+            seen += bucket_count
+            if seen >= target:
+                return LATENCY_BUCKETS[index] if index < len(LATENCY_BUCKETS) else self.max
+        return self.max
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'avg_seconds': round(self.total / self.count, 3) if self.count else None,
+            'max_seconds': round(self.max, 3) if self.count else None,
+            'p50_seconds': self.percentile(0.5),
+            'p95_seconds': self.percentile(0.95),
+        }
+
+
+class StatusStore:
+    """Ring buffer of message delivery states keyed by wamid"""
+
+    def __init__(self, capacity=100000):
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._index = {}
+        self._wamids = [None] * capacity
+        self._recipients = [None] * capacity
+        self._status = bytearray(capacity)
+        self._seen = bytearray(capacity)  # Bitmask of status codes already recorded
+        self._sent_at = array('d', [0.0]) * capacity
+        self._delivered_at = array('d', [0.0]) * capacity
+        self._read_at = array('d', [0.0]) * capacity
+        self._failed_at = array('d', [0.0]) * capacity
+        self._error_code = array('l', [0]) * capacity
+        self._next = 0
+        self.callbacks = 0
+        self.counts = {name: 0 for name in STATUS_NAMES}
+        self.delivery_latency = LatencyStats()
+        self.read_latency = LatencyStats()
+
+    def _slot(self, wamid):
+        slot = self._index.get(wamid)
+        if slot is not None:
+            return slot
+
+        # Claim the oldest slot, evicting whatever message held it
+        slot = self._next
+        self._next = (slot + 1) % self.capacity
+        evicted = self._wamids[slot]
+        if evicted is not None:
+            del self._index[evicted]
+        self._index[wamid] = slot
+        self._wamids[slot] = wamid
+        self._recipients[slot] = None
+        self._status[slot] = 0
+        self._seen[slot] = 0
+        self._sent_at[slot] = 0.0
+        self._delivered_at[slot] = 0.0
+        self._read_at[slot] = 0.0
+        self._failed_at[slot] = 0.0
+        self._error_code[slot] = 0
+        return slot
+
+    def record_all(self, statuses):
+        """Record the 'statuses' list of a webhook change value"""
+        with self._lock:
+            for status in statuses:
+                self._record(status)
+
+    def _record(self, status):
+        code = STATUS_CODES.get(status.get('status'))
+        wamid = status.get('id')
+        if code is None or not wamid:
+            return
+
+        self.callbacks += 1
+        slot = self._slot(wamid)
+
+        # Meta retries callbacks; only the first of each status counts
+        if self._seen[slot] & (1 << code):
+            return
+        self._seen[slot] |= 1 << code
+        self.counts[STATUS_NAMES[code]] += 1
+        timestamp = float(status.get('timestamp') or 0)
+        if status.get('recipient_id'):
+            self._recipients[slot] = status['recipient_id']
+
+        # Latencies are recorded when the second timestamp of a pair arrives,
+        # whichever order the callbacks come in
+        if code == STATUS_CODES['sent']:
+            self._sent_at[slot] = timestamp
+            if self._delivered_at[slot]:
+                self.delivery_latency.add(self._delivered_at[slot] - timestamp)
+        elif code == STATUS_CODES['delivered']:
+            self._delivered_at[slot] = timestamp
+            if self._sent_at[slot]:
+                self.delivery_latency.add(timestamp - self._sent_at[slot])
+            if self._read_at[slot]:
+                self.read_latency.add(self._read_at[slot] - timestamp)
+        elif code == STATUS_CODES['read']:
+            self._read_at[slot] = timestamp
+            if self._delivered_at[slot]:
+                self.read_latency.add(timestamp - self._delivered_at[slot])
+        elif code == STATUS_CODES['failed']:
+            self._failed_at[slot] = timestamp
+            errors = status.get('errors') or [{}]
+            self._error_code[slot] = int(errors[0].get('code') or 0)
+
+        # Callbacks can arrive out of order; keep the furthest state, but failed always wins
+        if code == STATUS_CODES['failed'] or (self._status[slot] != STATUS_CODES['failed'] and code > self._status[slot]):
+            self._status[slot] = code
+
+    def get(self, wamid):
+        """Return the delivery record of a message, or None if it is not stored"""
+        with self._lock:
+            slot = self._index.get(wamid)
+            if slot is None:
+                return None
+
+            def timestamp(values):
+                return values[slot] or None
+
+            return {
+                'wamid': wamid,
+                'recipient_id': self._recipients[slot],
+                'status': STATUS_NAMES[self._status[slot]],
+                'sent_at': timestamp(self._sent_at),
+                'delivered_at': timestamp(self._delivered_at),
+                'read_at': timestamp(self._read_at),
+                'failed_at': timestamp(self._failed_at),
+                'error_code': self._error_code[slot] or None,
+            }
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'tracked_messages': len(self._index),
+                'capacity': self.capacity,
+                'callbacks': self.callbacks,
+                'callbacks_by_status': {name: count for name, count in self.counts.items() if name != 'unknown'},
+                'sent_to_delivered': self.delivery_latency.to_dict(),
+                'delivered_to_read': self.read_latency.to_dict(),
+            }
@@ -0,0 +1,216 @@
+"""
+Multi-tenant routing for WhatsApp ChatBot
+
+One deployment can serve several WhatsApp business numbers. Each tenant has
+its own Graph API token, assistant, chat directory, rate limits and intent
+rules, while the
+worker pool, circuit breakers and HTTP connection pools are shared.
+
+Tenants are listed in a JSON file (TENANTS_FILE):
+
+    {
+      "tenants": [
+        {
+          "name": "brand-a",
+          "phone_number_id": "123456789012345",
+          "whatsapp_token": "${BRAND_A_WHATSAPP_TOKEN}",
+          "assistant_id": "asst_...",
+          "rate_limit_messages": 20
+        }
+      ]
+    }
+
+``${VAR}`` references are expanded from the environment, so tokens can stay
+in .env; an unset variable is an error rather than a literal token. Inbound messages are routed on the ``metadata.phone_number_id`` of
+the webhook payload. The number configured in .env is always available as
+the ``default`` tenant.
+"""
+
+import os
+import re
+import json
+import time
+import threading
+
+
+# Tenants file key -> Config attribute it overrides
+TENANT_SETTINGS = {
+    'assistant_id': 'OPENAI_ASSISTANT_ID',
+    'model': 'OPENAI_MODEL',
+    'system_prompt': 'OPENAI_SYSTEM_PROMPT',
+    'response_engine': 'RESPONSE_ENGINE',
+    'chat_directory': 'CHAT_DIRECTORY',
+    'search_index_path': 'SEARCH_INDEX_PATH',
+    'degraded_reply': 'DEGRADED_REPLY',
+    'app_secret': 'WHATSAPP_APP_SECRET',
+    'rate_limit_enabled': 'RATE_LIMIT_ENABLED',
+    'rate_limit_messages': 'RATE_LIMIT_MESSAGES',
+    'rate_limit_window': 'RATE_LIMIT_WINDOW',
+    'intent_rules_file': 'INTENT_RULES_FILE',
+}
+
+DEFAULT_TENANT = 'default'
+
+
+class RateLimiter:
+    """Fixed-window limit on messages per phone number"""
+
+    def __init__(self, max_messages, window):
+        self.max_messages = max_messages
+        self.window = window
+        self.limited = 0
+        self._lock = threading.Lock()
+        self._windows = {}  # phone_number -> (window start, count)
+        self._last_prune = time.monotonic()
+
+    def allow(self, phone_number):
+        """Count a message, returning False if the phone is over its limit"""
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_prune > self.window:
+                self._windows = {
+                    phone: entry for phone, entry in self._windows.items()
+                    if now - entry[0] < self.window
+                }
+                self._last_prune = now
+
+            started, count = self._windows.get(phone_number, (now, 0))
+            if now - started >= self.window:
+                started, count = now, 0
+            if count >= self.max_messages:
+                self.limited += 1
+                return False
+            self._windows[phone_number] = (started, count + 1)
+            return True
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'max_messages': self.max_messages,
+                'window_seconds': self.window,
+                'tracked_phones': len(self._windows),
+                'limited': self.limited,
+            }
+
+
+class Tenant:
+    """One WhatsApp business number and the settings used to answer it"""
+
+    def __init__(self, name, phone_number_id, whatsapp_token, config):
+        self.name = name
+        self.phone_number_id = phone_number_id
+        self.whatsapp_token = whatsapp_token
+        self.config = config
+        self.rate_limiter = None
+        if config.RATE_LIMIT_ENABLED:
+            self.rate_limiter = RateLimiter(config.RATE_LIMIT_MESSAGES, config.RATE_LIMIT_WINDOW)
+        self.chat_manager = None  # Created by the app once the OpenAI client exists
+        self.intent_router = None
+
+    @property
+    def api_url(self):
+        return f"https://graph.facebook.com/v18.0/{self.phone_number_id}/messages"
+
+    def allow_message(self, phone_number):
+        return self.rate_limiter is None or self.rate_limiter.allow(phone_number)
+
+    def get_stats(self):
+        return {
+            'phone_number_id': self.phone_number_id,
+            'assistant_id': self.config.OPENAI_ASSISTANT_ID,
+            'chat_directory': self.config.CHAT_DIRECTORY,
+            'rate_limit': self.rate_limiter.get_stats() if self.rate_limiter else None,
+            'intents': self.intent_router.get_stats() if self.intent_router else None,
+        }
+
+
+def tenant_config(base, name, settings):
+    """Config subclass with a tenant's overrides, so engines keep reading config.X"""
+    overrides = {
+        attribute: settings[key]
+        for key, attribute in TENANT_SETTINGS.items()
+        if key in settings
+    }
+    overrides.setdefault('CHAT_DIRECTORY', os.path.join(base.CHAT_DIRECTORY, name))
+    overrides.setdefault('SEARCH_INDEX_PATH', os.path.join(overrides['CHAT_DIRECTORY'], 'search.db'))
+    return type(f"{name}Config", (base,), overrides)
+
+
+# $NAME or ${NAME} in a tenants file value
+ENV_REFERENCE = re.compile(r'\$(?:\{([A-Za-z_]\w*)\}|([A-Za-z_]\w*))')
+
+
+def expand(value, where):
+    """Expand environment references in a tenants file value, raising if one is not set"""
+    if not isinstance(value, str):
+        return value
+    missing = [braced or bare for braced, bare in ENV_REFERENCE.findall(value) if (braced or bare) not in os.environ]
+    if missing:
+        raise ValueError(f"{where} refers to unset environment variable(s): {', '.join(missing)}")
+    return os.path.expandvars(value)
+
+
+class TenantRegistry:
+    """Looks up tenants by name or by the phone_number_id of an inbound webhook"""
+
+    def __init__(self, default, tenants=(), strict=False):
+        """strict: drop messages for unknown phone_number_ids instead of using the default tenant"""
+        self.default = default
+        self.strict = strict
+        self._by_name = {default.name: default}
+        self._by_phone_number_id = {}
+        for tenant in (default,) + tuple(tenants):
+            self._by_name[tenant.name] = tenant
+            if tenant.phone_number_id:
+                self._by_phone_number_id[tenant.phone_number_id] = tenant
+
+    @classmethod
+    def load(cls, config, default_token, default_phone_number_id):
+        """Build the default tenant from .env plus any tenants in config.TENANTS_FILE"""
+        default = Tenant(DEFAULT_TENANT, default_phone_number_id, default_token, config)
+        path = config.TENANTS_FILE
+        if not path or not os.path.exists(path):
+            return cls(default)
+
+        with open(path, 'r', encoding='utf-8') as f:
+            entries = json.load(f).get('tenants', [])
+
+        tenants = []
+        names = {DEFAULT_TENANT}
+        phone_number_ids = {str(default_phone_number_id)} if default_phone_number_id else set()
+        for entry in entries:
+            entry = {key: expand(value, f"{path}: {entry.get('name')!r} {key}") for key, value in entry.items()}
+            name = entry.get('name')
+            if not name or name in names or not entry.get('phone_number_id'):
+                raise ValueError(f"Tenant entries in {path} need a unique name and a phone_number_id: {entry.get('name')!r}")
+            if str(entry['phone_number_id']) in phone_number_ids:
+                raise ValueError(f"Tenant {name!r} in {path} reuses phone_number_id {entry['phone_number_id']}")
+            names.add(name)
+            phone_number_ids.add(str(entry['phone_number_id']))
+            tenants.append(Tenant(
+                name,
+                str(entry['phone_number_id']),
+                entry.get('whatsapp_token') or default_token,
+                tenant_config(config, name, entry)
+            ))
+        print(f"✅ Loaded {len(tenants)} tenant(s) from {path}: {', '.join(t.name for t in tenants)}")
+        return cls(default, tenants, strict=True)
+
+    def __iter__(self):
+        return iter(self._by_name.values())
+
+    def __len__(self):
+        return len(self._by_name)
+
+    def get(self, name=None):
+        """Tenant by name (None means the default tenant), or None if unknown"""
+        if name is None:
+            return self.default
+        return self._by_name.get(name)
+
+    def resolve(self, phone_number_id):
+        """Tenant that owns a business phone number, or None if it is not ours"""
+        tenant = self._by_phone_number_id.get(phone_number_id)
+        if tenant is None and (not self.strict or not phone_number_id):
+            return self.default
+        return tenant
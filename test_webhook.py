@@ -7,6 +7,8 @@ This script helps test the webhook functionality locally
 import requests
 import json
 import time
+import hmac
+import hashlib
 import os
 from datetime import datetime
 from dotenv import load_dotenv
@@ -20,6 +22,7 @@ print(f"📁 .env file loaded: {env_loaded}")
 # Test configuration
 WEBHOOK_URL = os.getenv('WEBHOOK_URL', 'http://hexawhite.quantumautomata.in:5000/webhook')
 VERIFY_TOKEN = os.getenv('VERIFY_TOKEN', 'your_webhook_verify_token_here')
+WHATSAPP_APP_SECRET = os.getenv('WHATSAPP_APP_SECRET')
 
 # Debug: Show what configuration is being used
 print(f"🌐 Testing webhook URL: {WEBHOOK_URL}")
@@ -98,11 +101,18 @@ def test_message_webhook():
         ]
     }
     
+    body = json.dumps(test_payload).encode('utf-8')
+    headers = {'Content-Type': 'application/json'}
+    if WHATSAPP_APP_SECRET:
+        # Sign the payload the same way Meta does
+        signature = hmac.new(WHATSAPP_APP_SECRET.encode('utf-8'), body, hashlib.sha256).hexdigest()
+        headers['X-Hub-Signature-256'] = f"sha256={signature}"
+    
     try:
         response = requests.post(
             WEBHOOK_URL,
-            json=test_payload,
-            headers={'Content-Type': 'application/json'}
+            data=body,
+            headers=headers
         )
         
         if response.status_code == 200:
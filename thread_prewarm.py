@@ -0,0 +1,137 @@
+"""
+Pre-warmed OpenAI threads for WhatsApp ChatBot
+
+A new customer's first reply would otherwise wait for threads.create before
+their message can even be added. The prewarmer keeps a few empty threads
+ready so a new conversation claims one without a network call.
+
+The pool is refilled in the background and sized by the recent rate of new
+conversations. Threads that sit unused for too long, or exceed the current
+target, are deleted so idle workers do not accumulate them.
+"""
+
+import math
+import time
+import threading
+from collections import deque
+
+
+class ThreadPrewarmer:
+    """Background-refilled pool of empty Assistants API threads"""
+
+    def __init__(self, client, breaker, min_size=1, max_size=20, horizon=120, rate_window=900,
+                 max_age=3600, interval=5, request_timeout=30):
+        """Keeps enough threads for `horizon` seconds of new conversations at the rate seen over `rate_window`"""
+        self.client = client
+        self.breaker = breaker
+        self.min_size = min_size
+        self.max_size = max_size
+        self.horizon = horizon
+        self.rate_window = rate_window
+        self.max_age = max_age
+        self.interval = interval
+        self.request_timeout = request_timeout
+        self._lock = threading.Lock()
+        self._ready = deque()  # (thread_id, created_at monotonic)
+        self._demand = deque()  # monotonic times of new conversations
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.stats = {'hits': 0, 'misses': 0, 'created': 0, 'deleted': 0, 'errors': 0}
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='thread-prewarm', daemon=True)
+        self._thread.start()
+
+    def claim(self):
+        """Take a ready thread ID for a new conversation, or None if the pool is empty"""
+        now = time.monotonic()
+        with self._lock:
+            self._demand.append(now)
+            if self._ready:
+                self.stats['hits'] += 1
+                return self._ready.popleft()[0]
+            self.stats['misses'] += 1
+        return None
+
+    def target_size(self):
+        """Threads to keep ready, from the new-conversation rate over rate_window"""
+        cutoff = time.monotonic() - self.rate_window
+        with self._lock:
+            while self._demand and self._demand[0] < cutoff:
+                self._demand.popleft()
+            rate = len(self._demand) / self.rate_window
+        return max(self.min_size, min(self.max_size, math.ceil(rate * self.horizon)))
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self._refill()
+            except Exception as e:
+                with self._lock:
+                    self.stats['errors'] += 1
+                print(f"⚠️  Could not pre-warm OpenAI threads: {e}")
+
+    def _refill(self):
+        target = self.target_size()
+
+        # Drop threads that waited too long or that the current demand no longer needs
+        expired = []
+        cutoff = time.monotonic() - self.max_age
+        with self._lock:
+            while self._ready and (self._ready[0][1] < cutoff or len(self._ready) > target):
+                expired.append(self._ready.popleft()[0])
+        for thread_id in expired:
+            self._delete(thread_id)
+
+        while not self._stop_event.is_set():
+            with self._lock:
+                if len(self._ready) >= target:
+                    return
+            if not self.breaker.allow():
+                return  # Replies need OpenAI more than the pool does
+            try:
+                thread = self.client.beta.threads.create(timeout=self.request_timeout)
+            except Exception as e:
+                self.breaker.record_failure(e)
+                raise
+            self.breaker.record_success()
+            with self._lock:
+                self._ready.append((thread.id, time.monotonic()))
+                self.stats['created'] += 1
+
+    def _delete(self, thread_id, timeout=None):
+        try:
+            self.client.beta.threads.delete(thread_id, timeout=timeout or self.request_timeout)
+            with self._lock:
+                self.stats['deleted'] += 1
+        except Exception as e:
+            print(f"⚠️  Could not delete unused thread {thread_id}: {e}")
+
+    def stop(self, timeout=5):
+        """Stop refilling and delete the threads nobody claimed, within timeout seconds in total
+
+        The bound keeps a retiring worker inside gunicorn's graceful_timeout;
+        threads still undeleted when it runs out are left to OpenAI.
+        """
+        deadline = time.monotonic() + timeout
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+        with self._lock:
+            unused = [thread_id for thread_id, _ in self._ready]
+            self._ready.clear()
+        for index, thread_id in enumerate(unused):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0.1:
+                print(f"⚠️  Out of time, leaving {len(unused) - index} unused OpenAI thread(s) undeleted")
+                return
+            self._delete(thread_id, timeout=min(self.request_timeout, remaining))
+
+    def get_stats(self):
+        target = self.target_size()
+        with self._lock:
+            return {
+                'ready': len(self._ready),
+                'target': target,
+                **self.stats,
+            }
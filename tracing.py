@@ -0,0 +1,222 @@
+"""
+Latency tracing for WhatsApp ChatBot
+
+Lightweight spans following the OpenTelemetry data model (trace/span IDs,
+parent links, start/end times in Unix nanoseconds, attributes, status),
+exported as one JSON object per line to a local file.
+
+Every inbound message starts a trace whose ID is derived from its wamid, so
+the trace for a customer complaint can be found from the message ID alone.
+Traces are sampled: unsampled messages get a shared no-op span, so tracing
+costs next to nothing for them.
+"""
+
+import os
+import json
+import time
+import random
+import hashlib
+import threading
+import contextvars
+from collections import deque
+
+
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+
+class NoopSpan:
+    """Stand-in for spans of unsampled traces"""
+
+    sampled = False
+    trace_id = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set_attribute(self, key, value):
+        pass
+
+    def end(self):
+        pass
+
+
+NOOP_SPAN = NoopSpan()
+
+
+class Span:
+    """A timed operation within a trace"""
+
+    sampled = True
+
+    def __init__(self, tracer, name, trace_id, parent=None, attributes=None):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_span_id = parent.span_id if parent is not None else None
+        self.attributes = dict(attributes) if attributes else {}
+        self.start_time = time.time_ns()
+        self.end_time = None
+        self.status = 'UNSET'
+        self.status_message = None
+        self._token = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def __enter__(self):
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None:
+            self.status = 'ERROR'
+            self.status_message = f"{exc_type.__name__}: {exc}"
+        elif self.status == 'UNSET':
+            self.status = 'OK'
+        _current_span.reset(self._token)
+        self.end()
+        return False
+
+    def end(self):
+        if self.end_time is None:
+            self.end_time = time.time_ns()
+            self.tracer.exporter.export(self)
+
+    def to_dict(self):
+        return {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'parentSpanId': self.parent_span_id,
+            'name': self.name,
+            'startTimeUnixNano': self.start_time,
+            'endTimeUnixNano': self.end_time,
+            'durationMs': round((self.end_time - self.start_time) / 1e6, 3),
+            'attributes': self.attributes,
+            'status': {'code': self.status, 'message': self.status_message},
+            'resource': self.tracer.resource,
+        }
+
+
+class FileSpanExporter:
+    """Buffers finished spans and appends them to a JSONL file from a background thread"""
+
+    def __init__(self, path, max_buffer=10000, flush_interval=2):
+        self.path = path
+        self.max_buffer = max_buffer
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self.exported = 0
+        self._buffer = deque()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name='span-exporter', daemon=True)
+        self._thread.start()
+
+    def export(self, span):
+        with self._lock:
+            if len(self._buffer) >= self.max_buffer:
+                self.dropped += 1
+                return
+            self._buffer.append(span)
+
+    def flush(self):
+        """Write all buffered spans to the file"""
+        with self._flush_lock:
+            with self._lock:
+                spans = list(self._buffer)
+                self._buffer.clear()
+            if not spans:
+                return
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(''.join(json.dumps(span.to_dict(), default=str) + '\n' for span in spans))
+            self.exported += len(spans)
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"⚠️  Could not export spans: {e}")
+
+
+class NullExporter:
+    """Discards spans (tracing disabled)"""
+
+    dropped = 0
+    exported = 0
+
+    def export(self, span):
+        pass
+
+    def flush(self):
+        pass
+
+
+class Tracer:
+    """Creates sampled traces and child spans"""
+
+    def __init__(self):
+        self.enabled = False
+        self.sample_rate = 0.0
+        self.exporter = NullExporter()
+        self.resource = {'service.name': 'whatsapp-chatbot'}
+        self.traces_started = 0
+        self.traces_sampled = 0
+
+    def configure(self, enabled, sample_rate, export_path, service_name='whatsapp-chatbot'):
+        """Enable or disable tracing; spans are written to export_path"""
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.resource = {'service.name': service_name, 'process.pid': os.getpid()}
+        if enabled:
+            self.exporter = FileSpanExporter(export_path)
+            print(f"✅ Tracing enabled: sampling {sample_rate:.0%} of messages to {export_path}")
+
+    @staticmethod
+    def trace_id_for(key):
+        """Trace ID derived from a key such as a wamid"""
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]
+
+    def trace(self, name, key=None, **attributes):
+        """Start the root span of a new trace, sampled at sample_rate"""
+        if not self.enabled:
+            return NOOP_SPAN
+        self.traces_started += 1
+        if random.random() >= self.sample_rate:
+            return NOOP_SPAN
+        self.traces_sampled += 1
+        trace_id = self.trace_id_for(key) if key else os.urandom(16).hex()
+        return Span(self, name, trace_id, attributes=attributes)
+
+    def span(self, name, parent=None, **attributes):
+        """Start a child of parent (default: the current span); no-op outside a sampled trace"""
+        if parent is None:
+            parent = _current_span.get()
+        if parent is None or not parent.sampled:
+            return NOOP_SPAN
+        return Span(self, name, parent.trace_id, parent=parent, attributes=attributes)
+
+    def current(self):
+        """The active span of this thread, or a no-op span"""
+        return _current_span.get() or NOOP_SPAN
+
+    def get_stats(self):
+        return {
+            'enabled': self.enabled,
+            'sample_rate': self.sample_rate,
+            'traces_started': self.traces_started,
+            'traces_sampled': self.traces_sampled,
+            'spans_exported': self.exporter.exported,
+            'spans_dropped': self.exporter.dropped,
+        }
+
+
+tracer = Tracer()
@@ -0,0 +1,201 @@
+"""
+Token usage accounting for WhatsApp ChatBot
+
+Every run's token usage, duration and poll count is recorded in SQLite,
+keyed by tenant, phone number and assistant (the assistant ID, or the model
+for the chat completions engine). Raw runs are kept for USAGE_RETENTION_DAYS
+and are also added to hourly rollups, which are kept for
+USAGE_ROLLUP_RETENTION_DAYS.
+
+The rollups answer two questions:
+
+- Which conversations are heaviest? Prompt tokens grow with a conversation's
+  history and drive run latency, so these are the first to trim.
+- How much run time does an hour of traffic need? The summed run duration
+  per hour is the average number of runs in flight, which sizes
+  WORKER_THREADS.
+
+Costs are estimated from USAGE_PRICES, e.g. ``gpt-4o-mini=0.15:0.60``
+(USD per million prompt:completion tokens, comma separated per model).
+"""
+
+import os
+import time
+import sqlite3
+import threading
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    ts INTEGER NOT NULL,
+    tenant TEXT,
+    phone_number TEXT NOT NULL,
+    assistant TEXT,
+    model TEXT,
+    status TEXT,
+    prompt_tokens INTEGER NOT NULL,
+    completion_tokens INTEGER NOT NULL,
+    duration_ms INTEGER NOT NULL,
+    polls INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_ts ON runs(ts);
+CREATE TABLE IF NOT EXISTS hourly (
+    hour INTEGER NOT NULL,
+    tenant TEXT NOT NULL,
+    phone_number TEXT NOT NULL,
+    assistant TEXT NOT NULL,
+    model TEXT NOT NULL,
+    runs INTEGER NOT NULL,
+    prompt_tokens INTEGER NOT NULL,
+    completion_tokens INTEGER NOT NULL,
+    max_prompt_tokens INTEGER NOT NULL,
+    duration_ms INTEGER NOT NULL,
+    polls INTEGER NOT NULL,
+    PRIMARY KEY (hour, tenant, phone_number, assistant, model)
+) WITHOUT ROWID;
+"""
+
+HOUR = 3600
+
+
+def parse_prices(value):
+    """'model=prompt:completion,...' (USD per million tokens) -> {model: (prompt, completion)}"""
+    prices = {}
+    for item in (value or '').split(','):
+        if '=' not in item:
+            continue
+        model, rates = item.split('=', 1)
+        prompt, _, completion = rates.partition(':')
+        prices[model.strip()] = (float(prompt), float(completion or prompt))
+    return prices
+
+
+class UsageStore:
+    """SQLite time series of per-run token usage with hourly rollups"""
+
+    def __init__(self, path, retention_days=7, rollup_retention_days=90, prices=None):
+        self.path = path
+        self.retention = retention_days * 86400
+        self.rollup_retention = rollup_retention_days * 86400
+        self.prices = prices or {}
+        self._lock = threading.Lock()
+        self._next_prune = 0
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(SCHEMA)
+
+    def record(self, phone_number, tenant=None, assistant=None, model=None, status=None,
+               prompt_tokens=0, completion_tokens=0, duration=0.0, polls=0):
+        """Store one run (duration in seconds) and add it to its hourly rollup"""
+        now = int(time.time())
+        duration_ms = int(duration * 1000)
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT INTO runs (ts, tenant, phone_number, assistant, model, status, prompt_tokens,'
+                ' completion_tokens, duration_ms, polls) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (now, tenant, phone_number, assistant, model, status, prompt_tokens, completion_tokens, duration_ms, polls)
+            )
+            self._conn.execute(
+                'INSERT INTO hourly VALUES (?, ?, ?, ?, ?, 1, ?, ?, ?, ?, ?)'
+                ' ON CONFLICT (hour, tenant, phone_number, assistant, model) DO UPDATE SET'
+                ' runs = runs + 1,'
+                ' prompt_tokens = prompt_tokens + excluded.prompt_tokens,'
+                ' completion_tokens = completion_tokens + excluded.completion_tokens,'
+                ' max_prompt_tokens = MAX(max_prompt_tokens, excluded.max_prompt_tokens),'
+                ' duration_ms = duration_ms + excluded.duration_ms,'
+                ' polls = polls + excluded.polls',
+                (now - now % HOUR, tenant or '', phone_number, assistant or '', model or '',
+                 prompt_tokens, completion_tokens, prompt_tokens, duration_ms, polls)
+            )
+            if now >= self._next_prune:
+                self._conn.execute('DELETE FROM runs WHERE ts < ?', (now - self.retention,))
+                self._conn.execute('DELETE FROM hourly WHERE hour < ?', (now - self.rollup_retention,))
+                self._next_prune = now + HOUR
+
+    def cost(self, model, prompt_tokens, completion_tokens):
+        """Estimated USD cost, or None if the model has no configured price"""
+        rates = self.prices.get(model)
+        if rates is None:
+            return None
+        return round((prompt_tokens * rates[0] + completion_tokens * rates[1]) / 1e6, 6)
+
+    @staticmethod
+    def _filters(hours, tenant):
+        conditions, params = ['hour >= ?'], [int(time.time()) // HOUR * HOUR - (hours - 1) * HOUR]
+        if tenant:
+            conditions.append('tenant = ?')
+            params.append(tenant)
+        return ' AND '.join(conditions), params
+
+    def top_conversations(self, hours=24, limit=20, sort='prompt_tokens', tenant=None):
+        """Heaviest conversations over the last hours, by total prompt tokens (or another rollup column)"""
+        if sort not in ('prompt_tokens', 'completion_tokens', 'max_prompt_tokens', 'duration_ms', 'runs'):
+            raise ValueError(f"Cannot sort by {sort!r}")
+        where, params = self._filters(hours, tenant)
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT tenant, phone_number, assistant, model, SUM(runs) AS runs,'
+                ' SUM(prompt_tokens) AS prompt_tokens, SUM(completion_tokens) AS completion_tokens,'
+                ' MAX(max_prompt_tokens) AS max_prompt_tokens, SUM(duration_ms) AS duration_ms, SUM(polls) AS polls'
+                f' FROM hourly WHERE {where} GROUP BY tenant, phone_number, assistant, model'
+                f' ORDER BY {sort} DESC LIMIT ?',
+                params + [limit]
+            ).fetchall()
+        conversations = []
+        for row in rows:
+            runs = row['runs']
+            conversations.append({
+                'tenant': row['tenant'] or None,
+                'phone_number': row['phone_number'],
+                'assistant': row['assistant'] or None,
+                'model': row['model'] or None,
+                'runs': runs,
+                'prompt_tokens': row['prompt_tokens'],
+                'completion_tokens': row['completion_tokens'],
+                'avg_prompt_tokens': round(row['prompt_tokens'] / runs),
+                'max_prompt_tokens': row['max_prompt_tokens'],
+                'avg_duration_ms': round(row['duration_ms'] / runs),
+                'avg_polls': round(row['polls'] / runs, 1),
+                'estimated_cost_usd': self.cost(row['model'], row['prompt_tokens'], row['completion_tokens']),
+            })
+        return conversations
+
+    def hourly_totals(self, hours=24, tenant=None):
+        """Per-hour totals across conversations, oldest first"""
+        where, params = self._filters(hours, tenant)
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT hour, model, COUNT(DISTINCT phone_number) AS conversations, SUM(runs) AS runs,'
+                ' SUM(prompt_tokens) AS prompt_tokens, SUM(completion_tokens) AS completion_tokens,'
+                ' SUM(duration_ms) AS duration_ms'
+                f' FROM hourly WHERE {where} GROUP BY hour, model ORDER BY hour',
+                params
+            ).fetchall()
+
+        totals = {}
+        for row in rows:
+            bucket = totals.setdefault(row['hour'], {
+                'hour': time.strftime('%Y-%m-%d %H:00', time.localtime(row['hour'])),
+                'conversations': 0, 'runs': 0, 'prompt_tokens': 0, 'completion_tokens': 0,
+                'duration_ms': 0, 'estimated_cost_usd': 0.0,
+            })
+            for key in ('conversations', 'runs', 'prompt_tokens', 'completion_tokens', 'duration_ms'):
+                bucket[key] += row[key]
+            cost = self.cost(row['model'], row['prompt_tokens'], row['completion_tokens'])
+            if cost is None or bucket['estimated_cost_usd'] is None:
+                bucket['estimated_cost_usd'] = None
+            else:
+                bucket['estimated_cost_usd'] = round(bucket['estimated_cost_usd'] + cost, 6)
+
+        for bucket in totals.values():
+            runs = bucket['runs']
+            bucket['avg_prompt_tokens'] = round(bucket['prompt_tokens'] / runs) if runs else None
+            bucket['avg_duration_ms'] = round(bucket['duration_ms'] / runs) if runs else None
+            # Run time per hour of wall time: the average number of runs in flight
+            bucket['avg_runs_in_flight'] = round(bucket.pop('duration_ms') / 1000 / HOUR, 3)
+        return list(totals.values())